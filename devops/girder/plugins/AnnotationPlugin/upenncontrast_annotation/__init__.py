@@ -115,6 +115,10 @@ class UPennContrastAnnotationAPIPlugin(GirderPlugin):
         from .server.api.project import Project
         from .server.api.zenodo import Zenodo
         from .server.api.zenodo_credentials import ZenodoCredentials
+        from .server.helpers.access_helpers import datasetAccessCache
+
+        # Forget the cached dataset access grants when folders or users change
+        datasetAccessCache.bindEvents()
 
         ModelImporter.registerModel(
             "upenn_annotation", AnnotationModel, "upenncontrast_annotation"
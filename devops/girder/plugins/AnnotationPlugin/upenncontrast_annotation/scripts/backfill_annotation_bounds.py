@@ -0,0 +1,38 @@
+from pymongo import UpdateOne
+
+from upenncontrast_annotation.server.models.annotation \
+    import Annotation
+
+# Backfill the persisted spatial fields on annotations written before they
+# were computed at save time. Computed in Python (not with an update
+# pipeline) so the same script also runs against DocumentDB.
+BATCH_SIZE = 1000
+
+annotationModel = Annotation()
+collection = annotationModel.collection
+
+operations = []
+updated = 0
+missingQuery = {"$or": [
+    {field: {"$exists": False}}
+    for field in ("bbox", "centroid", "estimatedRadius")
+]}
+for annotation in collection.find(missingQuery, {"coordinates": 1}):
+    try:
+        operations.append(UpdateOne(
+            {"_id": annotation["_id"]},
+            {"$set": annotationModel.spatialFields(
+                annotation["coordinates"]
+            )},
+        ))
+    except Exception as e:
+        print(f"Skipping {annotation['_id']} due to error: {e}")
+    if len(operations) >= BATCH_SIZE:
+        updated += collection.bulk_write(
+            operations, ordered=False
+        ).modified_count
+        operations = []
+if operations:
+    updated += collection.bulk_write(operations, ordered=False).modified_count
+
+print(f"Backfilled spatial fields on {updated} annotations")
@@ -0,0 +1,32 @@
+import sys
+
+from bson.objectid import ObjectId
+
+from upenncontrast_annotation.server.models.annotation \
+    import Annotation
+from upenncontrast_annotation.server.models.propertyValues \
+    import AnnotationPropertyValues
+
+# Recount the dataset summaries answering the uncomputed property counts
+# (see server/models/datasetSummary.py), if they drifted from the
+# annotations and property values. Rebuilds the datasets given as arguments,
+# or every dataset with annotations or property values.
+annotationModel = Annotation()
+
+if len(sys.argv) > 1:
+    datasetIds = [ObjectId(datasetId) for datasetId in sys.argv[1:]]
+else:
+    datasetIds = set(annotationModel.collection.distinct("datasetId"))
+    datasetIds.update(
+        AnnotationPropertyValues().collection.distinct("datasetId")
+    )
+
+rebuilt = 0
+for datasetId in datasetIds:
+    try:
+        annotationModel.rebuildDatasetSummary(datasetId)
+        rebuilt += 1
+    except Exception as e:
+        print(f"Skipping {datasetId} due to error: {e}")
+
+print(f"Rebuilt the summaries of {rebuilt} datasets")
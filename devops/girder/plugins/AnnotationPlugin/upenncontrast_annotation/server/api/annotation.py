@@ -11,7 +11,11 @@ from girder.constants import AccessType, TokenScope
 from girder.exceptions import RestException
 from girder.models.folder import Folder
 
-from ..helpers.access_helpers import requireDatasetsAccess
+from ..helpers.access_helpers import (
+    requireDatasetAccess,
+    requireDatasetsAccess,
+)
+from ..helpers.columnar import streamColumnarStubs
 from ..helpers.proxiedModel import recordable, memoizeBodyJson
 from ..helpers.validation import (
     MAX_LIST_LIMIT,
@@ -24,7 +28,8 @@ from ..helpers.validation import (
     validateUncomputedCountsProperties,
 )
 from ..models.annotation import Annotation as AnnotationModel
-from ..helpers.serialization import orJsonDefaults
+from ..models.changeSequence import DatasetChangeSequence
+from ..helpers.serialization import iterJsonArray, orJsonDefaults
 
 
 # Helper functions to get dataset ID for recordable endpoints
@@ -36,18 +41,7 @@ def _streamJsonArray(items, prefix=b"[", suffix=b"]", default=None):
     an enclosing object, e.g. {"total": N, "rows": [...]}). Returns a
     generator suitable for a streamed response body."""
     def generate():
-        chunk = [prefix]
-        first = True
-        for item in items:
-            if not first:
-                chunk.append(b",")
-            chunk.append(orjson.dumps(item, default=default))
-            first = False
-            if len(chunk) > 1000:
-                yield b"".join(chunk)
-                chunk = []
-        chunk.append(suffix)
-        yield b"".join(chunk)
+        yield from iterJsonArray(items, prefix, suffix, default)
     return generate
 
 
@@ -117,6 +111,7 @@ class Annotation(Resource):
         self.route("POST", ("multiple",), self.createMultiple)
         self.route("DELETE", ("multiple",), self.deleteMultiple)
         self.route("GET", ("stubs",), self.stubs)
+        self.route("GET", ("viewport",), self.viewport)
         self.route("POST", ("hydrate",), self.hydrate)
         self.route("POST", ("list",), self.listAnnotations)
         self.route("POST", ("list", "ids"), self.listAnnotationIds)
@@ -151,8 +146,14 @@ class Annotation(Resource):
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @describeRoute(
-        Description("Create multiple new annotations").param(
-            "body", "Annotation Object List", paramType="body"
+        Description("Create multiple new annotations")
+        .param("body", "Annotation Object List", paramType="body")
+        .param(
+            "historyGroup",
+            "Record this request in the same history entry as the other "
+            "requests with this value, so that they are undone together "
+            "(e.g. the chunks of one upload)",
+            required=False,
         )
     )
     @memoizeBodyJson
@@ -341,12 +342,7 @@ class Annotation(Resource):
 
         # First, check dataset permissions explicitly
         datasetId = ObjectId(params["datasetId"])
-        Folder().load(
-            datasetId,
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True,
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
 
         # Now query annotations directly without ACL filtering
         query = {"datasetId": datasetId}
@@ -392,12 +388,7 @@ class Annotation(Resource):
     )
     def count(self, params):
         datasetId = ObjectId(params["datasetId"])
-        Folder().load(
-            datasetId,
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True,
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
 
         query = {"datasetId": datasetId}
         if params.get("shape"):
@@ -433,12 +424,7 @@ class Annotation(Resource):
         datasetId = requireObjectId(body.get("datasetId"), "datasetId")
         properties = body.get("properties") or []
         validateUncomputedCountsProperties(properties)
-        Folder().load(
-            datasetId,
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True,
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
         return self._annotationModel.uncomputedCounts(datasetId, properties)
 
     @access.public(scope=TokenScope.DATA_READ)
@@ -502,21 +488,140 @@ class Annotation(Resource):
             required=False,
             requireArray=True,
         )
+        .param(
+            "format",
+            "Response encoding: 'json' (an array of stub objects) or "
+            "'columnar' (packed little-endian typed arrays; see "
+            "helpers/columnar.py for the layout)",
+            required=False,
+            default="json",
+            enum=["json", "columnar"],
+        )
+        .param(
+            "since",
+            "Return only the changes after this dataset change sequence, "
+            "as {seq, reset, deleted, upserted}. The sequence to pass is "
+            "the Nimbus-Change-Seq header of a full response, or the `seq` "
+            "of the previous delta. Removals are kept for 30 days: an "
+            "older sequence gets a reset. JSON format only.",
+            dataType="integer",
+            required=False,
+        )
         .errorResponse()
     )
     def stubs(self, params):
         datasetId = requireObjectId(params.get("datasetId"), "datasetId")
-        Folder().load(
+        requireDatasetAccess(datasetId, self.getCurrentUser())
+
+        # Read the sequence before querying: a write racing this request is
+        # then re-sent by the next delta rather than missed.
+        seq = DatasetChangeSequence().current(datasetId)
+        since = params.get("since")
+        if since is not None:
+            if params.get("format") == "columnar":
+                raise RestException(
+                    "since is only supported with the json format", code=400
+                )
+            return self._stubDelta(datasetId, since, seq, params)
+
+        cursor = self._annotationModel.stubs(
             datasetId,
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True,
+            shape=params.get("shape"),
+            tags=params.get("tags"),
         )
 
-        cursor = self._annotationModel.stubs(
+        setResponseHeader("Nimbus-Change-Seq", str(seq))
+        if params.get("format") == "columnar":
+            setResponseHeader("Content-Type", "application/octet-stream")
+            return streamColumnarStubs(cursor)
+        setResponseHeader("Content-Type", "application/json")
+        return _streamJsonArray(cursor, default=orJsonDefaults)
+
+    def _stubDelta(self, datasetId, since, seq, params):
+        # A client ahead of the server (e.g. after a database restore),
+        # passing a negative sequence, or behind the pruned tombstones can't
+        # be patched: tell it to reset its cache and send every stub.
+        reset = (
+            since < 0 or since > seq
+            or since < DatasetChangeSequence().deltaFloor(datasetId)
+        )
+        if reset:
+            upserted, deletedIds = self._annotationModel.stubs(
+                datasetId,
+                shape=params.get("shape"),
+                tags=params.get("tags"),
+            ), []
+        else:
+            upserted, deletedIds = self._annotationModel.stubChanges(
+                datasetId,
+                since,
+                shape=params.get("shape"),
+                tags=params.get("tags"),
+            )
+        prefix = (
+            b'{"seq":' + str(seq).encode()
+            + b',"reset":' + (b"true" if reset else b"false")
+            + b',"deleted":' + orjson.dumps(deletedIds)
+            + b',"upserted":['
+        )
+        setResponseHeader("Content-Type", "application/json")
+        return _streamJsonArray(
+            upserted, prefix=prefix, suffix=b"]}", default=orJsonDefaults
+        )
+
+    @access.public(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description("Get the annotations intersecting a viewport")
+        .notes(
+            "Returns full annotation documents at the given location whose "
+            "bounding box intersects [minX, maxX] x [minY, maxY]. Backed by "
+            "a spatial index on the persisted annotation bbox, so panning "
+            "costs what is visible rather than the whole dataset."
+        )
+        .param("datasetId", "The dataset to query", required=True)
+        .param("minX", "Viewport left bound", dataType="number")
+        .param("minY", "Viewport top bound", dataType="number")
+        .param("maxX", "Viewport right bound", dataType="number")
+        .param("maxY", "Viewport bottom bound", dataType="number")
+        .param("XY", "Restrict to this XY location", dataType="integer",
+               required=False)
+        .param("Z", "Restrict to this Z location", dataType="integer",
+               required=False)
+        .param("Time", "Restrict to this Time location",
+               dataType="integer", required=False)
+        .param("shape", "Filter annotations by shape", required=False)
+        .jsonParam(
+            "tags",
+            "Filter annotations by tags",
+            required=False,
+            requireArray=True,
+        )
+        .param("limit", "Maximum number of annotations (0 for no limit)",
+               dataType="integer", default=0, required=False)
+        .errorResponse()
+        .errorResponse("Read access denied.", 403)
+    )
+    def viewport(self, params):
+        datasetId = requireObjectId(params.get("datasetId"), "datasetId")
+        bbox = {
+            key: params[key] for key in ("minX", "minY", "maxX", "maxY")
+        }
+        if bbox["minX"] > bbox["maxX"] or bbox["minY"] > bbox["maxY"]:
+            raise RestException(
+                "Viewport min bounds must not exceed max bounds", code=400
+            )
+        limit = params.get("limit") or 0
+        if limit < 0:
+            raise RestException("limit must not be negative", code=400)
+        requireDatasetAccess(datasetId, self.getCurrentUser())
+
+        cursor = self._annotationModel.viewport(
             datasetId,
+            bbox,
+            location={axis: params.get(axis) for axis in ("XY", "Z", "Time")},
             shape=params.get("shape"),
             tags=params.get("tags"),
+            limit=limit,
         )
 
         setResponseHeader("Content-Type", "application/json")
@@ -578,10 +683,7 @@ class Annotation(Resource):
     def listAnnotationIds(self, params):
         bodyJson = requireObjectBody(self.getBodyJson())
         datasetId = requireObjectId(bodyJson.get("datasetId"), "datasetId")
-        Folder().load(
-            datasetId, user=self.getCurrentUser(),
-            level=AccessType.READ, exc=True,
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
         filters = bodyJson.get("filters") or {}
         validateListInputs(filters)
         dropNoOpPropertyFilters(filters)
@@ -595,17 +697,18 @@ class Annotation(Resource):
     @describeRoute(
         Description("List annotations (paged), stub-shaped + property values")
         .param("body", "JSON: {datasetId, filters, sort, propertyPaths, "
-                       "offset, limit, anchorId?}", paramType="body")
+                       "offset, limit, anchorId?, cursor?}", paramType="body")
+        .notes("The response carries a nextCursor (null on the last page). "
+               "Pass it back as cursor, with the same filters and sort, to "
+               "get the next page: offset is then ignored, and the page is "
+               "found by a range match instead of skipping earlier rows.")
         .errorResponse()
         .errorResponse("Read access denied.", 403)
     )
     def listAnnotations(self, params):
         bodyJson = requireObjectBody(self.getBodyJson())
         datasetId = requireObjectId(bodyJson.get("datasetId"), "datasetId")
-        Folder().load(
-            datasetId, user=self.getCurrentUser(),
-            level=AccessType.READ, exc=True,
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
         filters = bodyJson.get("filters") or {}
         sort = bodyJson.get("sort")
         propertyPaths = bodyJson.get("propertyPaths") or []
@@ -614,6 +717,13 @@ class Annotation(Resource):
             requireObjectId(anchorIdValue, "anchorId")
             if anchorIdValue is not None else None
         )
+        cursorValue = bodyJson.get("cursor")
+        if cursorValue is not None and not isinstance(cursorValue, str):
+            raise RestException("cursor must be a string", code=400)
+        if cursorValue is not None and anchorId is not None:
+            raise RestException(
+                "anchorId and cursor cannot be combined", code=400
+            )
         # Parse-or-400 at the boundary, then clamp: a non-integer
         # offset/limit would otherwise raise an uncaught int() error -> 500 on
         # this public endpoint. The limit is clamped to MAX_LIST_LIMIT so a
@@ -632,6 +742,10 @@ class Annotation(Resource):
         # field (ValueError -> 400) before the expensive count aggregation
         # runs, so a bad sort key doesn't pay for a full count.
         try:
+            after = (
+                self._annotationModel.decodeListCursor(sort, cursorValue)
+                if cursorValue is not None else None
+            )
             resolvedOffset = offset
             if anchorId is not None:
                 position = self._annotationModel.listPosition(
@@ -644,7 +758,7 @@ class Annotation(Resource):
             cursor = (
                 self._annotationModel.listPage(
                     datasetId, filters, sort, propertyPaths,
-                    resolvedOffset, limit
+                    resolvedOffset, limit, after
                 )
                 if resolvedOffset is not None else []
             )
@@ -652,15 +766,36 @@ class Annotation(Resource):
             raise RestException(str(e), code=400)
         total = self._annotationModel.listCount(datasetId, filters)
 
-        encodedOffset = (
-            b"null" if resolvedOffset is None
-            else str(resolvedOffset).encode()
-        )
-        prefix = (
-            b'{"total":' + str(total).encode()
-            + b',"offset":' + encodedOffset + b',"rows":['
-        )
+        prefix = b'{"total":' + str(total).encode()
+        if after is None:
+            # A cursor page has no known offset
+            prefix += b',"offset":' + (
+                b"null" if resolvedOffset is None
+                else str(resolvedOffset).encode()
+            )
+        prefix += b',"rows":['
+
+        # The next cursor is taken from the last row once the page has been
+        # streamed; a short page is the last one.
+        annotationModel = self._annotationModel
+        page = {"count": 0, "last": None}
+
+        def trackLastRow(rows):
+            for row in rows:
+                page["count"] += 1
+                page["last"] = row
+                yield row
+
+        def generate():
+            yield from iterJsonArray(
+                trackLastRow(cursor), prefix, b"]", orJsonDefaults
+            )
+            nextCursor = None
+            if page["count"] >= limit:
+                nextCursor = annotationModel.encodeListCursor(
+                    datasetId, sort, page["last"]
+                )
+            yield b',"nextCursor":' + orjson.dumps(nextCursor) + b"}"
+
         setResponseHeader("Content-Type", "application/json")
-        return _streamJsonArray(
-            cursor, prefix=prefix, suffix=b"]}", default=orJsonDefaults
-        )
+        return generate
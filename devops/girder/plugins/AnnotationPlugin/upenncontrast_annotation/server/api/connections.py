@@ -302,9 +302,17 @@ class AnnotationConnection(Resource):
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @describeRoute(
-        Description("Create connections between annotations").param(
-            "body", "Connection Object", paramType="body"
+        Description("Create connections between annotations")
+        .notes(
+            "Connects each annotation of annotationsIds to the nearest "
+            "annotation, by centroid, in the same dataset and location, "
+            "restricted to channelId and tags when given. Only points, "
+            "lines and polygons are candidates; an annotation of another "
+            "shape is connected to the first candidate. The distance "
+            "includes z when the points of both annotations all have a z "
+            "coordinate, and is in x, y otherwise."
         )
+        .param("body", "Connection Object", paramType="body")
     )
     @memoizeBodyJson
     @recordable("Create connections with nearest", getDatasetIdFromInfoInBody)
@@ -1,11 +1,13 @@
 """
-Export API for downloading annotation data as JSON or CSV.
+Export API for downloading annotation data as JSON, CSV, Parquet or Arrow.
 
 This endpoint exports annotations, connections, properties, and property
 values for a dataset.
 """
 
+import itertools
 import orjson
+import pyarrow as pa
 import re
 from dataclasses import dataclass
 
@@ -25,7 +27,12 @@ from ..models.propertyValues import (
 from ..models.property import AnnotationProperty as PropertyModel
 from ..models.collection import Collection as CollectionModel
 from ..models.datasetView import DatasetView as DatasetViewModel
-from ..helpers.serialization import orJsonDefaults
+from ..helpers.arrowStream import iterArrowStream, iterParquet
+from ..helpers.serialization import (
+    iterJsonArray,
+    iterJsonObject,
+    orJsonDefaults,
+)
 from ..helpers.validation import (
     requireObjectId,
     validateAnnotationIdCount,
@@ -53,6 +60,42 @@ CSV_FIXED_COLUMNS = [
     CsvColumn("Name", is_quoted=True),
 ]
 
+# Arrow types of the fixed columns, in CSV_FIXED_COLUMNS order. XY, Z and
+# Time are 1-indexed like in the CSV; tags stay a list.
+ARROW_FIXED_TYPES = [
+    pa.string(),
+    pa.int64(),
+    pa.int64(),
+    pa.int64(),
+    pa.int64(),
+    pa.list_(pa.string()),
+    pa.string(),
+    pa.string(),
+]
+
+# Cursor batch size used when streaming exports
+EXPORT_BATCH_SIZE = 1000
+
+# Rows per record batch (and per Parquet row group) of table exports
+ARROW_BATCH_ROWS = 65536
+
+# Annotation fields read to build a CSV row
+CSV_ANNOTATION_FIELDS = ["channel", "location", "tags", "shape", "name"]
+
+# Number of annotation ids joined with their property values at a time when
+# exporting a subset as CSV
+CSV_JOIN_CHUNK_SIZE = 10000
+
+# Fields maintained by the server on every annotation write (spatial index
+# and change sequence). Left out of JSON exports, which only carry what an
+# import needs.
+ANNOTATION_EXPORT_EXCLUDED_FIELDS = (
+    "bbox",
+    "centroid",
+    "estimatedRadius",
+    "changeSeq",
+)
+
 # Must stay in sync with UNSAFE_CSV_COLUMN_CHARS in
 # src/components/AnnotationBrowser/AnnotationCSVDialog.vue so that the
 # client-side preview matches the server-generated CSV exactly.
@@ -92,6 +135,55 @@ def _deduplicateColumnNames(names):
     return result
 
 
+def _isArrowNumber(value):
+    """Whether a property value fits a float64 column (bools do not)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _tableExportSchema(defaultFilename):
+    """Body schema of the Parquet and Arrow exports."""
+    return {
+        "type": "object",
+        "properties": {
+            "datasetId": {
+                "type": "string",
+                "description": "The dataset ID (required)"
+            },
+            "propertyPaths": {
+                "type": "array",
+                "description": "Array of property paths to include",
+                "items": {
+                    "type": "array",
+                    "items": {"type": "string"}
+                }
+            },
+            "annotationIds": {
+                "type": "array",
+                "description": (
+                    "Annotation IDs to export. Omit for all "
+                    "annotations; an empty array exports none."
+                ),
+                "items": {"type": "string"}
+            },
+            "sanitizeColumnNames": {
+                "type": "boolean",
+                "description": (
+                    "Replace spaces, slashes, commas, and other "
+                    "non-alphanumeric column-name characters with "
+                    "underscores"
+                ),
+                "default": False
+            },
+            "filename": {
+                "type": "string",
+                "description": "Filename for download",
+                "default": defaultFilename
+            }
+        },
+        "required": ["datasetId"]
+    }
+
+
 class Export(Resource):
     """REST API resource for exporting annotation data."""
 
@@ -108,6 +200,8 @@ class Export(Resource):
 
         self.route("GET", ("json",), self.exportJson)
         self.route("POST", ("csv",), self.exportCsv)
+        self.route("POST", ("parquet",), self.exportParquet)
+        self.route("POST", ("arrow",), self.exportArrow)
 
     @access.public(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -199,33 +293,66 @@ class Export(Resource):
         setResponseHeader("Content-Type", "application/json")
         setContentDisposition(safe_filename, disposition='attachment')
 
-        # Build export data
-        data = {}
+        # Stream each section straight from its cursor so memory stays
+        # bounded by one chunk, whatever the size of the dataset
+        sections = []
 
         if includeAnnotations:
-            data["annotations"] = list(self._annotationModel.find(
-                {"datasetId": datasetObjectId}
+            sections.append((
+                "annotations",
+                iterJsonArray(
+                    self._annotationModel.find(
+                        {"datasetId": datasetObjectId},
+                        fields={
+                            field: 0
+                            for field in ANNOTATION_EXPORT_EXCLUDED_FIELDS
+                        },
+                        batch_size=EXPORT_BATCH_SIZE,
+                    ),
+                    default=orJsonDefaults,
+                ),
             ))
 
         if includeConnections:
-            data["annotationConnections"] = list(self._connectionModel.find(
-                {"datasetId": datasetObjectId}
+            sections.append((
+                "annotationConnections",
+                iterJsonArray(
+                    self._connectionModel.find(
+                        {"datasetId": datasetObjectId},
+                        batch_size=EXPORT_BATCH_SIZE,
+                    ),
+                    default=orJsonDefaults,
+                ),
             ))
 
         if includeProperties:
-            data["annotationProperties"] = self._getProperties(
-                datasetObjectId, configObjectId,
-                self.getCurrentUser()
-            )
+            sections.append((
+                "annotationProperties",
+                iterJsonArray(
+                    self._getProperties(
+                        datasetObjectId, configObjectId,
+                        self.getCurrentUser()
+                    ),
+                    default=orJsonDefaults,
+                ),
+            ))
 
         if includePropertyValues:
-            data["annotationPropertyValues"] = self._getPropertyValues(
-                datasetObjectId
-            )
+            sections.append((
+                "annotationPropertyValues",
+                iterJsonObject(
+                    self._iterPropertyValues(datasetObjectId),
+                    default=orJsonDefaults,
+                ),
+            ))
 
         # Return as generator so Girder streams raw bytes
         def generate():
-            yield orjson.dumps(data, default=orJsonDefaults)
+            yield b"{"
+            for index, (key, chunks) in enumerate(sections):
+                yield (b"," if index else b"") + orjson.dumps(key) + b":"
+                yield from chunks
+            yield b"}"
         return generate
 
     def _getProperties(self, datasetId, configurationId, user):
@@ -274,28 +401,24 @@ class Export(Resource):
             ))
         return []
 
-    def _getPropertyValues(self, datasetId):
+    def _iterPropertyValues(self, datasetId):
         """
-        Get property values as a dict keyed by annotationId.
+        Iterate over the property values of a dataset as (annotationId,
+        values) pairs, without holding them all in memory.
 
         The backend stores property values as individual documents:
         {"annotationId": "abc", "values": {"propId1": {"Area": 100}}}
 
-        This method transforms them into the frontend format:
+        The pairs are the entries of the frontend format:
         {"abc": {"propId1": {"Area": 100}}}
-
         """
-        result = {}
         cursor = self._propertyValuesModel.find(
-            {"datasetId": datasetId}
+            {"datasetId": datasetId},
+            fields={"_id": 0, "annotationId": 1, "values": 1},
+            batch_size=EXPORT_BATCH_SIZE,
         )
-
         for doc in cursor:
-            annotationId = str(doc["annotationId"])
-            values = doc.get("values", {})
-            result[annotationId] = values
-
-        return result
+            yield str(doc["annotationId"]), doc.get("values", {})
 
     @access.public(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -381,32 +504,10 @@ class Export(Resource):
         sanitizeColumnNames = bool(body.get("sanitizeColumnNames", False))
         filename = body.get("filename", "export.csv")
 
-        # Permission check
-        datasetObjectId = requireObjectId(datasetId, "datasetId")
-        Folder().load(
-            datasetObjectId,
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True
+        datasetObjectId, parsedPropertyPaths, parsedAnnotationIds = (
+            self._parseExportParams(datasetId, propertyPaths, annotationIds)
         )
 
-        # The jsonParam schema guarantees shapes (lists of strings), but not
-        # that id strings are valid ObjectIds. Convert them all here at the
-        # API boundary: the CSV body is generated lazily while streaming, so
-        # an InvalidId raised there could not become a clean 400 anymore.
-        parsedPropertyPaths = propertyPaths or []
-        for path in parsedPropertyPaths:
-            if path:
-                requireObjectId(path[0], "propertyPaths property id")
-
-        parsedAnnotationIds = None
-        if annotationIds is not None:
-            validateAnnotationIdCount(len(annotationIds))
-            parsedAnnotationIds = [
-                requireObjectId(aid, "annotationIds entry")
-                for aid in annotationIds
-            ]
-
         # Validate delimiter
         if delimiter not in (",", "\t"):
             delimiter = ","
@@ -447,6 +548,256 @@ class Export(Resource):
 
         return generate
 
+    def _parseExportParams(self, datasetId, propertyPaths, annotationIds):
+        """
+        Check read access to the dataset and parse the ids of an export body.
+
+        Returns:
+            Tuple of the dataset ObjectId, the property paths, and the
+            annotation ObjectIds (None for the whole dataset)
+        """
+        # Permission check
+        datasetObjectId = requireObjectId(datasetId, "datasetId")
+        Folder().load(
+            datasetObjectId,
+            user=self.getCurrentUser(),
+            level=AccessType.READ,
+            exc=True
+        )
+
+        # The jsonParam schema guarantees shapes (lists of strings), but not
+        # that id strings are valid ObjectIds. Convert them all here at the
+        # API boundary: export bodies are generated lazily while streaming,
+        # so an InvalidId raised there could not become a clean 400 anymore.
+        parsedPropertyPaths = propertyPaths or []
+        for path in parsedPropertyPaths:
+            if path:
+                requireObjectId(path[0], "propertyPaths property id")
+
+        parsedAnnotationIds = None
+        if annotationIds is not None:
+            validateAnnotationIdCount(len(annotationIds))
+            parsedAnnotationIds = [
+                requireObjectId(aid, "annotationIds entry")
+                for aid in annotationIds
+            ]
+        return datasetObjectId, parsedPropertyPaths, parsedAnnotationIds
+
+    @access.public(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description("Export dataset annotations as a Parquet file")
+        .notes("""
+            Same rows and columns as the CSV export, typed: one row group per
+            batch of annotations, and one column per property path.
+        """)
+        .jsonParam(
+            "body",
+            "Export parameters",
+            paramType="body",
+            required=True,
+            schema=_tableExportSchema("export.parquet"),
+        )
+        .errorResponse("Dataset not found or access denied", 404)
+    )
+    def exportParquet(self, body):
+        return self._exportTable(
+            body, iterParquet, ".parquet", "application/vnd.apache.parquet"
+        )
+
+    @access.public(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description("Export dataset annotations as an Arrow IPC stream")
+        .notes("""
+            Same rows and columns as the CSV export, typed, in the Arrow IPC
+            streaming format: one record batch per batch of annotations.
+        """)
+        .jsonParam(
+            "body",
+            "Export parameters",
+            paramType="body",
+            required=True,
+            schema=_tableExportSchema("export.arrows"),
+        )
+        .errorResponse("Dataset not found or access denied", 404)
+    )
+    def exportArrow(self, body):
+        return self._exportTable(
+            body,
+            iterArrowStream,
+            ".arrows",
+            "application/vnd.apache.arrow.stream",
+        )
+
+    def _exportTable(self, body, encode, extension, contentType):
+        """Stream the record batches of an export with an encoder of
+        arrowStream."""
+        datasetObjectId, parsedPropertyPaths, parsedAnnotationIds = (
+            self._parseExportParams(
+                body.get("datasetId"),
+                body.get("propertyPaths", []),
+                body.get("annotationIds"),
+            )
+        )
+        sanitizeColumnNames = bool(body.get("sanitizeColumnNames", False))
+        filename = body.get("filename") or "export" + extension
+        if not filename.endswith(extension):
+            filename += extension
+
+        setResponseHeader("Content-Type", contentType)
+        setContentDisposition(filename, disposition='attachment')
+
+        exportSelf = self
+
+        def generate():
+            schema, batches = exportSelf._buildRecordBatches(
+                datasetObjectId,
+                parsedPropertyPaths,
+                parsedAnnotationIds,
+                sanitizeColumnNames,
+            )
+            yield from encode(schema, batches)
+
+        return generate
+
+    def _buildRecordBatches(
+        self,
+        datasetObjectId,
+        parsedPropertyPaths,
+        parsedAnnotationIds=None,
+        sanitizeColumnNames=False,
+        batchSize=None,
+    ):
+        """
+        Build the typed table of an export, in record batches.
+
+        The columns are the CSV columns. Property columns are float64, or
+        strings (formatted like in the CSV) when any exported value of their
+        path is not a number. The schema is written before the first batch,
+        so the values are read twice: once for their types, then to stream
+        the rows.
+
+        Returns:
+            Tuple of the schema, and a generator of record batches
+        """
+        batchSize = batchSize or ARROW_BATCH_ROWS
+        propertyNameMap = self._buildPropertyNameMap(parsedPropertyPaths)
+        columns, includedPaths = self._buildCsvColumns(
+            parsedPropertyPaths,
+            propertyNameMap,
+            sanitizeColumnNames,
+        )
+
+        propertyTypes = self._inferPropertyTypes(
+            datasetObjectId, parsedAnnotationIds, includedPaths
+        )
+        schema = pa.schema([
+            pa.field(column.name, arrowType)
+            for column, arrowType in zip(
+                columns, ARROW_FIXED_TYPES + propertyTypes
+            )
+        ])
+
+        def batches():
+            if parsedAnnotationIds is not None and not parsedAnnotationIds:
+                return
+            rows = self._iterAnnotationsWithValues(
+                datasetObjectId,
+                parsedAnnotationIds,
+                includedPaths,
+            )
+            while True:
+                chunk = list(itertools.islice(rows, batchSize))
+                if not chunk:
+                    return
+                yield self._buildRecordBatch(
+                    chunk, includedPaths, propertyTypes, schema
+                )
+
+        return schema, batches()
+
+    def _inferPropertyTypes(self, datasetId, annotationIds, includedPaths):
+        """
+        The Arrow type of each property path: float64, unless one of the
+        values of the exported annotations is not a number. Only the values
+        are read, and only until every path is a string.
+        """
+        isString = [False] * len(includedPaths)
+        if not includedPaths or (
+            annotationIds is not None and not annotationIds
+        ):
+            return [pa.float64()] * len(includedPaths)
+
+        if annotationIds is None:
+            fields = {"_id": 0}
+            for path in includedPaths:
+                fields["values." + ".".join(path)] = 1
+            valueDocs = self._propertyValuesModel.find(
+                {"datasetId": datasetId},
+                fields=fields,
+                batch_size=EXPORT_BATCH_SIZE,
+            )
+        else:
+            valueDocs = (
+                doc
+                for i in range(0, len(annotationIds), CSV_JOIN_CHUNK_SIZE)
+                for doc in self._propertyValuesModel.findByAnnotationIds(
+                    datasetId,
+                    annotationIds[i:i + CSV_JOIN_CHUNK_SIZE],
+                    includedPaths,
+                )
+            )
+        for doc in valueDocs:
+            values = doc.get("values", {})
+            for index, path in enumerate(includedPaths):
+                if isString[index]:
+                    continue
+                value = self._getValueFromPath(values, path)
+                if value is not None and not _isArrowNumber(value):
+                    isString[index] = True
+            if all(isString):
+                break
+        return [
+            pa.string() if string else pa.float64() for string in isString
+        ]
+
+    def _buildRecordBatch(self, chunk, includedPaths, propertyTypes, schema):
+        """Build one record batch from (annotation, values) pairs."""
+        locations = [annotation.get("location", {}) for annotation, _ in chunk]
+        arrays = [
+            [str(annotation["_id"]) for annotation, _ in chunk],
+            [annotation.get("channel", 0) for annotation, _ in chunk],
+            [location.get("XY", 0) + 1 for location in locations],
+            [location.get("Z", 0) + 1 for location in locations],
+            [location.get("Time", 0) + 1 for location in locations],
+            [
+                [str(tag) for tag in annotation.get("tags") or []]
+                for annotation, _ in chunk
+            ],
+            [str(annotation.get("shape", "")) for annotation, _ in chunk],
+            [str(annotation.get("name", "") or "") for annotation, _ in chunk],
+        ]
+        for path, arrowType in zip(includedPaths, propertyTypes):
+            values = [
+                self._getValueFromPath(annPropValues, path)
+                for _, annPropValues in chunk
+            ]
+            if arrowType == pa.string():
+                arrays.append([
+                    None if value is None
+                    else str(value) if isinstance(value, dict)
+                    else self._formatValue(value)
+                    for value in values
+                ])
+            else:
+                arrays.append(values)
+        return pa.RecordBatch.from_arrays(
+            [
+                pa.array(values, type=field.type)
+                for values, field in zip(arrays, schema)
+            ],
+            schema=schema,
+        )
+
     def _generateCsvLines(
         self,
         datasetObjectId,
@@ -473,19 +824,17 @@ class Export(Resource):
                 headerRow.append(col.name)
         yield delimiter.join(headerRow) + '\n'
 
-        # An explicitly empty subset has no rows, so skip the dataset-wide
-        # property-values scan below entirely.
+        # An explicitly empty subset has no rows, so skip the property-values
+        # reads below entirely.
         if parsedAnnotationIds is not None and not parsedAnnotationIds:
             return
 
-        # Load all property values for the dataset
-        propertyValues = self._getPropertyValues(datasetObjectId)
-
-        # Query annotations. When filtering by IDs, chunk
-        # the $in to stay under MongoDB's 16MB BSON limit.
-        for annotation in self._iterAnnotations(
+        # Annotations are joined with their property values as they stream,
+        # so memory stays flat whatever the size of the dataset.
+        for annotation, annPropValues in self._iterAnnotationsWithValues(
             datasetObjectId,
             parsedAnnotationIds,
+            includedPaths,
         ):
             annId = str(annotation["_id"])
             location = annotation.get("location", {})
@@ -503,7 +852,6 @@ class Export(Resource):
             ]
 
             # Add property values
-            annPropValues = propertyValues.get(annId, {})
             for path in includedPaths:
                 value = self._getValueFromPath(annPropValues, path)
                 if value is None:
@@ -565,24 +913,88 @@ class Export(Resource):
             ]
         return columns, includedPaths
 
-    def _iterAnnotations(self, datasetId, annotationIds):
-        """Iterate annotations, preserving an explicitly empty subset."""
+    def _iterAnnotations(self, datasetId, annotationIds, fields=None):
+        """Iterate annotations, preserving an explicitly empty subset.
+
+        A whole dataset is iterated in _id order.
+        """
         if annotationIds is None:
-            for ann in self._annotationModel.find({"datasetId": datasetId}):
+            for ann in self._annotationModel.find(
+                {"datasetId": datasetId},
+                fields=fields,
+                sort=[("_id", 1)],
+                batch_size=EXPORT_BATCH_SIZE,
+            ):
                 yield ann
             return
         if not annotationIds:
             return
 
+        # Chunk the $in to stay under MongoDB's 16MB BSON limit.
         IN_CHUNK_SIZE = 500000
         for i in range(0, len(annotationIds), IN_CHUNK_SIZE):
             chunk = annotationIds[i:i + IN_CHUNK_SIZE]
             for ann in self._annotationModel.find({
                 "datasetId": datasetId,
                 "_id": {"$in": chunk},
-            }):
+            }, fields=fields):
                 yield ann
 
+    def _iterAnnotationsWithValues(
+        self, datasetId, annotationIds, propertyPaths
+    ):
+        """
+        Iterate (annotation, values) pairs: the CSV fields of each
+        annotation, and its property values restricted to propertyPaths.
+
+        A whole dataset is read as two cursors sorted by annotation id, which
+        are merge-joined in lockstep. A subset is read by chunks of ids, each
+        chunk looking its values up with findByAnnotationIds. Neither holds
+        more than a chunk of values in memory.
+        """
+        if annotationIds is not None:
+            for i in range(0, len(annotationIds), CSV_JOIN_CHUNK_SIZE):
+                chunk = annotationIds[i:i + CSV_JOIN_CHUNK_SIZE]
+                valuesById = {
+                    doc["annotationId"]: doc.get("values", {})
+                    for doc in self._propertyValuesModel.findByAnnotationIds(
+                        datasetId, chunk, propertyPaths
+                    )
+                } if propertyPaths else {}
+                for ann in self._iterAnnotations(
+                    datasetId, chunk, CSV_ANNOTATION_FIELDS
+                ):
+                    yield ann, valuesById.get(ann["_id"], {})
+            return
+
+        annotations = self._iterAnnotations(
+            datasetId, None, CSV_ANNOTATION_FIELDS
+        )
+        if not propertyPaths:
+            for ann in annotations:
+                yield ann, {}
+            return
+
+        fields = {"_id": 0, "annotationId": 1}
+        for path in propertyPaths:
+            fields["values." + ".".join(path)] = 1
+        valueDocs = self._propertyValuesModel.find(
+            {"datasetId": datasetId},
+            fields=fields,
+            sort=[("annotationId", 1)],
+            batch_size=EXPORT_BATCH_SIZE,
+        )
+        valueDoc = next(valueDocs, None)
+        for ann in annotations:
+            # Skip values of annotations that are not exported
+            while (valueDoc is not None
+                   and valueDoc["annotationId"] < ann["_id"]):
+                valueDoc = next(valueDocs, None)
+            if valueDoc is not None and valueDoc["annotationId"] == ann["_id"]:
+                yield ann, valueDoc.get("values", {})
+            else:
+                yield ann, {}
+
     def _buildPropertyNameMap(self, propertyPaths):
         """
         Build a mapping of property IDs to their names.
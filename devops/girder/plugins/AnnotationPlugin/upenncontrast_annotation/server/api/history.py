@@ -4,6 +4,7 @@ from girder.api.rest import Resource
 from girder.constants import AccessType, TokenScope
 from girder.exceptions import AccessException, RestException
 from girder.models.folder import Folder
+from girder.utility.progress import ProgressContext
 from ..models.history import History as HistoryModel
 from bson.objectid import ObjectId
 
@@ -53,6 +54,12 @@ class History(Resource):
             "datasetId",
             "The dataset in which undo should be done",
             required=True,
+        ).param(
+            "progress",
+            "Whether to record progress on the undo.",
+            dataType="boolean",
+            default=False,
+            required=False,
         )
     )
     def undo(self, params):
@@ -65,7 +72,9 @@ class History(Resource):
         Folder().load(
             datasetId, user=user, level=AccessType.WRITE, exc=True
         )
-        return self._historyModel.undo(user, datasetId)
+        progress = self.boolParam("progress", params, default=False)
+        with ProgressContext(progress, user=user, title="Undo") as ctx:
+            return self._historyModel.undo(user, datasetId, ctx)
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @describeRoute(
@@ -73,6 +82,12 @@ class History(Resource):
             "datasetId",
             "The dataset in which redo should be done",
             required=True,
+        ).param(
+            "progress",
+            "Whether to record progress on the redo.",
+            dataType="boolean",
+            default=False,
+            required=False,
         )
     )
     def redo(self, params):
@@ -85,4 +100,6 @@ class History(Resource):
         Folder().load(
             datasetId, user=user, level=AccessType.WRITE, exc=True
         )
-        self._historyModel.redo(user, datasetId)
+        progress = self.boolParam("progress", params, default=False)
+        with ProgressContext(progress, user=user, title="Redo") as ctx:
+            self._historyModel.redo(user, datasetId, ctx)
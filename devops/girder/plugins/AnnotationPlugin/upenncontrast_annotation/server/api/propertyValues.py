@@ -4,11 +4,16 @@ from girder.api import access
 from girder.api.describe import Description, describeRoute
 from girder.api.rest import Resource
 from girder.constants import AccessType, TokenScope
-from girder.exceptions import RestException
+from girder.exceptions import RestException, ValidationException
 from girder.models.folder import Folder
 
-from ..helpers.access_helpers import requireDatasetsAccess
+from ..helpers.access_helpers import (
+    requireDatasetAccess,
+    requireDatasetsAccess,
+)
+from ..helpers.proxiedModel import recordable
 from ..helpers.validation import (
+    requireInt,
     requireList,
     requireObjectBody,
     requireObjectId,
@@ -20,6 +25,11 @@ from ..models.propertyValues import (
 )
 
 
+def getDatasetIdFromParams(self: "PropertyValues", *args, **kwargs):
+    params = kwargs["params"] if "params" in kwargs else args[0]
+    return params.get("datasetId")
+
+
 class PropertyValues(Resource):
     def __init__(self):
         super().__init__()
@@ -33,6 +43,7 @@ class PropertyValues(Resource):
         self.route("GET", (), self.find)
         self.route("GET", ("count",), self.count)
         self.route("GET", ("histogram",), self.histogram)
+        self.route("POST", ("histograms",), self.histograms)
 
     # TODO: anytime a dataset is mentioned, load the dataset and check for
     #   existence and that the user has access to it
@@ -108,6 +119,7 @@ class PropertyValues(Resource):
         .errorResponse("Write access was denied for the property values.", 403)
     )
     @access.user(scope=TokenScope.DATA_WRITE)
+    @recordable("Delete property values", getDatasetIdFromParams)
     def delete(self, params):
         if "propertyId" not in params:
             raise RestException(
@@ -161,12 +173,7 @@ class PropertyValues(Resource):
         # be a clean 400 on this public endpoint, not a 500.
         rawIds = requireList(body.get("annotationIds", []), "annotationIds")
         validateAnnotationIdCount(len(rawIds))
-        Folder().load(
-            datasetId,
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True,
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
         annotationIds = [requireObjectId(i, "annotationId") for i in rawIds]
         return self._annotationPropertyValuesModel.findByAnnotationIds(
             datasetId, annotationIds, propertyPaths
@@ -197,10 +204,9 @@ class PropertyValues(Resource):
         # Check dataset permissions if datasetId is provided
         if "datasetId" in params:
             datasetId = ObjectId(params["datasetId"])
-            dataset = Folder().load(
-                datasetId, user=self.getCurrentUser(), level=AccessType.READ
-            )
-            if not dataset:
+            try:
+                requireDatasetAccess(datasetId, self.getCurrentUser())
+            except ValidationException:
                 raise RestException(
                     code=403, message="Access denied to dataset"
                 )
@@ -233,10 +239,7 @@ class PropertyValues(Resource):
         if "datasetId" not in params:
             raise RestException(code=400, message="Dataset ID is required")
         datasetId = ObjectId(params["datasetId"])
-        Folder().load(
-            datasetId, user=self.getCurrentUser(), level=AccessType.READ,
-            exc=True
-        )
+        requireDatasetAccess(datasetId, self.getCurrentUser())
 
         query = {"datasetId": datasetId}
         return {
@@ -264,12 +267,7 @@ class PropertyValues(Resource):
     def histogram(self, params):
         params = self._annotationPropertyValuesModel.convertIdsToObjectIds(
             params)
-        Folder().load(
-            params["datasetId"],
-            user=self.getCurrentUser(),
-            level=AccessType.READ,
-            exc=True,
-        )
+        requireDatasetAccess(params["datasetId"], self.getCurrentUser())
         if "buckets" in params:
             return self._annotationPropertyValuesModel.histogram(
                 params["propertyPath"],
@@ -280,3 +278,42 @@ class PropertyValues(Resource):
             return self._annotationPropertyValuesModel.histogram(
                 params["propertyPath"], params["datasetId"]
             )
+
+    @access.public(scope=TokenScope.DATA_READ)
+    @describeRoute(
+        Description(
+            "Get the histograms of several property paths of a dataset"
+        )
+        .notes(
+            "Histograms computed since the last write to the dataset are "
+            "returned as is; the others are computed in one pass."
+        )
+        .param(
+            "body",
+            (
+                "{ datasetId: string, propertyPaths: string[][], "
+                "buckets?: number }"
+            ),
+            paramType="body",
+        )
+        .errorResponse()
+        .errorResponse("Read access was denied for the dataset.", 403)
+    )
+    def histograms(self, params):
+        body = requireObjectBody(self.getBodyJson())
+        datasetId = requireObjectId(body.get("datasetId"), "datasetId")
+        propertyPaths = body.get("propertyPaths")
+        validatePropertyPaths(propertyPaths)
+        buckets = requireInt(body.get("buckets", 255), "buckets")
+        if buckets < 1:
+            raise RestException("buckets must be positive", code=400)
+        requireDatasetAccess(datasetId, self.getCurrentUser())
+        # Dotted paths, without duplicates
+        propertyPaths = list(dict.fromkeys(
+            ".".join(path) for path in propertyPaths
+        ))
+        if not propertyPaths:
+            return {}
+        return self._annotationPropertyValuesModel.histograms(
+            propertyPaths, datasetId, buckets
+        )
@@ -1,5 +1,10 @@
 """Shared helpers for access control endpoints."""
 
+import threading
+import time
+from collections import OrderedDict
+
+from girder import events
 from girder.constants import AccessType
 from girder.exceptions import AccessException
 from girder.models.folder import Folder
@@ -31,6 +36,91 @@ def requireDatasetsAccess(datasetIds, user, level=AccessType.WRITE):
         folderModel.requireAccess(dataset, user, level)
 
 
+# Seconds during which a granted dataset access is reused without loading
+# the folder again. Folder and user writes made by this server process drop
+# the affected grants at once; the TTL bounds how long a change made by
+# another process goes unnoticed.
+DATASET_ACCESS_TTL = 5
+DATASET_ACCESS_MAX_ENTRIES = 10000
+
+
+class DatasetAccessCache:
+    """Grants of dataset access levels, keyed by (userId, datasetId, level),
+    each valid for `ttl` seconds. Denials are never cached."""
+
+    def __init__(self, ttl, maxEntries):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.grants = OrderedDict()
+        self.lock = threading.Lock()
+
+    def isGranted(self, key):
+        with self.lock:
+            grantedAt = self.grants.get(key)
+            if grantedAt is None:
+                return False
+            if time.monotonic() - grantedAt > self.ttl:
+                del self.grants[key]
+                return False
+            return True
+
+    def grant(self, key):
+        with self.lock:
+            self.grants[key] = time.monotonic()
+            self.grants.move_to_end(key)
+            while len(self.grants) > self.maxEntries:
+                self.grants.popitem(last=False)
+
+    def forgetDataset(self, datasetId):
+        with self.lock:
+            for key in [key for key in self.grants if key[1] == datasetId]:
+                del self.grants[key]
+
+    def clear(self):
+        with self.lock:
+            self.grants.clear()
+
+    def folderChangedEvent(self, event):
+        if event.info and "_id" in event.info:
+            self.forgetDataset(str(event.info["_id"]))
+
+    def userChangedEvent(self, event):
+        # Admin status and group membership live on the user document
+        self.clear()
+
+    def bindEvents(self):
+        for eventName, handler in (
+            ("model.folder.save.after", self.folderChangedEvent),
+            ("model.folder.remove", self.folderChangedEvent),
+            ("model.user.save.after", self.userChangedEvent),
+            ("model.user.remove", self.userChangedEvent),
+        ):
+            events.bind(eventName, "upenn.datasetAccessCache", handler)
+
+
+datasetAccessCache = DatasetAccessCache(
+    DATASET_ACCESS_TTL, DATASET_ACCESS_MAX_ENTRIES
+)
+
+
+def requireDatasetAccess(datasetId, user, level=AccessType.READ):
+    """Check that a user has an access level on a dataset, like
+    Folder().load(datasetId, user=user, level=level, exc=True), reusing the
+    grants of the last DATASET_ACCESS_TTL seconds.
+
+    :param datasetId: The dataset id, as an ObjectId or a string.
+    :param user: The current user document, or None.
+    :param level: The required AccessType level.
+    :raises AccessException: If the user lacks access to the dataset.
+    :raises ValidationException: If the dataset does not exist.
+    """
+    key = (user["_id"] if user else None, str(datasetId), level)
+    if datasetAccessCache.isGranted(key):
+        return
+    Folder().load(datasetId, user=user, level=level, exc=True)
+    datasetAccessCache.grant(key)
+
+
 def fetchUserEmails(userIds):
     """Bulk-fetch email addresses for a list of user IDs.
 
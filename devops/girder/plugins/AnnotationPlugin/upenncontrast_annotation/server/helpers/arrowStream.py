@@ -0,0 +1,85 @@
+"""Stream Arrow record batches as Arrow IPC or Parquet response bodies.
+
+pyarrow writers expect a seekable file they own until they are closed. The
+sink below only counts and hands out the bytes written so far, so each
+record batch can be sent as soon as it is encoded and memory stays bounded
+by one batch. Parquet footers record absolute offsets, which is why the
+sink keeps track of the position across drains.
+"""
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class _ChunkSink:
+    """Write-only file object that returns what was written since the last
+    drain."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        # pyarrow may reuse the buffer once write returns
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _iterWritten(openWriter, schema, batches):
+    sink = _ChunkSink()
+    writer = openWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iterArrowStream(schema, batches):
+    """Encode record batches in the Arrow IPC streaming format.
+
+    Args:
+        schema (pa.Schema): The schema shared by every batch
+        batches (Iterable[pa.RecordBatch]): The batches to encode
+
+    Returns:
+        Generator[bytes]: The encoded stream, one chunk per batch
+    """
+    return _iterWritten(pa.ipc.new_stream, schema, batches)
+
+
+def iterParquet(schema, batches):
+    """Encode record batches as a Parquet file, one row group per batch.
+
+    Args:
+        schema (pa.Schema): The schema shared by every batch
+        batches (Iterable[pa.RecordBatch]): The batches to encode
+
+    Returns:
+        Generator[bytes]: The encoded file, one chunk per row group
+    """
+    return _iterWritten(pq.ParquetWriter, schema, batches)
@@ -52,6 +52,11 @@ def simpleCentroid(listCoordinates):
     return centroid
 
 
+# The shapes annotationToAnnotationDistance measures: any other shape is at
+# an infinite distance
+MEASURABLE_SHAPES = ("point", "line", "polygon")
+
+
 def isAPoint(annotation):
     return annotation["shape"] == "point"
 
@@ -2,14 +2,195 @@ from girder import events
 from girder.exceptions import ValidationException
 from girder.models.model_base import AccessControlledModel
 
-from pymongo.errors import BulkWriteError, WriteError
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
 
-from upenncontrast_annotation.server.helpers.serialization import \
-    convertIdsToObjectIds
+from upenncontrast_annotation.server.helpers.serialization import (
+    collapseDottedPaths,
+    convertIdsToObjectIds,
+)
+from upenncontrast_annotation.server.models.changeSequence import \
+    DatasetChangeSequence
+from upenncontrast_annotation.server.models.tombstone import DatasetTombstone
 
 
 class CustomNimbusImageModel(AccessControlledModel):
+    # When True, every write advances the per-dataset change sequence (see
+    # models/changeSequence.py): saved documents are stamped with the new
+    # sequence in `changeSeq` and removals leave a tombstone, so clients can
+    # sync only what changed since the sequence they last saw.
+    tracksDatasetChanges = False
+
+    # When True, every write advances the dataset write version once it is
+    # done (see DatasetChangeSequence.writeVersion), which invalidates the
+    # values cached for the dataset (see helpers/datasetCache.py).
+    versionsDatasetWrites = False
+
+    # Fields feeding a per-dataset summary (see models/datasetSummary.py).
+    # When set, writes read these fields of the replaced or removed
+    # documents, and pass them with the written documents to
+    # summarizeChanges().
+    datasetSummaryFields = None
+
+    # Number of ReplaceOne operations sent per bulk_write when saveMany()
+    # updates existing documents.
+    saveManyBatchSize = 1000
+
+    def stampDatasetChanges(self, documents):
+        """Advance the change sequence of the datasets of `documents` once and
+        stamp each document's `changeSeq` with it (in place)."""
+        documents = [
+            document for document in documents if "datasetId" in document
+        ]
+        if not documents:
+            return
+        seqByDataset = DatasetChangeSequence().advance(
+            document["datasetId"] for document in documents
+        )
+        for document in documents:
+            document["changeSeq"] = seqByDataset[document["datasetId"]]
+
+    def recordDatasetRemovals(self, documents):
+        """Advance the change sequence of the datasets of the removed
+        `documents` ({_id, datasetId}) and leave a tombstone for each."""
+        documents = [
+            document for document in documents if "datasetId" in document
+        ]
+        if not documents:
+            return
+        seqByDataset = DatasetChangeSequence().advance(
+            document["datasetId"] for document in documents
+        )
+        DatasetTombstone().record(self.name, documents, seqByDataset)
+
+    def advanceDatasetWriteVersions(self, documents):
+        """Advance the write version of the datasets of the written
+        `documents`, if this model versions dataset writes."""
+        if not self.versionsDatasetWrites:
+            return
+        datasetIds = [
+            document["datasetId"]
+            for document in documents if "datasetId" in document
+        ]
+        if datasetIds:
+            DatasetChangeSequence().advanceWriteVersion(datasetIds)
+
+    def findSummaryFields(self, query, limit=0, paths=None):
+        """The datasetId and datasetSummaryFields of the documents matching
+        `query`, or an empty list when the model has no summary.
+
+        :param paths: The dotted paths a write changes (see updatedPaths).
+            When given, only these parts of the summary fields are read.
+        """
+        if not self.datasetSummaryFields:
+            return []
+        fields = {"datasetId": 1}
+        for field in self.datasetSummaryFields:
+            if paths is None or field in paths:
+                fields[field] = 1
+                continue
+            fields.update({
+                path: 1 for path in paths if path.startswith(field + ".")
+            })
+        return list(self.collection.find(query, fields, limit=limit))
+
+    @staticmethod
+    def updatedPaths(updates):
+        """The dotted paths written by the Mongo update documents of
+        (key, update) `updates`, none of them below another."""
+        return collapseDottedPaths(
+            path
+            for _, update in updates
+            for fields in update.values()
+            for path in fields
+        )
+
+    def summarizeChanges(self, before, after):
+        """Update the per-dataset summary of this model after a write.
+
+        :param before: The previous version of the replaced or removed
+            documents, as returned by findSummaryFields.
+        :param after: The new or replacing documents.
+        """
+
+    def save(self, document, validate=True, triggerEvents=True):
+        if self.datasetSummaryFields and validate:
+            # Validate ahead of the base save, in the same order: it may
+            # merge the document into an existing one (giving it that _id),
+            # whose previous version is read below.
+            if triggerEvents:
+                event = events.trigger(
+                    ".".join(("model", self.name, "validate")), document
+                )
+                validate = not event.defaultPrevented
+            if validate:
+                document = self.validate(document)
+            validate = False
+        if self.tracksDatasetChanges:
+            self.stampDatasetChanges([document])
+        before = self.findSummaryFields(
+            {"_id": document["_id"]}, limit=1
+        ) if "_id" in document else []
+        document = super().save(document, validate, triggerEvents)
+        if self.datasetSummaryFields:
+            self.summarizeChanges(before, [document])
+        self.advanceDatasetWriteVersions([document])
+        return document
+
+    def remove(self, document, **kwargs):
+        before = self.findSummaryFields({"_id": document["_id"]}, limit=1)
+        result = super().remove(document, **kwargs)
+        if self.tracksDatasetChanges and result is not None:
+            self.recordDatasetRemovals([document])
+        if self.datasetSummaryFields:
+            self.summarizeChanges(before, [])
+        self.advanceDatasetWriteVersions([document])
+        return result
+
+    def removeWithQuery(self, query):
+        if not (self.tracksDatasetChanges or self.versionsDatasetWrites
+                or self.datasetSummaryFields):
+            return super().removeWithQuery(query)
+        removed = self.findSummaryFields(query) or list(
+            self.collection.find(query, {"datasetId": 1})
+        )
+        result = super().removeWithQuery(query)
+        if self.tracksDatasetChanges:
+            self.recordDatasetRemovals(removed)
+        if self.datasetSummaryFields:
+            self.summarizeChanges(removed, [])
+        self.advanceDatasetWriteVersions(removed)
+        return result
+
+    def removeDataset(self, datasetId):
+        """Remove the documents of a removed dataset. Unlike removeWithQuery,
+        leaves no tombstones and updates no summary or write version: these
+        are removed with the dataset."""
+        return self.collection.delete_many({"datasetId": datasetId})
+
+    def update(self, query, update, multi=True, summarize=True):
+        """Update the documents matching `query`.
+
+        :param summarize: False when the caller applies the change to the
+            dataset summary itself, which skips reading the summary fields
+            of the documents before and after the update.
+        """
+        summarize = summarize and self.datasetSummaryFields
+        if not (self.versionsDatasetWrites or summarize):
+            return super().update(query, update, multi)
+        limit = 0 if multi else 1
+        updated = (summarize and self.findSummaryFields(
+            query, limit=limit
+        )) or list(self.collection.find(query, {"datasetId": 1}, limit=limit))
+        result = super().update(query, update, multi)
+        if summarize and updated:
+            self.summarizeChanges(updated, self.findSummaryFields(
+                {"_id": {"$in": [document["_id"] for document in updated]}}
+            ))
+        self.advanceDatasetWriteVersions(updated)
+        return result
+
     def saveMany(self, documents, validate=True, triggerEvents=True):
         """
         Create or update several documents in the collection. If a single
@@ -46,38 +227,150 @@ class CustomNimbusImageModel(AccessControlledModel):
             if event.defaultPrevented:
                 return documents
 
-        idsToRemove = [
-            ObjectId(document["_id"])
-            for document in documents
-            if "_id" in document
-        ]
-        if len(idsToRemove) > 0:
-            try:
-                self.removeWithQuery({"_id": {"$in": idsToRemove}})
-            except WriteError as e:
-                raise ValidationException(
-                    "Database save many failed while deleting duplicate keys: "
-                    + e.details
-                )
+        if self.tracksDatasetChanges:
+            self.stampDatasetChanges(documents)
+
+        toReplace = []
+        toInsert = []
+        for document in documents:
+            if "_id" in document:
+                document["_id"] = ObjectId(document["_id"])
+                toReplace.append(document)
+            else:
+                toInsert.append(document)
 
+        replacedIds = [document["_id"] for document in toReplace]
+        before = self.findSummaryFields(
+            {"_id": {"$in": replacedIds}}
+        ) if replacedIds else []
         try:
-            documentIds = self.collection.insert_many(documents).inserted_ids
+            self.replaceMany(toReplace)
+            if toInsert:
+                self.collection.insert_many(toInsert)
         except BulkWriteError as e:
             raise ValidationException(
-                "Database save many failed: " + e.details
+                "Database save many failed: " + str(e.details)
             )
 
-        for document, documentId in zip(documents, documentIds):
-            document["_id"] = documentId
+        if self.datasetSummaryFields:
+            self.summarizeChanges(before, documents)
+        self.advanceDatasetWriteVersions(documents)
 
         if triggerEvents:
             events.trigger(
                 "model.%s.saveMany.after" % self.name,
-                {"newDocuments": documents, "removedIds": idsToRemove},
+                {"newDocuments": documents, "removedIds": replacedIds},
             )
 
         return documents
 
+    def replaceMany(self, documents, batchSize=None):
+        """
+        Replace documents in place by _id, inserting those that do not exist
+        yet. Writes go out as unordered bulk_write batches of ReplaceOne
+        upserts, so each index entry is rewritten once instead of deleted
+        and reinserted. No validation or events; see saveMany().
+
+        :param documents: The documents to write, each with an ObjectId _id.
+        :type documents: list of dict
+        :param batchSize: Operations per bulk_write. Defaults to
+            saveManyBatchSize.
+        :type batchSize: int
+        """
+        batchSize = batchSize or self.saveManyBatchSize
+        for start in range(0, len(documents), batchSize):
+            self.collection.bulk_write(
+                [
+                    ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+                    for document in documents[start:start + batchSize]
+                ],
+                ordered=False,
+            )
+
+    def upsertMany(self, keyField, updates, batchSize=None):
+        """
+        Apply an update to the document identified by each key, inserting
+        the documents that do not exist yet. Writes go out as unordered
+        bulk_write batches of UpdateOne upserts, so only the updated fields
+        are written and concurrent updates of different fields of a document
+        do not overwrite each other. No validation or events.
+
+        Models tracking dataset changes stamp each document with the change
+        sequence of its dataset: the datasetId the update sets, or else the
+        one of the existing document, or the one inserted.
+
+        :param keyField: The field identifying a document, e.g. annotationId.
+        :type keyField: str
+        :param updates: (key, update) pairs, where update is a Mongo update
+            document such as {"$set": {...}}.
+        :type updates: list of tuple
+        :param batchSize: Operations per bulk_write. Defaults to
+            saveManyBatchSize.
+        :type batchSize: int
+        """
+        if len(updates) == 0:
+            return
+        query = {keyField: {"$in": [key for key, _ in updates]}}
+        # The summary only changes where the updates write
+        paths = self.updatedPaths(updates)
+        before = self.findSummaryFields(query, paths=paths)
+        if self.tracksDatasetChanges:
+            updates = self.stampUpserts(keyField, query, updates)
+        batchSize = batchSize or self.saveManyBatchSize
+        try:
+            for start in range(0, len(updates), batchSize):
+                self.collection.bulk_write(
+                    [
+                        UpdateOne({keyField: key}, update, upsert=True)
+                        for key, update in updates[start:start + batchSize]
+                    ],
+                    ordered=False,
+                )
+        except BulkWriteError as e:
+            raise ValidationException(
+                "Database upsert many failed: " + str(e.details)
+            )
+        after = self.findSummaryFields(query, paths=paths) or list(
+            self.collection.find(query, {"datasetId": 1})
+        )
+        if self.datasetSummaryFields:
+            self.summarizeChanges(before, after)
+        self.advanceDatasetWriteVersions(after)
+
+    def stampUpserts(self, keyField, query, updates):
+        """The `updates` of upsertMany, each also setting the changeSeq of
+        the dataset of its document. Documents of no known dataset are not
+        stamped, like in stampDatasetChanges."""
+        datasetIds = {
+            document[keyField]: document["datasetId"]
+            for document in self.collection.find(
+                query, {keyField: 1, "datasetId": 1}
+            )
+            if "datasetId" in document
+        }
+        documents = []
+        for key, update in updates:
+            # $setOnInsert only applies to the documents that do not exist
+            datasetId = update.get("$set", {}).get(
+                "datasetId",
+                datasetIds.get(
+                    key, update.get("$setOnInsert", {}).get("datasetId")
+                ),
+            )
+            document = {"key": key}
+            if datasetId is not None:
+                document["datasetId"] = datasetId
+            documents.append(document)
+        self.stampDatasetChanges(documents)
+        stamped = []
+        for document, (key, update) in zip(documents, updates):
+            if "changeSeq" in document:
+                update = dict(update, **{"$set": dict(
+                    update.get("$set", {}), changeSeq=document["changeSeq"]
+                )})
+            stamped.append((key, update))
+        return stamped
+
     def getUpdatableFields(self):
         """Return the set of fields that may be modified via update.
 
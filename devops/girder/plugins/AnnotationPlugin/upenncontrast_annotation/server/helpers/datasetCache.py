@@ -0,0 +1,60 @@
+"""In-process caches of values computed from the documents of a dataset.
+
+An entry is stored with the write version of its dataset (see
+DatasetChangeSequence.writeVersion), read before the value is computed. Any
+later write to a versioned model advances the version, so the entry is
+recomputed on its next read instead of being invalidated explicitly. Each
+server process has its own cache; all of them read the version from the
+database, so they never serve a value older than the last write.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import orjson
+
+from ..models.changeSequence import DatasetChangeSequence
+from .serialization import orJsonDefaults
+
+
+def hashKey(value):
+    """Stable hash of a JSON-like value (dict keys are sorted), to key
+    caches on request parameters such as list filters."""
+    return hashlib.sha1(orjson.dumps(
+        value, default=orJsonDefaults, option=orjson.OPT_SORT_KEYS
+    )).hexdigest()
+
+
+class DatasetVersionedCache:
+    """LRU cache of at most `maxEntries` values, each keyed by a dataset id
+    and a hashable key, and valid for one dataset write version."""
+
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getOrCompute(self, datasetId, key, compute):
+        """Return the cached value of (datasetId, key) if the dataset has
+        not been written since it was computed, else compute() it and cache
+        the result."""
+        version = DatasetChangeSequence().writeVersion(datasetId)
+        cacheKey = (datasetId, key)
+        with self.lock:
+            entry = self.entries.get(cacheKey)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(cacheKey)
+                return entry[1]
+
+        value = compute()
+        with self.lock:
+            self.entries[cacheKey] = (version, value)
+            self.entries.move_to_end(cacheKey)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,115 @@
+"""Vectorized geometry over batches of annotations.
+
+The coordinates of a batch of annotations are packed once into a ragged
+buffer: a single float64 array holding every point, and the offsets at which
+each annotation's points start. Centroids and distances are then computed
+with array operations instead of one Python loop per annotation.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# offsets: int64 [N + 1], annotation i owns the points offsets[i]:offsets[i+1]
+# xy: float64 [M, 2], the x and y of every point
+# z: float64 [M], the z of every point, NaN for points without one
+CoordinateBuffer = namedtuple("CoordinateBuffer", ["offsets", "xy", "z"])
+
+
+def coordinateBuffer(coordinateLists):
+    """Pack lists of point coordinates ({x, y, z?}), one list per
+    annotation, into a CoordinateBuffer.
+
+    Args:
+        coordinateLists (list[dict[]]): The coordinates of each annotation
+
+    Returns:
+        CoordinateBuffer: The packed coordinates
+    """
+    counts = np.fromiter(
+        (len(coordinates) for coordinates in coordinateLists),
+        dtype=np.int64,
+        count=len(coordinateLists),
+    )
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    points = [
+        point for coordinates in coordinateLists for point in coordinates
+    ]
+    xy = np.array(
+        [(point["x"], point["y"]) for point in points], dtype=np.float64
+    ).reshape(-1, 2)
+    z = np.array(
+        [point.get("z", np.nan) for point in points], dtype=np.float64
+    )
+    return CoordinateBuffer(offsets, xy, z)
+
+
+def centroids(buffer):
+    """Compute the simple centroid (mean of the points) of every annotation
+    of a CoordinateBuffer, like helpers.connections.simpleCentroid.
+
+    Args:
+        buffer (CoordinateBuffer): The packed coordinates
+
+    Returns:
+        Tuple(np.ndarray, np.ndarray): The [N, 2] x, y centroids and the [N]
+            z centroids. A z centroid is NaN unless all the points of the
+            annotation have a z. Annotations without points get NaN.
+    """
+    counts = np.diff(buffer.offsets)
+    starts = buffer.offsets[:-1][counts > 0]
+    xySums = np.zeros((len(counts), 2), dtype=np.float64)
+    zSums = np.zeros(len(counts), dtype=np.float64)
+    if len(starts) > 0:
+        # Empty annotations are skipped: each remaining segment ends where
+        # the next non-empty one starts
+        xySums[counts > 0] = np.add.reduceat(buffer.xy, starts, axis=0)
+        # A single missing z makes the sum NaN
+        zSums[counts > 0] = np.add.reduceat(buffer.z, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return xySums / counts[:, np.newaxis], zSums / counts
+
+
+def distances(fromXY, fromZ, toXY, toZ):
+    """Compute point to point distances, broadcasting over the leading
+    dimensions. Like helpers.connections.pointToPointDistance, the z
+    difference only counts where both points have a z (not NaN).
+
+    Use the centroids of annotations as points to get point to centroid or
+    centroid to centroid distances; the centroid of a point annotation is
+    the point itself.
+
+    Args:
+        fromXY (np.ndarray): [..., 2] x, y of the first points
+        fromZ (np.ndarray): [...] z of the first points
+        toXY (np.ndarray): [..., 2] x, y of the second points
+        toZ (np.ndarray): [...] z of the second points
+
+    Returns:
+        np.ndarray: The distances, with the broadcast shape of the inputs
+    """
+    squareDist = np.sum(
+        np.square(np.asarray(toXY) - np.asarray(fromXY)), axis=-1
+    )
+    squareZ = np.square(np.asarray(toZ) - np.asarray(fromZ))
+    return np.sqrt(squareDist + np.where(np.isnan(squareZ), 0, squareZ))
+
+
+def boundingBoxes(buffer):
+    """Compute the axis-aligned bounding box of every annotation of a
+    CoordinateBuffer, like Annotation.boundingBox.
+
+    Args:
+        buffer (CoordinateBuffer): The packed coordinates, with at least one
+            point per annotation
+
+    Returns:
+        Tuple(np.ndarray, np.ndarray): The [N, 2] x, y minimums and the
+            [N, 2] x, y maximums
+    """
+    starts = buffer.offsets[:-1]
+    return (
+        np.minimum.reduceat(buffer.xy, starts, axis=0),
+        np.maximum.reduceat(buffer.xy, starts, axis=0),
+    )
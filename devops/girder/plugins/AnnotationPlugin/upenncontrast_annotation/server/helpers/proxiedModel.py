@@ -1,7 +1,8 @@
 from girder import events
 from girder.api import rest
-from girder.exceptions import AccessException
+from girder.exceptions import AccessException, RestException
 from .customModel import CustomNimbusImageModel
+from .serialization import collapseDottedPaths, overlayDottedPaths
 
 from ..models.history import History as HistoryModel
 
@@ -37,8 +38,13 @@ class recordable:
     """
     A decorator which makes a function able to record the write operations on
     the database
+
+    Requests sharing a `historyGroup` query parameter (e.g. the chunks of one
+    client upload) are recorded in a single history entry, undone at once.
     """
 
+    maxHistoryGroupLength = 64
+
     def __init__(self, actionName, findDatasetIdFn):
         self.historyModel: HistoryModel = HistoryModel()
         self.actionName = actionName
@@ -54,6 +60,13 @@ class recordable:
             if datasetId is None:
                 return fun(*args, **kwargs)
 
+            group = (kwargs.get("params") or {}).get("historyGroup")
+            if group is not None and (
+                not isinstance(group, str)
+                or not 0 < len(group) <= self.maxHistoryGroupLength
+            ):
+                raise RestException("Invalid historyGroup")
+
             # Wrap original endpoint between a start and a stop recording.
             # The finally ensures stopRecording fires even on failure so the
             # model's recording state never leaks across requests.
@@ -76,7 +89,10 @@ class recordable:
                 "isUndone": False,
                 "datasetId": ObjectId(datasetId),
             }
-            self.historyModel.create(user, document, record)
+            if group is not None:
+                self.historyModel.createInGroup(user, document, record, group)
+            else:
+                self.historyModel.create(user, document, record)
 
             return val
 
@@ -88,12 +104,14 @@ class ModelRecord:
     A record of changes made to the database
     "changes" associates a string id (not an ObjectId) with a dict:
     { 'before': document or None, 'after': document or None }
+    and 'paths' when before and after are partial copies of the document,
+    only holding these dotted paths
     """
 
     def __init__(self):
         self.changes = {}
 
-    def changeDocument(self, before, after):
+    def changeDocument(self, before, after, paths=None):
         doc_with_id = (
             before
             if before is not None
@@ -103,11 +121,32 @@ class ModelRecord:
             return
         doc_id = doc_with_id["_id"]
         old_change = self.changes.get(doc_id, None)
-        if old_change:
-            # old_change['after'] == before
-            old_change["after"] = after
-        else:
+        if old_change is None:
             self.changes[doc_id] = {"before": before, "after": after}
+            if paths is not None:
+                self.changes[doc_id]["paths"] = list(paths)
+            return
+        old_paths = old_change.get("paths")
+        if old_paths is not None and paths is None:
+            # A full copy of the document: complete the partial change
+            if before is not None and old_change["before"] is not None:
+                old_change["before"] = overlayDottedPaths(
+                    before, old_change["before"], old_paths
+                )
+            del old_change["paths"]
+        elif old_paths is not None:
+            # Two partial changes: the first before of each path, and the
+            # last after
+            if old_change["before"] is not None:
+                old_change["before"] = overlayDottedPaths(
+                    before or {}, old_change["before"], old_paths
+                )
+            after = overlayDottedPaths(old_change["after"], after, paths)
+            old_change["paths"] = collapseDottedPaths(old_paths + paths)
+        # A partial change following a full one is completed by the caller
+        # (see ProxiedModel.recordChange)
+        # old_change['after'] == before
+        old_change["after"] = after
 
 
 class ProxiedModel(CustomNimbusImageModel):
@@ -115,6 +154,9 @@ class ProxiedModel(CustomNimbusImageModel):
     Enable recording of changes made to the database
     """
 
+    # Number of updated documents read back per query when recording
+    recordBatchSize = 50000
+
     def __init__(self):
         events.bind(
             "proxiedModel.startRecording",
@@ -169,17 +211,28 @@ class ProxiedModel(CustomNimbusImageModel):
             self.record.changeDocument(before, None)
         return super().remove(document, **kwargs)
 
-    def update(self, query, update, multi=True):
-        if self.is_recording:
-            docs_before = self.find(query)
-            for before in docs_before:
-                self.record.changeDocument(before, None)
-            val = super().update(query, update, multi)
-            docs_after = self.find(query)
-            for after in docs_after:
-                self.record.changeDocument(None, after)
-            return val
-        return super().update(query, update, multi)
+    def update(self, query, update, multi=True, **kwargs):
+        if not self.is_recording:
+            return super().update(query, update, multi, **kwargs)
+        paths = self.recordedPaths(update)
+        fields = self.recordedFields(paths)
+        docs_before = {
+            before["_id"]: before
+            for before in self.find(
+                query, limit=0 if multi else 1, fields=fields
+            )
+        }
+        val = super().update(query, update, multi, **kwargs)
+        # Look the documents up again by id, in batches: the update may have
+        # changed the fields the query matched on
+        ids = list(docs_before)
+        for start in range(0, len(ids), self.recordBatchSize):
+            for after in self.find(
+                {"_id": {"$in": ids[start:start + self.recordBatchSize]}},
+                fields=fields,
+            ):
+                self.recordChange(docs_before[after["_id"]], after, paths)
+        return val
 
     def save(self, document, validate=True, triggerEvents=True):
         if self.is_recording:
@@ -192,10 +245,73 @@ class ProxiedModel(CustomNimbusImageModel):
         return super().save(document, validate, triggerEvents)
 
     def saveMany(self, documents, validate=True, triggerEvents=True):
+        if not self.is_recording:
+            return super().saveMany(documents, validate, triggerEvents)
+        # Existing documents are replaced in place, so capture their previous
+        # version before it is overwritten
+        existingIds = [
+            ObjectId(document["_id"])
+            for document in documents
+            if "_id" in document
+        ]
+        docs_before = (
+            list(self.find({"_id": {"$in": existingIds}}))
+            if existingIds else []
+        )
         new_documents = super().saveMany(documents, validate, triggerEvents)
-        if self.is_recording:
-            # No need to record the removal of existing documents as
-            # saveMany() calls removeWithQuery() which records the removal
-            for after in new_documents:
-                self.record.changeDocument(None, after)
+        for before in docs_before:
+            self.record.changeDocument(before, None)
+        for after in new_documents:
+            self.record.changeDocument(None, after)
         return new_documents
+
+    def upsertMany(self, keyField, updates, **kwargs):
+        if not self.is_recording:
+            return super().upsertMany(keyField, updates, **kwargs)
+        paths = self.updatedPaths(updates)
+        fields = self.recordedFields(paths, keyField)
+        query = {keyField: {"$in": [key for key, _ in updates]}}
+        docs_before = {
+            before["_id"]: before for before in self.find(query, fields=fields)
+        }
+        val = super().upsertMany(keyField, updates, **kwargs)
+        for after in self.find(query, fields=fields):
+            self.recordChange(docs_before.get(after["_id"]), after, paths)
+        return val
+
+    @classmethod
+    def recordedPaths(cls, update):
+        """The dotted paths written by a Mongo update document, or None when
+        they are not plain paths ($rename, positional operators) and the
+        whole documents are recorded."""
+        if "$rename" in update:
+            return None
+        paths = cls.updatedPaths([(None, update)])
+        if any("$" in path for path in paths):
+            return None
+        return paths
+
+    @staticmethod
+    def recordedFields(paths, *keys):
+        """The projection of the documents recorded for a write of `paths`,
+        or None for whole documents. Only the written paths change, so the
+        records are partial copies holding only these (and `keys`)."""
+        if paths is None:
+            return None
+        return {path: 1 for path in collapseDottedPaths(paths + list(keys))}
+
+    def recordChange(self, before, after, paths):
+        """Record a document written by an update of `paths` (see
+        recordedPaths), from copies projected with recordedFields."""
+        if paths is None:
+            self.record.changeDocument(before, None)
+            self.record.changeDocument(None, after)
+            return
+        change = self.record.changes.get(after["_id"])
+        if change is not None and "paths" not in change:
+            # Already recorded in full by an earlier write of the request
+            self.record.changeDocument(
+                None, self.findOne({"_id": after["_id"]})
+            )
+        else:
+            self.record.changeDocument(before, after, paths)
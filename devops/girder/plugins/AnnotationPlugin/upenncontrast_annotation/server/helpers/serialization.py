@@ -1,5 +1,11 @@
+import copy
+
+import orjson
 from bson import ObjectId
 
+# Number of encoded elements joined into each chunk of a streamed response
+JSON_CHUNK_ITEMS = 1000
+
 
 def orJsonDefaults(obj):
     if isinstance(obj, ObjectId):
@@ -7,6 +13,46 @@ def orJsonDefaults(obj):
     raise ValueError("Type not supported")
 
 
+def iterJsonChunks(encodedItems, prefix=b"[", suffix=b"]"):
+    """Join already encoded JSON elements with commas, wrapped in
+    `prefix`/`suffix`, yielding bytes every JSON_CHUNK_ITEMS elements so a
+    response can be streamed with bounded memory."""
+    chunk = [prefix]
+    first = True
+    for encoded in encodedItems:
+        if not first:
+            chunk.append(b",")
+        chunk.append(encoded)
+        first = False
+        if len(chunk) > JSON_CHUNK_ITEMS:
+            yield b"".join(chunk)
+            chunk = []
+    chunk.append(suffix)
+    yield b"".join(chunk)
+
+
+def iterJsonArray(items, prefix=b"[", suffix=b"]", default=None):
+    """Yield `items` as a streamed JSON array, see iterJsonChunks."""
+    return iterJsonChunks(
+        (orjson.dumps(item, default=default) for item in items),
+        prefix,
+        suffix,
+    )
+
+
+def iterJsonObject(pairs, prefix=b"{", suffix=b"}", default=None):
+    """Yield (key, value) `pairs` as a streamed JSON object, see
+    iterJsonChunks. Keys must be strings."""
+    return iterJsonChunks(
+        (
+            orjson.dumps(key) + b":" + orjson.dumps(value, default=default)
+            for key, value in pairs
+        ),
+        prefix,
+        suffix,
+    )
+
+
 def convertIdsToObjectIds(objOrObjs, keysToConvert):
     def convertIds(obj, keysToConvert):
         for keyToConvert in keysToConvert:
@@ -16,3 +62,64 @@ def convertIdsToObjectIds(objOrObjs, keysToConvert):
     if isinstance(objOrObjs, dict):
         return convertIds(objOrObjs, keysToConvert)
     return [convertIds(obj, keysToConvert) for obj in objOrObjs]
+
+
+# Returned by getDottedPath for a path that is not in the document
+MISSING = object()
+
+
+def getDottedPath(document, path):
+    """The value at a Mongo dotted `path` of `document`, or MISSING."""
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def setDottedPath(document, path, value):
+    """Set the value at a Mongo dotted `path` of `document`, in place."""
+    *parents, last = path.split(".")
+    for key in parents:
+        if not isinstance(document.get(key), dict):
+            document[key] = {}
+        document = document[key]
+    document[last] = value
+
+
+def unsetDottedPath(document, path):
+    """Remove the value at a Mongo dotted `path` of `document`, in place."""
+    *parents, last = path.split(".")
+    for key in parents:
+        document = document.get(key)
+        if not isinstance(document, dict):
+            return
+    document.pop(last, None)
+
+
+def collapseDottedPaths(paths):
+    """The `paths` that are not below another of them, sorted, so that they
+    can be projected together."""
+    collapsed = set()
+    for path in sorted(set(paths), key=lambda path: path.count(".")):
+        keys = path.split(".")
+        if not any(
+            ".".join(keys[:length]) in collapsed
+            for length in range(1, len(keys))
+        ):
+            collapsed.add(path)
+    return sorted(collapsed)
+
+
+def overlayDottedPaths(document, source, paths):
+    """A copy of `document` where each of `paths` has its value in `source`,
+    or is removed when `source` does not have it."""
+    document = copy.deepcopy(document)
+    for path in paths:
+        value = getDottedPath(source, path)
+        if value is MISSING:
+            unsetDottedPath(document, path)
+        else:
+            setDottedPath(document, path, copy.deepcopy(value))
+    return document
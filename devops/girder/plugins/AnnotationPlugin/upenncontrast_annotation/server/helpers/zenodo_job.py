@@ -542,7 +542,7 @@ def _build_annotation_json(
         ))
 
     # Get property values
-    # (same pattern as export.py _getPropertyValues)
+    # (same pattern as export.py _iterPropertyValues)
     prop_values = {}
     for doc in property_values_model.find(
         {'datasetId': ds_oid}
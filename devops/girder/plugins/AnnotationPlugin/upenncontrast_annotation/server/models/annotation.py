@@ -1,7 +1,11 @@
+import base64
 import re
 
 import fastjsonschema
+import numpy as np
 
+from bson import decode as bsonDecode, encode as bsonEncode
+from bson.errors import BSONError
 from bson.objectid import ObjectId
 
 from girder import events
@@ -11,10 +15,15 @@ from girder.models.folder import Folder
 
 from girder.utility.acl_mixin import AccessControlMixin
 
+from ..helpers import geometry
+from ..helpers.datasetCache import DatasetVersionedCache, hashKey
 from ..helpers.fastjsonschema import customJsonSchemaCompile
 from ..helpers.proxiedModel import ProxiedModel
 from ..helpers.tasks import runJobRequest
+from .datasetSummary import DatasetSummary
+from .propertyValueIndex import PropertyValueIndex
 from .propertyValues import AnnotationPropertyValues
+from .tombstone import DatasetTombstone
 
 # Bound any single aggregation's DB runtime so one expensive query (e.g. over a
 # 700K-annotation public dataset) can't run unbounded and pin a Mongo
@@ -23,6 +32,27 @@ from .propertyValues import AnnotationPropertyValues
 AGGREGATION_MAX_TIME_MS = 300000
 DEFAULT_AGGREGATE_HINT = {"datasetId": 1, "_id": 1}
 
+# Compound index backing the viewport query: equality on the dataset and
+# location, then the persisted bounding box so every intersection bound is
+# checked on index keys rather than by fetching the documents.
+VIEWPORT_INDEX = [
+    ("datasetId", SortDir.ASCENDING),
+    ("location.XY", SortDir.ASCENDING),
+    ("location.Z", SortDir.ASCENDING),
+    ("location.Time", SortDir.ASCENDING),
+    ("bbox.minX", SortDir.ASCENDING),
+    ("bbox.maxX", SortDir.ASCENDING),
+    ("bbox.minY", SortDir.ASCENDING),
+    ("bbox.maxY", SortDir.ASCENDING),
+]
+CHANGE_SEQ_INDEX = [
+    ("datasetId", SortDir.ASCENDING),
+    ("changeSeq", SortDir.ASCENDING),
+]
+
+# List totals by (dataset, filters), for the current dataset write version
+LIST_COUNT_CACHE = DatasetVersionedCache(maxEntries=10000)
+
 
 class AnnotationSchema:
     coordSchema = {
@@ -104,6 +134,19 @@ class Annotation(AccessControlMixin, ProxiedModel):
     # Collection joined by the property-value $lookup stages.
     PROPERTY_VALUES_COLLECTION = "annotation_property_values"
 
+    # Pages of at least this many rows get their property values from one
+    # findByAnnotationIds query after the page is read, rather than from a
+    # $lookup probing the values once per row inside the aggregation.
+    # Smaller pages keep the $lookup, which saves the second round trip.
+    APP_JOIN_MIN_ROWS = 20
+
+    # Stamp writes with the dataset change sequence for delta stub syncs.
+    tracksDatasetChanges = True
+    # Invalidate cached list totals on writes.
+    versionsDatasetWrites = True
+    # Count annotations by shape and tags in the dataset summary.
+    datasetSummaryFields = ("shape", "tags")
+
     def __init__(self):
         super().__init__()
         compoundSearchIndex = (
@@ -111,6 +154,8 @@ class Annotation(AccessControlMixin, ProxiedModel):
             ('_id', SortDir.ASCENDING)
         )
         self.ensureIndices([(compoundSearchIndex, {}),
+                            (VIEWPORT_INDEX, {}),
+                            (CHANGE_SEQ_INDEX, {}),
                             "name", "datasetId", "channel", "location"])
 
         # Used by Girder to define what field are used to check permissions
@@ -174,38 +219,140 @@ class Annotation(AccessControlMixin, ProxiedModel):
 
     def cleanOrphaned(self, event):
         if event.info and event.info["_id"]:
-            query = {
-                "datasetId": event.info["_id"],
-            }
-            self.removeWithQuery(query)
-
-    def isDatasetId(self, datasetId):
-        folder = Folder().load(datasetId, force=True)
-        return (
-            folder is not None
-            and "meta" in folder
-            and folder["meta"].get("subtype", None) == "contrastDataset"
-        )
+            self.removeDataset(event.info["_id"])
+
+    @staticmethod
+    def boundingBox(coordinates):
+        """Axis-aligned bounding box of a coordinate list, as
+        {minX, minY, maxX, maxY}. Persisted on every annotation (see
+        validateMultiple) so viewport queries can match on it."""
+        xs = [coordinate["x"] for coordinate in coordinates]
+        ys = [coordinate["y"] for coordinate in coordinates]
+        return {
+            "minX": min(xs),
+            "minY": min(ys),
+            "maxX": max(xs),
+            "maxY": max(ys),
+        }
+
+    @classmethod
+    def spatialFields(cls, coordinates):
+        """The derived geometry persisted on every annotation: bbox, centroid
+        (mean of the coordinates) and estimatedRadius (half the larger bbox
+        side, matching the frontend estimateAnnotationRadius). Stored at write
+        time so stub and list queries never aggregate over coordinates."""
+        bbox = cls.boundingBox(coordinates)
+        count = len(coordinates)
+        return {
+            "bbox": bbox,
+            "centroid": {
+                "x": sum(coordinate["x"] for coordinate in coordinates)
+                / count,
+                "y": sum(coordinate["y"] for coordinate in coordinates)
+                / count,
+            },
+            "estimatedRadius": max(
+                bbox["maxX"] - bbox["minX"], bbox["maxY"] - bbox["minY"]
+            ) / 2,
+        }
 
     def validate(self, document):
         return self.validateMultiple([document])[0]
 
     def validateMultiple(self, annotations):
-        # Validate using the schema
-        try:
-            for annotation in annotations:
-                self.jsonValidate(annotation)
-        except fastjsonschema.JsonSchemaValueException as exp:
-            raise ValidationException(exp)
+        # Most bulk uploads are well formed: run the full schema validation
+        # only when the cheap checks fail, to raise its detailed error
+        if not self._passesFastChecks(annotations):
+            try:
+                for annotation in annotations:
+                    self.jsonValidate(annotation)
+            except fastjsonschema.JsonSchemaValueException as exp:
+                raise ValidationException(exp)
+
+        # Derived spatial fields: recomputed on every save/saveMany (both go
+        # through here), so they always track the current coordinates.
+        self._setSpatialFields(annotations)
+
+        # Check if the datasets exist, in one query
+        datasetIds = list(
+            set(annotation["datasetId"] for annotation in annotations)
+        )
+        datasetCount = Folder().collection.count_documents({
+            "_id": {"$in": datasetIds},
+            "meta.subtype": "contrastDataset",
+        })
+        if datasetCount != len(datasetIds):
+            raise ValidationException("Annotation dataset ID is invalid")
+
+        return annotations
 
-        # Check if the datasets exist
-        datasetIds = set(annotation["datasetId"] for annotation in annotations)
+    _FAST_SHAPES = frozenset(AnnotationSchema.shapeSchema["enum"])
+    _FAST_NUMBER_TYPES = frozenset((int, float))
 
-        for datasetId in datasetIds:
-            if not self.isDatasetId(datasetId):
-                raise ValidationException("Annotation dataset ID is invalid")
+    def _passesFastChecks(self, annotations):
+        """Whether the annotations certainly satisfy annotationSchema.
 
-        return annotations
+        Only exact types are accepted (bool is an int subclass but not a
+        JSON number), so a False may still be valid: the caller then runs
+        the full schema validation.
+        """
+        shapes = self._FAST_SHAPES
+        try:
+            for annotation in annotations:
+                location = annotation["location"]
+                tags = annotation["tags"]
+                color = annotation.get("color")
+                if not (
+                    type(annotation["coordinates"]) is list
+                    and annotation["coordinates"]
+                    and type(tags) is list
+                    and all(type(tag) is str for tag in tags)
+                    and type(annotation["channel"]) is int
+                    and type(location) is dict
+                    and all(
+                        type(location[key]) is int
+                        for key in ("XY", "Z", "Time") if key in location
+                    )
+                    and type(annotation["shape"]) is str
+                    and annotation["shape"] in shapes
+                    and type(annotation["datasetId"]) is ObjectId
+                    and type(annotation.get("name", "")) is str
+                    and (color is None or type(color) is str)
+                ):
+                    return False
+            points = [
+                point
+                for annotation in annotations
+                for point in annotation["coordinates"]
+            ]
+            if set(map(type, points)) != {dict}:
+                return False
+            # x and y are required, z optional
+            values = [point["x"] for point in points]
+            values += [point["y"] for point in points]
+            values += [point["z"] for point in points if "z" in point]
+        except (KeyError, TypeError):
+            return False
+        return set(map(type, values)) <= self._FAST_NUMBER_TYPES
+
+    def _setSpatialFields(self, annotations):
+        """Set the fields of spatialFields on every annotation, computed
+        with array operations over all the coordinates at once."""
+        buffer = geometry.coordinateBuffer(
+            [annotation["coordinates"] for annotation in annotations]
+        )
+        xy, _ = geometry.centroids(buffer)
+        mins, maxs = geometry.boundingBoxes(buffer)
+        radii = np.max(maxs - mins, axis=1) / 2
+        for annotation, (minX, minY), (maxX, maxY), (x, y), radius in zip(
+            annotations, mins.tolist(), maxs.tolist(), xy.tolist(),
+            radii.tolist(),
+        ):
+            annotation["bbox"] = {
+                "minX": minX, "minY": minY, "maxX": maxX, "maxY": maxY,
+            }
+            annotation["centroid"] = {"x": x, "y": y}
+            annotation["estimatedRadius"] = radius
 
     def create(self, annotation):
         annotation.pop('_id', None)
@@ -262,42 +409,95 @@ class Annotation(AccessControlMixin, ProxiedModel):
         runtime-bound _aggregate options live with the other list aggregations.
         """
         match = {"datasetId": datasetId}
+        match.update(self._stubFilter(shape, tags))
+        return self._aggregate(self.collection, self._stubsPipeline(match))
+
+    def _stubFilter(self, shape, tags):
+        match = {}
         if shape:
             match["shape"] = shape
         if tags:
             match["tags"] = {"$all": tags}
+        return match
 
-        pipeline = [
+    def _stubsPipeline(self, match):
+        return [
             {"$match": match},
             {"$addFields": {
-                "centroid": {
-                    "x": {"$avg": "$coordinates.x"},
-                    "y": {"$avg": "$coordinates.y"},
-                },
-                # Half the larger bounding-box side. Matches the frontend
-                # estimateAnnotationRadius so the stub circle tracks the
-                # annotation's footprint; the previous bbox-diagonal/2
-                # circumscribed the box and overshot the real size by up to
-                # sqrt(2) (a square cell rendered ~41% too large).
-                "estimatedRadius": {
-                    "$divide": [
-                        {"$max": [
-                            {"$subtract": [
-                                {"$max": "$coordinates.x"},
-                                {"$min": "$coordinates.x"},
-                            ]},
-                            {"$subtract": [
-                                {"$max": "$coordinates.y"},
-                                {"$min": "$coordinates.y"},
-                            ]},
-                        ]},
-                        2,
-                    ]
-                },
+                "centroid": self._centroidExpr(),
+                "estimatedRadius": self._estimatedRadiusExpr(),
             }},
             {"$project": {"coordinates": 0}},
         ]
-        return self._aggregate(self.collection, pipeline)
+
+    def stubChanges(self, datasetId, since, shape=None, tags=None):
+        """Stub changes since the dataset change sequence `since`, for delta
+        syncs of a client-side stub cache.
+
+        Returns (upserted, deletedIds): a cursor over the stubs written after
+        `since` that match the filters, and the string ids the client must
+        drop -- annotations removed since then, plus annotations changed
+        since then that no longer match the filters. Reads go through the
+        {datasetId, changeSeq} index, so the cost follows the size of the
+        delta rather than the dataset.
+        """
+        changedMatch = {"datasetId": datasetId, "changeSeq": {"$gt": since}}
+        stubFilter = self._stubFilter(shape, tags)
+
+        removedIds = DatasetTombstone().removedIdsSince(
+            self.name, datasetId, since)
+        # A tombstoned id may have been written again since (e.g. by an undo
+        # of its deletion): only report it if it is still gone.
+        stillPresent = {
+            document["_id"]
+            for document in self.collection.find(
+                {"_id": {"$in": removedIds}}, {"_id": 1})
+        } if removedIds else set()
+        deletedIds = {
+            str(documentId) for documentId in removedIds
+            if documentId not in stillPresent
+        }
+        if stubFilter:
+            deletedIds.update(
+                str(document["_id"])
+                for document in self.collection.find(
+                    dict(changedMatch, **{"$nor": [stubFilter]}),
+                    {"_id": 1},
+                ).hint(CHANGE_SEQ_INDEX)
+            )
+
+        upserted = self._aggregate(
+            self.collection,
+            self._stubsPipeline(dict(changedMatch, **stubFilter)),
+            hint=CHANGE_SEQ_INDEX,
+        )
+        return upserted, sorted(deletedIds)
+
+    def viewport(self, datasetId, bbox, location=None, shape=None, tags=None,
+                 limit=0):
+        """Annotations at `location` whose bounding box intersects `bbox`
+        ({minX, minY, maxX, maxY}). Returns a cursor.
+
+        Backed by VIEWPORT_INDEX, so the cost is proportional to the matched
+        annotations rather than the dataset size. Each location axis (XY, Z,
+        Time) is matched only when given. Annotations written before the
+        bbox field existed are not matched until backfilled (see
+        scripts/backfill_annotation_bounds.py).
+        """
+        query = {"datasetId": datasetId}
+        for axis in ("XY", "Z", "Time"):
+            if (location or {}).get(axis) is not None:
+                query["location." + axis] = location[axis]
+        if shape:
+            query["shape"] = shape
+        if tags:
+            query["tags"] = {"$all": tags}
+        # Two boxes intersect iff they overlap on both axes.
+        query["bbox.minX"] = {"$lte": bbox["maxX"]}
+        query["bbox.maxX"] = {"$gte": bbox["minX"]}
+        query["bbox.minY"] = {"$lte": bbox["maxY"]}
+        query["bbox.maxY"] = {"$gte": bbox["minY"]}
+        return self.find(query, limit=limit).hint(VIEWPORT_INDEX)
 
     def _buildListMatchStages(self, datasetId, filters):
         """Pipeline stages matching annotation-document fields.
@@ -371,11 +571,40 @@ class Annotation(AccessControlMixin, ProxiedModel):
         cursor = self._aggregate(self.collection, pipeline)
         return [str(doc["_id"]) for doc in cursor]
 
+    def _centroidExpr(self, prefix="$"):
+        # The centroid is persisted at write time (see spatialFields); the
+        # $avg fallback only runs for annotations saved before that and not
+        # yet backfilled by scripts/backfill_annotation_bounds.py.
+        return {"$ifNull": [prefix + "centroid", {
+            "x": {"$avg": prefix + "coordinates.x"},
+            "y": {"$avg": prefix + "coordinates.y"},
+        }]}
+
+    def _estimatedRadiusExpr(self, prefix="$"):
+        # Half the larger bounding-box side. Matches the frontend
+        # estimateAnnotationRadius so the stub circle tracks the
+        # annotation's footprint; the previous bbox-diagonal/2
+        # circumscribed the box and overshot the real size by up to
+        # sqrt(2) (a square cell rendered ~41% too large). Persisted at
+        # write time; computed here only for un-backfilled annotations.
+        return {"$ifNull": [prefix + "estimatedRadius", {
+            "$divide": [
+                {"$max": [
+                    {"$subtract": [
+                        {"$max": prefix + "coordinates.x"},
+                        {"$min": prefix + "coordinates.x"},
+                    ]},
+                    {"$subtract": [
+                        {"$max": prefix + "coordinates.y"},
+                        {"$min": prefix + "coordinates.y"},
+                    ]},
+                ]},
+                2,
+            ]
+        }]}
+
     def _centroidAddFields(self):
-        return {"$addFields": {"centroid": {
-            "x": {"$avg": "$coordinates.x"},
-            "y": {"$avg": "$coordinates.y"},
-        }}}
+        return {"$addFields": {"centroid": self._centroidExpr()}}
 
     def _lookupStages(self):
         return [
@@ -390,6 +619,37 @@ class Annotation(AccessControlMixin, ProxiedModel):
             }},
         ]
 
+    @staticmethod
+    def _projectValues(values, propertyPaths):
+        """The Python counterpart of _valuesExpr: the nested `values` of the
+        property paths, without the missing or null leaves."""
+        projected = {}
+        for path in propertyPaths:
+            value = values
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            node = projected
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            if value is not None:
+                node[path[-1]] = value
+        return projected
+
+    def _joinValues(self, datasetId, rows, propertyPaths):
+        """Set the projected property values of a page of annotations, read
+        with a single query instead of a per-row $lookup."""
+        valuesById = {
+            document["annotationId"]: document.get("values") or {}
+            for document in self._pvModel.findByAnnotationIds(
+                datasetId, [row["_id"] for row in rows], propertyPaths
+            )
+        }
+        for row in rows:
+            row["values"] = self._projectValues(
+                valuesById.get(row["_id"], {}), propertyPaths
+            )
+        return rows
+
     def _valuesExpr(self, propertyPaths, valueBase="_pv.values."):
         """Nested `values` projection expression. $$REMOVE drops a missing
         leaf so the nested structure is preserved without nulls."""
@@ -466,6 +726,92 @@ class Annotation(AccessControlMixin, ProxiedModel):
             return {"$sort": {key: direction, "_id": 1}}
         return {"$sort": {"_id": 1}}
 
+    def _sortSignature(self, sort):
+        sort = sort or {}
+        return [sort.get("type"), sort.get("key"), sort.get("order") == "desc"]
+
+    def encodeListCursor(self, datasetId, sort, row):
+        """Opaque cursor resuming a list after `row`, the last row of a page
+        returned by listPage with the same `sort`.
+
+        The cursor holds the sort key of the row and its _id: the next page
+        is a range match on them (see decodeListCursor and listPage) rather
+        than a $skip over every earlier row.
+        """
+        position = {"sort": self._sortSignature(sort), "id": row["_id"]}
+        if sort and sort.get("type") == "property":
+            # The sort value is not in the row unless it is also a display
+            # column, so read it back from the row's property-value doc.
+            valueKey = "values." + ".".join(sort["key"])
+            valueDoc = self._pvModel.collection.find_one(
+                {"datasetId": datasetId, "annotationId": row["_id"]},
+                {valueKey: 1},
+            ) or {}
+            value = valueDoc
+            for key in ["values"] + list(sort["key"]):
+                value = value.get(key) if isinstance(value, dict) else None
+            position["hasValue"] = value is not None
+            position["value"] = value
+        elif sort and sort.get("type") == "field" and sort["key"] != "_id":
+            value = row
+            for key in sort["key"].split("."):
+                value = value.get(key) if isinstance(value, dict) else None
+            position["value"] = value
+        return base64.urlsafe_b64encode(bsonEncode(position)).decode()
+
+    def decodeListCursor(self, sort, cursor):
+        """Decode a cursor of encodeListCursor. Raises ValueError when the
+        cursor is malformed or was made for another sort."""
+        try:
+            position = bsonDecode(base64.urlsafe_b64decode(cursor))
+        except (BSONError, TypeError, ValueError):
+            raise ValueError("Invalid list cursor")
+        if (position.get("sort") != self._sortSignature(sort)
+                or not isinstance(position.get("id"), ObjectId)):
+            raise ValueError("List cursor does not match the sort")
+        return position
+
+    def _keysetMatch(self, sort, position, valueField, hasValueField=None,
+                     idField="_id"):
+        """Query matching the rows that sort after a decoded cursor
+        `position`, in the order of _sortStage (or _pvSortStage with
+        idField="annotationId").
+
+        valueField holds the sort value (the field itself, or _sortValue
+        for a property sort). hasValueField holds _hasSortValue; leave it
+        None when only rows with a sort value are paged.
+        """
+        descending = (sort or {}).get("order") == "desc"
+        isProperty = bool(sort and sort.get("type") == "property")
+        lastId = position["id"]
+        if not isProperty and (not sort or sort.get("key") == "_id"):
+            return {idField: {"$lt" if descending else "$gt": lastId}}
+
+        afterId = {idField: {"$gt": lastId}}
+        value = position.get("value")
+        if isProperty and not position.get("hasValue"):
+            # Rows without a sort value come last, in _id order
+            return dict(afterId, **{hasValueField: 0})
+        if value is None:
+            # A missing field sorts as null: first ascending, last descending
+            after = [dict(afterId, **{valueField: None})]
+            if not descending:
+                after.append({valueField: {"$ne": None}})
+            return {"$or": after}
+
+        after = [
+            {valueField: {"$lt" if descending else "$gt": value}},
+            dict(afterId, **{valueField: value}),
+        ]
+        if descending and not isProperty:
+            after.append({valueField: None})
+        if hasValueField is None:
+            return {"$or": after}
+        return {"$or": [
+            {"$and": [{hasValueField: 1}, {"$or": after}]},
+            {hasValueField: 0},
+        ]}
+
     def _hasAnnotationFieldFilters(self, filters):
         """True if any filter constrains annotation-document fields.
 
@@ -508,7 +854,8 @@ class Annotation(AccessControlMixin, ProxiedModel):
         return {"$sort": {"annotationId": 1}}
 
     def _pvDrivenPagePipeline(self, datasetId, filters, sort, propertyPaths,
-                              skip, limit, restrictToPresentSortValue=False):
+                              skip, limit, restrictToPresentSortValue=False,
+                              after=None):
         # Sort/paginate the lean property-value docs first, then join the
         # annotation back for just the page and reshape to the
         # annotation-driven output (annotation _id + centroid + values).
@@ -523,7 +870,18 @@ class Annotation(AccessControlMixin, ProxiedModel):
         if restrictToPresentSortValue and sort and sort.get("key"):
             valueKey = "values." + ".".join(sort["key"])
             pipeline.append({"$match": {valueKey: {"$ne": None}}})
+            if after is not None:
+                # Every paged doc has the value: range-match the raw field
+                pipeline.append({"$match": self._keysetMatch(
+                    sort, after, valueKey, idField="annotationId",
+                )})
+                after = None
         pipeline += self._propertySortAddFields(sort, valueBase="values.")
+        if after is not None:
+            pipeline.append({"$match": self._keysetMatch(
+                sort, after, "_sortValue", "_hasSortValue",
+                idField="annotationId",
+            )})
         pipeline.append(self._pvSortStage(sort))
         pipeline.append({"$skip": skip})
         pipeline.append({"$limit": limit})
@@ -541,10 +899,9 @@ class Annotation(AccessControlMixin, ProxiedModel):
                 "_ann.values": self._valuesExpr(propertyPaths,
                                                 valueBase="values."),
             }})
-        pipeline.append({"$addFields": {"_ann.centroid": {
-            "x": {"$avg": "$_ann.coordinates.x"},
-            "y": {"$avg": "$_ann.coordinates.y"},
-        }}})
+        pipeline.append({"$addFields": {
+            "_ann.centroid": self._centroidExpr(prefix="$_ann."),
+        }})
         pipeline.append({"$replaceRoot": {"newRoot": "$_ann"}})
         pipeline.append({"$project": {"coordinates": 0}})
         return pipeline
@@ -559,14 +916,17 @@ class Annotation(AccessControlMixin, ProxiedModel):
         return result[0]["count"] if result else 0
 
     def _noValueTail(self, datasetId, sort, propertyPaths,
-                     tailOffset, tailLimit):
+                     tailOffset, tailLimit, afterId=None):
         # Annotations with no value for the sort key (missing PV doc or
         # missing path) sort last on a pure property sort. {key: None} matches
         # both missing and null, including when the joined _pv is absent.
         if tailLimit <= 0:
             return []
         sortKey = "_pv.values." + ".".join(sort["key"])
-        pipeline = [{"$match": {"datasetId": datasetId}}]
+        match = {"datasetId": datasetId}
+        if afterId is not None:
+            match["_id"] = {"$gt": afterId}
+        pipeline = [{"$match": match}]
         pipeline += self._lookupStages()
         pipeline.append({"$match": {sortKey: None}})
         pipeline.append({"$sort": {"_id": 1}})
@@ -577,7 +937,7 @@ class Annotation(AccessControlMixin, ProxiedModel):
         return list(self._aggregate(self.collection, pipeline))
 
     def _pvDrivenPage(self, datasetId, filters, sort, propertyPaths,
-                      skip, limit):
+                      skip, limit, after=None):
         # A pure property sort (no property filter) must also surface
         # annotations with no value for the sort key, ordered after the
         # present ones. A property filter already excludes those rows.
@@ -585,22 +945,49 @@ class Annotation(AccessControlMixin, ProxiedModel):
             bool(sort and sort.get("type") == "property")
             and not filters.get("propertyFilters")
         )
+        if isPureSort and after is not None and not after["hasValue"]:
+            # The cursor is already in the no-value tail
+            return self._noValueTail(
+                datasetId, sort, propertyPaths, 0, limit,
+                afterId=after["id"],
+            )
         rows = list(self._aggregate(
             self._pvModel.collection,
             self._pvDrivenPagePipeline(
                 datasetId, filters, sort, propertyPaths, skip, limit,
-                restrictToPresentSortValue=isPureSort,
+                restrictToPresentSortValue=isPureSort, after=after,
             ),
         ))
         if isPureSort and len(rows) < limit:
-            hasCount = self._pvHasValueCount(datasetId, sort)
+            # A cursor among the present values starts the tail at its top,
+            # without counting them.
+            tailOffset = 0 if after is not None else max(
+                0, skip - self._pvHasValueCount(datasetId, sort)
+            )
             rows += self._noValueTail(
                 datasetId, sort, propertyPaths,
-                max(0, skip - hasCount), limit - len(rows),
+                tailOffset, limit - len(rows),
             )
         return rows
 
     def listCount(self, datasetId, filters):
+        """Number of annotations matching the filters.
+
+        Served from LIST_COUNT_CACHE until the next write to the dataset's
+        annotations or property values, so paging through a list only counts
+        it once. Filters are keyed without their empty entries.
+        """
+        normalizedFilters = {
+            key: value for key, value in filters.items()
+            if value not in (None, "", [], {})
+        }
+        return LIST_COUNT_CACHE.getOrCompute(
+            datasetId,
+            ("listCount", hashKey(normalizedFilters)),
+            lambda: self._computeListCount(datasetId, filters),
+        )
+
+    def _computeListCount(self, datasetId, filters):
         # Sorting never changes the count, so only a property FILTER matters.
         if (filters.get("propertyFilters")
                 and not self._hasAnnotationFieldFilters(filters)):
@@ -737,30 +1124,6 @@ class Annotation(AccessControlMixin, ProxiedModel):
             self.collection, countPipeline)), None)
         return result["position"] if result else 0
 
-    def _propertyComputeMatch(self, shape, tagSpec):
-        """Match expression for the annotations a property CAN be computed on.
-
-        Mirrors the client canComputeAnnotationProperty/tagFilterFunction:
-        same shape, and inclusive -> the annotation carries all the property's
-        tags ($all); exclusive -> the annotation's tags are exactly that set.
-        Empty tags: inclusive matches every annotation of the shape; exclusive
-        matches only untagged annotations.
-        """
-        match = {}
-        if shape:
-            match["shape"] = shape
-        tagSpec = tagSpec or {}
-        tags = tagSpec.get("tags") or []
-        exclusive = bool(tagSpec.get("exclusive"))
-        if tags:
-            match["tags"] = (
-                {"$all": tags, "$size": len(tags)} if exclusive
-                else {"$all": tags}
-            )
-        elif exclusive:
-            match["tags"] = {"$size": 0}
-        return match
-
     def uncomputedCounts(self, datasetId, propertyFilters):
         """Per property, the count of annotations awaiting its computation.
 
@@ -771,41 +1134,62 @@ class Annotation(AccessControlMixin, ProxiedModel):
         700K-annotation dataset never ships its full value map for the
         properties panel.
 
-        Computed as total_matching - has_value. `has_value` counts
-        property-value docs carrying the property's key; values are only ever
-        written for annotations that matched at compute time, so re-tagging an
-        annotation AFTER its value was computed can under-report the count by
-        that one annotation. That edge case is acceptable for an informational
-        badge and avoids a full per-annotation $lookup join (multi-second at
-        700K).
+        Computed as total_matching - has_value, from the dataset summary
+        (see models/datasetSummary.py), which is rebuilt here if missing.
+        `has_value` counts property-value docs carrying the property's key;
+        values are only ever written for annotations that matched at compute
+        time, so re-tagging an annotation AFTER its value was computed can
+        under-report the count by that one annotation. That edge case is
+        acceptable for an informational badge and avoids a full
+        per-annotation $lookup join (multi-second at 700K).
         """
         if not propertyFilters:
             return {}
 
-        # One $facet over the annotations: a branch per property counting the
-        # documents that match its shape + tag rule. Project to {shape, tags}
-        # first so the facet buffers tiny docs rather than full geometry.
-        totalFacet = {
-            "p%d" % i: [
-                {"$match": self._propertyComputeMatch(
-                    propertyFilter.get("shape"), propertyFilter.get("tags"))},
-                {"$count": "n"},
-            ]
-            for i, propertyFilter in enumerate(propertyFilters)
-        }
-        totals = next(iter(self._aggregate(
-            self.collection,
-            [
-                {"$match": {"datasetId": datasetId}},
-                {"$project": {"shape": 1, "tags": 1}},
-                {"$facet": totalFacet},
-            ],
-        )), {})
+        summary = DatasetSummary().findOne({"_id": datasetId})
+        if summary is None:
+            summary = self.rebuildDatasetSummary(datasetId)
+
+        counts = {}
+        for propertyFilter in propertyFilters:
+            tagSpec = propertyFilter.get("tags") or {}
+            total = DatasetSummary.countMatching(
+                summary,
+                propertyFilter.get("shape"),
+                tagSpec.get("tags") or [],
+                bool(tagSpec.get("exclusive")),
+            )
+            hasValue = (summary.get("valueCounts") or {}).get(
+                propertyFilter["id"], 0
+            )
+            counts[propertyFilter["id"]] = max(0, total - hasValue)
+        return counts
+
+    def rebuildDatasetSummary(self, datasetId):
+        """Recount the dataset summary from the annotations and property
+        values of the dataset. Returns the new summary."""
+        # Group by shape and tags, projected first so the group stage only
+        # sees tiny docs rather than full geometry. Differently ordered tags
+        # are merged by DatasetSummary.replace.
+        groups = [
+            (doc["_id"].get("shape"), doc["_id"].get("tags"), doc["n"])
+            for doc in self._aggregate(
+                self.collection,
+                [
+                    {"$match": {"datasetId": datasetId}},
+                    {"$project": {"shape": 1, "tags": 1}},
+                    {"$group": {
+                        "_id": {"shape": "$shape", "tags": "$tags"},
+                        "n": {"$sum": 1},
+                    }},
+                ],
+            )
+        ]
 
         # One streaming pass over the value docs: count, per top-level property
         # key, how many docs carry it. `values`' top-level keys are property
         # ids -- exactly the existence the client checks (propertyValues a/p).
-        hasValueByProperty = {
+        valueCounts = {
             doc["_id"]: doc["n"]
             for doc in self._aggregate(
                 self._pvModel.collection,
@@ -818,14 +1202,10 @@ class Annotation(AccessControlMixin, ProxiedModel):
                 ],
             )
         }
+        return DatasetSummary().replace(datasetId, groups, valueCounts)
 
-        counts = {}
-        for i, propertyFilter in enumerate(propertyFilters):
-            branch = totals.get("p%d" % i) or []
-            total = branch[0]["n"] if branch else 0
-            hasValue = hasValueByProperty.get(propertyFilter["id"], 0)
-            counts[propertyFilter["id"]] = max(0, total - hasValue)
-        return counts
+    def summarizeChanges(self, before, after):
+        DatasetSummary().annotationsChanged(before, after)
 
     def _needsPropertyBeforePage(self, filters, sort):
         """Whether property values must be joined BEFORE pagination.
@@ -854,9 +1234,31 @@ class Annotation(AccessControlMixin, ProxiedModel):
             pipeline += self._propertySortAddFields(sort)
         return pipeline
 
+    def _touchPropertyIndexes(self, filters, sort):
+        # Keep the partial indexes of the filtered and sorted property paths
+        # from being evicted (see PropertyValueIndex)
+        paths = [
+            propertyFilter["path"]
+            for propertyFilter in filters.get("propertyFilters") or []
+        ]
+        if sort and sort.get("type") == "property" and sort.get("key"):
+            paths.append(sort["key"])
+        if paths:
+            PropertyValueIndex().touch(
+                ["values." + ".".join(path) for path in paths]
+            )
+
     def listPage(self, datasetId, filters, sort, propertyPaths,
-                 offset, limit):
-        skip = max(0, offset)
+                 offset, limit, after=None):
+        """One page of the filtered, sorted list.
+
+        The page starts at `offset`, or right after the decoded cursor
+        `after` (see decodeListCursor) when given. A cursor page is a range
+        match on the sort key and _id, so deep pages cost the same as the
+        first one instead of skipping every earlier row.
+        """
+        skip = 0 if after is not None else max(0, offset)
+        self._touchPropertyIndexes(filters, sort)
         if not self._needsPropertyBeforePage(filters, sort):
             # Sort by an annotation field (the {datasetId,_id} index orders
             # the default/_id case, so the page is found without scanning the
@@ -864,9 +1266,21 @@ class Annotation(AccessControlMixin, ProxiedModel):
             # display and compute the centroid -- paying that per-row cost on
             # the page rather than on every matched annotation.
             pipeline = self._buildListMatchStages(datasetId, filters)
+            if after is not None:
+                pipeline.append({"$match": self._keysetMatch(
+                    sort, after, (sort or {}).get("key"),
+                )})
             pipeline.append(self._sortStage(sort))
             pipeline.append({"$skip": skip})
             pipeline.append({"$limit": limit})
+            if propertyPaths and limit >= self.APP_JOIN_MIN_ROWS:
+                pipeline.append(self._centroidAddFields())
+                pipeline += self._projectStage(None)
+                return self._joinValues(
+                    datasetId,
+                    list(self._aggregate(self.collection, pipeline)),
+                    propertyPaths,
+                )
             if propertyPaths:
                 pipeline += self._lookupStages()
             pipeline.append(self._centroidAddFields())
@@ -878,7 +1292,7 @@ class Annotation(AccessControlMixin, ProxiedModel):
             # paginate the lean value docs, then join the annotation back for
             # just the page -- avoiding the join over the whole matched set.
             return self._pvDrivenPage(
-                datasetId, filters, sort, propertyPaths, skip, limit
+                datasetId, filters, sort, propertyPaths, skip, limit, after
             )
 
         # Fallback: an annotation-field filter is combined with a property
@@ -886,6 +1300,13 @@ class Annotation(AccessControlMixin, ProxiedModel):
         # accompanies a property filter. Join, filter, sort, then paginate on
         # the annotation collection.
         pipeline = self._annotationDrivenStages(datasetId, filters, sort)
+        if after is not None:
+            isPropertySort = sort and sort.get("type") == "property"
+            pipeline.append({"$match": self._keysetMatch(
+                sort, after,
+                "_sortValue" if isPropertySort else (sort or {}).get("key"),
+                "_hasSortValue" if isPropertySort else None,
+            )})
         pipeline.append(self._sortStage(sort))
         pipeline.append({"$skip": skip})
         pipeline.append({"$limit": limit})
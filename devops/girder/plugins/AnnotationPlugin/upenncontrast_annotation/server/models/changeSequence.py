@@ -0,0 +1,82 @@
+from pymongo import ReturnDocument
+
+from girder import events
+from girder.models.model_base import Model
+
+
+class DatasetChangeSequence(Model):
+    """
+    A monotonic per-dataset write counter. Every write to a model that tracks
+    dataset changes (see CustomNimbusImageModel.tracksDatasetChanges) advances
+    its dataset's sequence and stamps the written documents with the new
+    value, so a client can ask for everything changed since the sequence it
+    last saw.
+
+    Documents are {_id: datasetId, seq: int, version: int, deltaFloor: int};
+    a dataset that was never written to is at sequence 0.
+
+    `deltaFloor` is the oldest sequence a delta can start from: the removals
+    up to it are no longer tombstoned (see DatasetTombstone.prune).
+
+    `version` is a second counter, advanced AFTER each write to a model that
+    versions dataset writes (see CustomNimbusImageModel.versionsDatasetWrites)
+    rather than before it like the sequence. A value computed after reading
+    the version can then be cached under it: a concurrent write always ends
+    with a newer version.
+    """
+
+    def initialize(self):
+        self.name = "dataset_change_sequence"
+        events.bind(
+            "model.folder.remove",
+            "upenn.changeSequence.folderRemovedEvent",
+            self.folderRemovedEvent,
+        )
+
+    def validate(self, document):
+        return document
+
+    def folderRemovedEvent(self, event):
+        if event.info and event.info["_id"]:
+            self.collection.delete_one({"_id": event.info["_id"]})
+
+    def current(self, datasetId):
+        document = self.collection.find_one({"_id": datasetId})
+        return document["seq"] if document else 0
+
+    def deltaFloor(self, datasetId):
+        document = self.collection.find_one(
+            {"_id": datasetId}, {"deltaFloor": 1}
+        )
+        return (document or {}).get("deltaFloor", 0)
+
+    def raiseDeltaFloor(self, datasetId, seq):
+        self.collection.update_one(
+            {"_id": datasetId}, {"$max": {"deltaFloor": seq}}, upsert=True
+        )
+
+    def advance(self, datasetIds):
+        """Advance the sequence of each dataset once; returns a dict mapping
+        each datasetId to its new sequence value."""
+        return {
+            datasetId: self.collection.find_one_and_update(
+                {"_id": datasetId},
+                {"$inc": {"seq": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )["seq"]
+            for datasetId in set(datasetIds)
+        }
+
+    def writeVersion(self, datasetId):
+        document = self.collection.find_one(
+            {"_id": datasetId}, {"version": 1}
+        )
+        return (document or {}).get("version", 0)
+
+    def advanceWriteVersion(self, datasetIds):
+        """Advance the write version of each dataset once."""
+        for datasetId in set(datasetIds):
+            self.collection.update_one(
+                {"_id": datasetId}, {"$inc": {"version": 1}}, upsert=True
+            )
@@ -1,17 +1,20 @@
 import fastjsonschema
 import numpy as np
+from scipy.spatial import cKDTree
 
 from bson.objectid import ObjectId
 
 from girder import events
-from girder.constants import SortDir
+from girder.constants import AccessType, SortDir
 from girder.exceptions import ValidationException
 from girder.models.folder import Folder
 from girder.utility.acl_mixin import AccessControlMixin
 
 from .annotation import Annotation
 
-from ..helpers.connections import annotationToAnnotationDistance
+from ..helpers.access_helpers import requireDatasetsAccess
+from ..helpers import geometry
+from ..helpers.connections import MEASURABLE_SHAPES
 from ..helpers.fastjsonschema import customJsonSchemaCompile
 from ..helpers.proxiedModel import ProxiedModel
 
@@ -172,101 +175,163 @@ class AnnotationConnection(AccessControlMixin, ProxiedModel):
         }
         return self.removeWithQuery(query)
 
-    def getClosestAnnotation(self, annotationRef, annotations):
-        """Get the closest annotation based on its distance to a reference
-        annotation.
+    def _loadCentroids(self, query):
+        """Get the ids and centroids of the annotations matching the query,
+        as a list of ids, an (N, 2) array of x, y and an (N,) array of z.
 
-        Args:
-            annotationRef (any): the annotation of reference
-            annotations (any): a list of annotations
-
-        Returns:
-            Tuple(Annotation, Number): Returns a tuple of 2 items: the closest
-                annotation and the minimum distance
-            None: if no closest annotation is found
+        The x, y are the persisted centroids, and the z the mean z of the
+        points, NaN unless all of them have one (like geometry.centroids).
+        Only the z of the coordinates is read. Annotations written before
+        centroids were persisted get theirs computed from the coordinates.
         """
-
-        filteredAnnotations = [
-            annotation
-            for annotation in annotations
-            if annotation["_id"] != annotationRef["_id"]
-        ]
-        if len(filteredAnnotations) == 0:
-            return None
-        distances = np.array(
-            [
-                annotationToAnnotationDistance(annotationRef, annotation)
-                for annotation in filteredAnnotations
+        annotationModel = Annotation()
+        ids = []
+        centroids = []
+        zs = []
+        missing = []
+        for annotation in annotationModel.collection.find(
+            query, {"centroid": 1, "coordinates.z": 1}
+        ):
+            centroid = annotation.get("centroid")
+            if centroid is None:
+                missing.append(annotation["_id"])
+                continue
+            ids.append(annotation["_id"])
+            centroids.append((centroid["x"], centroid["y"]))
+            pointZs = [
+                point.get("z", np.nan)
+                for point in annotation.get("coordinates") or []
             ]
-        )
-        closestAnnotationIdx = np.argmin(distances)
-        return (
-            filteredAnnotations[closestAnnotationIdx],
-            distances[closestAnnotationIdx],
-        )
+            zs.append(np.mean(pointZs) if pointZs else np.nan)
+        centroidsXY = np.array(centroids, dtype=float).reshape(-1, 2)
+        centroidsZ = np.array(zs, dtype=float)
+        if missing:
+            legacyAnnotations = list(annotationModel.collection.find(
+                {"_id": {"$in": missing}}, {"coordinates": 1}
+            ))
+            ids.extend(annotation["_id"] for annotation in legacyAnnotations)
+            legacyXY, legacyZ = geometry.centroids(geometry.coordinateBuffer([
+                annotation["coordinates"] for annotation in legacyAnnotations
+            ]))
+            centroidsXY = np.concatenate([centroidsXY, legacyXY])
+            centroidsZ = np.concatenate([centroidsZ, legacyZ])
+        return ids, centroidsXY, centroidsZ
+
+    @staticmethod
+    def _nearest(candidateXY, candidateZ, queryXY, queryZ):
+        """Index of the nearest candidate of each query centroid, for the
+        distance of geometry.distances: the z difference only counts when
+        both centroids have a z (not NaN).
+
+        One KD-tree query answers the centroids without a z, over the x, y
+        of every candidate. The others take the nearer of the candidates
+        with a z, in x, y, z, and of those without, in x, y.
+        """
+        candidateHasZ = ~np.isnan(candidateZ)
+        queryHasZ = ~np.isnan(queryZ)
+        nearest = np.zeros(len(queryXY), dtype=np.int64)
+        if not queryHasZ.all():
+            _, nearest[~queryHasZ] = cKDTree(candidateXY).query(
+                queryXY[~queryHasZ]
+            )
+        if not queryHasZ.any():
+            return nearest
+        best = np.full(queryHasZ.sum(), np.inf)
+        bestIndex = np.zeros(queryHasZ.sum(), dtype=np.int64)
+        for candidates, points, queries in (
+            (
+                candidateHasZ,
+                np.column_stack([candidateXY, candidateZ]),
+                np.column_stack([queryXY, queryZ])[queryHasZ],
+            ),
+            (~candidateHasZ, candidateXY, queryXY[queryHasZ]),
+        ):
+            if not candidates.any():
+                continue
+            distance, index = cKDTree(points[candidates]).query(queries)
+            closer = distance < best
+            best[closer] = distance[closer]
+            bestIndex[closer] = np.flatnonzero(candidates)[index[closer]]
+        nearest[queryHasZ] = bestIndex
+        return nearest
 
     def connectToNearest(self, info, user=None):
-        # annotation ids, a list of tags and a channel index.
-        connections = []
-
-        annotationsIdsToConnect = info["annotationsIds"]
-        ids = [ObjectId(id) for id in annotationsIdsToConnect]
+        """Connect each annotation of info["annotationsIds"] to the closest
+        annotation, by centroid, in the same dataset and location. Candidates
+        can be restricted to a channel (info["channelId"]) and to any of
+        info["tags"]; the annotations to connect are never candidates.
+
+        Like annotationToAnnotationDistance, only points, lines and polygons
+        have a distance: other shapes are never candidates, and an
+        annotation of another shape is connected to the first candidate.
+
+        Candidates are loaded once per (dataset, location) group and the
+        nearest neighbour lookups of the group are answered by KD-tree
+        queries. Distances include z when both centroids have one (see
+        _nearest). The connections are then created together.
+        """
+        ids = [ObjectId(id) for id in info["annotationsIds"]]
 
         # Get annotations that match selected tags and channel
         query = {
             "_id": {"$nin": ids},
+            "shape": {"$in": list(MEASURABLE_SHAPES)},
         }
         # channelId can be None if not specify
         channelId = info["channelId"]
-        channelQuery = (
-            {"channel": int(channelId)} if channelId is not None else {}
-        )
-        query.update(channelQuery)
-
+        if channelId is not None:
+            query["channel"] = int(channelId)
         tags = info["tags"]
-        tagsQuery = (
-            {"tags": {"$in": tags}}
-            if tags is not None and len(tags) > 0
-            else {}
+        if tags is not None and len(tags) > 0:
+            query["tags"] = {"$in": tags}
+
+        annotationsToConnect = list(Annotation().collection.find(
+            {"_id": {"$in": ids}}, {"datasetId": 1, "location": 1, "shape": 1}
+        ))
+        requireDatasetsAccess(
+            (annotation["datasetId"] for annotation in annotationsToConnect),
+            user,
+            level=AccessType.READ,
         )
-        query.update(tagsQuery)
 
-        # Loop on each annotation to connect
-        # Look for the closest annotation and connect to it
-        for id in ids:
-            annotation = Annotation().getAnnotationById(id, user)
-
-            if annotation is None:
-                print("Annotation not defined", id)
+        # Only work on annotations that are placed in the same dataset and
+        # the same tile
+        groups = {}
+        for annotation in annotationsToConnect:
+            key = (
+                annotation["datasetId"],
+                tuple(annotation["location"].items()),
+            )
+            groups.setdefault(key, []).append(annotation)
+
+        parents = {}
+        for (datasetId, location), group in groups.items():
+            candidateIds, candidateXY, candidateZ = self._loadCentroids(
+                {**query, "datasetId": datasetId, "location": dict(location)}
+            )
+            if len(candidateIds) == 0:
                 continue
-
-            # Only work on annotations that are placed in the same tile
-            location = annotation["location"]
-            tileQuery = {"location": location}
-            query.update(tileQuery)
-
-            # Only work on annotations that are placed in the same dataset
-            datasetId = annotation["datasetId"]
-            datasetQuery = {"datasetId": datasetId}
-            query.update(datasetQuery)
-
-            annotations = list(Annotation().find(query))
-
-            # Find the closest annotation
-            result = self.getClosestAnnotation(annotation, annotations)
-
-            # Define connection
-            if result is not None:
-                connections.append(
-                    self.create(
-                        connection={
-                            "tags": [],
-                            "label": "A Connection -- automatic",
-                            "parentId": result[0]["_id"],
-                            "childId": id,
-                            "datasetId": annotation["datasetId"],
-                        },
-                    )
-                )
-
-        return connections
+            groupIds, groupXY, groupZ = self._loadCentroids(
+                {"_id": {"$in": [annotation["_id"] for annotation in group]}}
+            )
+            nearest = self._nearest(candidateXY, candidateZ, groupXY, groupZ)
+            for childId, index in zip(groupIds, nearest):
+                parents[childId] = (candidateIds[index], datasetId)
+            for annotation in group:
+                if annotation.get("shape") not in MEASURABLE_SHAPES:
+                    # At an infinite distance of every candidate
+                    parents[annotation["_id"]] = (candidateIds[0], datasetId)
+
+        # Define connections, in the order the annotations were given
+        connections = [
+            {
+                "tags": [],
+                "label": "A Connection -- automatic",
+                "parentId": parents[id][0],
+                "childId": id,
+                "datasetId": parents[id][1],
+            }
+            for id in ids
+            if id in parents
+        ]
+        return self.createMultiple(connections)
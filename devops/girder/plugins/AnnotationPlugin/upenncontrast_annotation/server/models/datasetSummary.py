@@ -0,0 +1,162 @@
+import hashlib
+
+import orjson
+
+from pymongo import UpdateOne
+
+from girder import events
+from girder.models.model_base import Model
+
+
+class DatasetSummary(Model):
+    """
+    Materialized per-dataset counters answering the uncomputed property
+    counts without scanning the dataset.
+
+    Documents are {_id: datasetId, annotationGroups: {key: {shape, tags,
+    count}}, valueCounts: {propertyId: count}}: the number of annotations
+    per (shape, sorted tags) pair, and the number of property-value
+    documents carrying each top-level property id.
+
+    Writes to annotations and property values apply their changes as $inc
+    (see CustomNimbusImageModel.datasetSummaryFields), only to summaries
+    that already exist: a missing summary is rebuilt from the collections on
+    its first read (Annotation.rebuildDatasetSummary), and
+    scripts/rebuild_dataset_summaries.py rebuilds them all after a drift.
+    """
+
+    def initialize(self):
+        self.name = "dataset_summary"
+        events.bind(
+            "model.folder.remove",
+            "upenn.datasetSummary.folderRemovedEvent",
+            self.folderRemovedEvent,
+        )
+
+    def validate(self, document):
+        return document
+
+    def folderRemovedEvent(self, event):
+        if event.info and event.info["_id"]:
+            self.collection.delete_one({"_id": event.info["_id"]})
+
+    @staticmethod
+    def groupKey(shape, tags):
+        return hashlib.sha1(orjson.dumps([shape, tags])).hexdigest()
+
+    @staticmethod
+    def isCountableKey(key):
+        # Property ids are ObjectId strings; other keys could not be stored
+        # as a field name
+        return isinstance(key, str) and "." not in key \
+            and not key.startswith("$")
+
+    def replace(self, datasetId, groups, valueCounts):
+        """Store the summary of a dataset.
+
+        Args:
+            datasetId (ObjectId): The dataset
+            groups (Iterable[tuple]): (shape, tags, count) of each group of
+                annotations, where tags is None for annotations without tags
+            valueCounts (dict): Count of value docs by property id
+        """
+        annotationGroups = {}
+        for shape, tags, count in groups:
+            tags = sorted(tags) if tags is not None else None
+            group = annotationGroups.setdefault(
+                self.groupKey(shape, tags),
+                {"shape": shape, "tags": tags, "count": 0},
+            )
+            group["count"] += count
+        document = {
+            "_id": datasetId,
+            "annotationGroups": annotationGroups,
+            "valueCounts": {
+                key: count for key, count in valueCounts.items()
+                if self.isCountableKey(key)
+            },
+        }
+        self.collection.replace_one({"_id": datasetId}, document, upsert=True)
+        return document
+
+    def _applyIncrements(self, increments, sets=None):
+        operations = []
+        for datasetId, inc in increments.items():
+            inc = {field: delta for field, delta in inc.items() if delta}
+            if not inc:
+                continue
+            update = {"$inc": inc}
+            if sets and sets.get(datasetId):
+                update["$set"] = sets[datasetId]
+            operations.append(UpdateOne({"_id": datasetId}, update))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def annotationsChanged(self, before, after):
+        """Count the written annotations ({datasetId, shape, tags}) in their
+        new group instead of their previous one."""
+        increments = {}
+        sets = {}
+        for documents, sign in ((before, -1), (after, 1)):
+            for document in documents:
+                if "datasetId" not in document:
+                    continue
+                shape = document.get("shape")
+                tags = document.get("tags")
+                tags = sorted(tags) if tags is not None else None
+                key = "annotationGroups." + self.groupKey(shape, tags)
+                inc = increments.setdefault(document["datasetId"], {})
+                inc[key + ".count"] = inc.get(key + ".count", 0) + sign
+                sets.setdefault(document["datasetId"], {}).update({
+                    key + ".shape": shape,
+                    key + ".tags": tags,
+                })
+        self._applyIncrements(increments, sets)
+
+    def valuesChanged(self, before, after):
+        """Count the top-level property ids of the written property-value
+        docs ({datasetId, values})."""
+        increments = {}
+        for documents, sign in ((before, -1), (after, 1)):
+            for document in documents:
+                if "datasetId" not in document:
+                    continue
+                inc = increments.setdefault(document["datasetId"], {})
+                for key in document.get("values") or {}:
+                    if self.isCountableKey(key):
+                        field = "valueCounts." + key
+                        inc[field] = inc.get(field, 0) + sign
+        self._applyIncrements(increments)
+
+    def valuesRemoved(self, datasetId, propertyId, count):
+        """Uncount a property id removed from `count` property-value docs."""
+        if self.isCountableKey(propertyId):
+            self._applyIncrements(
+                {datasetId: {"valueCounts." + propertyId: -count}}
+            )
+
+    @staticmethod
+    def countMatching(summary, shape, tags, exclusive):
+        """Number of annotations of a summary a property CAN be computed on.
+
+        Mirrors the client canComputeAnnotationProperty/tagFilterFunction:
+        same shape, and inclusive -> the annotation carries all the property's
+        tags ($all); exclusive -> the annotation's tags are exactly that set
+        ($all and $size). Empty tags: inclusive matches every annotation of
+        the shape; exclusive matches only untagged annotations.
+        """
+        tags = tags or []
+        tagSet = set(tags)
+        total = 0
+        for group in (summary.get("annotationGroups") or {}).values():
+            if shape and group["shape"] != shape:
+                continue
+            groupTags = group["tags"]
+            if tags or exclusive:
+                # $all and $size never match annotations without tags
+                if groupTags is None or not tagSet.issubset(groupTags):
+                    continue
+                if exclusive and len(groupTags) != len(tags):
+                    continue
+            total += group["count"]
+        return total
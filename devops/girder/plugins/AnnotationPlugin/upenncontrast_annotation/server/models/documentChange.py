@@ -3,6 +3,7 @@ from girder.exceptions import ValidationException
 
 from ..helpers.customModel import CustomNimbusImageModel
 from ..helpers.fastjsonschema import customJsonSchemaCompile
+from ..helpers.serialization import MISSING, getDottedPath, setDottedPath
 import fastjsonschema
 
 from bson.objectid import ObjectId
@@ -24,16 +25,37 @@ class DocumentChangeSchema:
             "documentId": {
                 "type": "objectId",
             },
-            # Document before action, can be None
+            # Compact changes (see compactChange): "insert", "update" or
+            # "delete". Records without it store full before/after copies.
+            "op": {
+                "type": "string",
+                "enum": ["insert", "update", "delete"],
+            },
+            # Field-level diff of an update: the changed top-level fields
+            # before and after the action. A field missing from one side did
+            # not exist on that side. With "paths", the changed fields are
+            # these dotted paths instead of top-level fields.
+            "diff": {
+                "type": "object",
+                "properties": {
+                    "before": {"type": "object"},
+                    "after": {"type": "object"},
+                    "paths": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["before", "after"],
+            },
+            # Document before action, can be None. Compact records only keep
+            # it for deletions.
             "before": {
                 "type": ["object", "null"],
             },
-            # Document after action, can be None
+            # Document after action, can be None. Compact insert records only
+            # get it when undone, so that redo can insert the document again.
             "after": {
                 "type": ["object", "null"],
             },
         },
-        "required": ["historyId", "modelName", "before", "after"],
+        "required": ["historyId", "modelName"],
     }
 
 
@@ -45,7 +67,12 @@ class DocumentChange(CustomNimbusImageModel):
 
     def __init__(self):
         super().__init__()
-        self.ensureIndices(["historyId", "documentId"])
+        self.ensureIndices([
+            "historyId",
+            "documentId",
+            # Undo and redo read the changes of an entry grouped by model
+            ([("historyId", 1), ("modelName", 1)], {}),
+        ])
         self.schema = DocumentChangeSchema.documentChangeSchema
 
     jsonValidate = staticmethod(
@@ -63,6 +90,58 @@ class DocumentChange(CustomNimbusImageModel):
             raise ValidationException(exp)
         return document
 
+    @staticmethod
+    def compactChange(before, after, paths=None):
+        """
+        Turn the full before/after copies of a document into the compact
+        change stored in the collection:
+        - an insertion only keeps the operation, the document id is enough
+          to undo it
+        - an update keeps the top-level fields that changed, on both sides,
+          or the dotted paths that changed when the copies only hold `paths`
+        - a deletion keeps the removed document
+        Returns None when nothing changed.
+        """
+        if before is None and after is None:
+            return None
+        if before is None:
+            return {"op": "insert"}
+        if after is None:
+            return {"op": "delete", "before": before}
+        if paths is not None:
+            changed = [
+                path for path in paths
+                if getDottedPath(before, path) != getDottedPath(after, path)
+            ]
+            if not changed:
+                return None
+            diff = {"before": {}, "after": {}, "paths": changed}
+            for side, document in (("before", before), ("after", after)):
+                for path in changed:
+                    value = getDottedPath(document, path)
+                    if value is not MISSING:
+                        setDottedPath(diff[side], path, value)
+            return {"op": "update", "diff": diff}
+        changed = [
+            key for key in before.keys() | after.keys()
+            if key != "_id"
+            and (key not in before or key not in after
+                 or before[key] != after[key])
+        ]
+        if not changed:
+            return None
+        return {
+            "op": "update",
+            "diff": {
+                "before": {
+                    key: before[key] for key in changed if key in before
+                },
+                "after": {
+                    key: after[key] for key in changed if key in after
+                },
+            },
+        }
+
     def createChangesFromRecord(self, history_id, record, creator):
         # The record is a dict:
         # { model_name: { document_id: { before: ..., after: ... } } }
@@ -70,12 +149,18 @@ class DocumentChange(CustomNimbusImageModel):
         for model_name in record:
             for document_id in record[model_name]:
                 raw_change = record[model_name][document_id]
+                compact_change = self.compactChange(
+                    raw_change["before"],
+                    raw_change["after"],
+                    raw_change.get("paths"),
+                )
+                if compact_change is None:
+                    continue
                 new_document_change = {
                     "historyId": history_id,
                     "modelName": model_name,
                     "documentId": ObjectId(document_id),
-                    "before": raw_change["before"],
-                    "after": raw_change["after"],
+                    **compact_change,
                 }
                 self.setUserAccess(
                     new_document_change, user=creator, level=AccessType.ADMIN
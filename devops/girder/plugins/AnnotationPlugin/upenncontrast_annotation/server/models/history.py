@@ -1,15 +1,20 @@
 from girder.constants import SortDir, AccessType
 from girder.exceptions import ValidationException
 from girder.utility.model_importer import ModelImporter
+from girder.utility.progress import noProgress
 
+from .changeSequence import DatasetChangeSequence
 from .documentChange import DocumentChange as DocumentChangeModel
 from ..helpers.customModel import CustomNimbusImageModel
 
 from ..helpers.fastjsonschema import customJsonSchemaCompile
+from ..helpers.serialization import MISSING, getDottedPath
 import fastjsonschema
 
 from bson.objectid import ObjectId
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
 import datetime
+import itertools
 
 
 class HistorySchema:
@@ -37,6 +42,9 @@ class HistorySchema:
                 # Special type defined in a custom validator
                 "type": "objectId",
             },
+            "historyGroup": {
+                "type": "string",
+            },
         },
         "required": ["actionName", "actionDate", "userId", "isUndone"],
     }
@@ -48,9 +56,26 @@ class History(CustomNimbusImageModel):
     This class itself doesn't inherit the ProxiedModel
     """
 
+    # Number of document changes applied per bulk_write on undo or redo
+    undoBatchSize = 1000
+
     def __init__(self):
         super().__init__()
         self.ensureIndices(["name", "datasetId", "userId"])
+        # One entry per group of requests (see createInGroup)
+        self.ensureIndices([(
+            (
+                ("userId", SortDir.ASCENDING),
+                ("datasetId", SortDir.ASCENDING),
+                ("historyGroup", SortDir.ASCENDING),
+            ),
+            {
+                "unique": True,
+                "partialFilterExpression": {
+                    "historyGroup": {"$exists": True},
+                },
+            },
+        )])
         self.schema = HistorySchema.historySchema
 
     jsonValidate = staticmethod(
@@ -86,13 +111,13 @@ class History(CustomNimbusImageModel):
             query, sort=sort, fields=fields, user=user
         )
 
-    def undo(self, user, datasetId):
-        self.undoOrRedo(user, datasetId, True)
+    def undo(self, user, datasetId, progress=noProgress):
+        self.undoOrRedo(user, datasetId, True, progress)
 
-    def redo(self, user, datasetId):
-        self.undoOrRedo(user, datasetId, False)
+    def redo(self, user, datasetId, progress=noProgress):
+        self.undoOrRedo(user, datasetId, False, progress)
 
-    def undoOrRedo(self, user, datasetId, undo: bool):
+    def undoOrRedo(self, user, datasetId, undo: bool, progress=noProgress):
         # Get the most recent action which has (not) been undone
         query = {
             "userId": user["_id"],
@@ -111,41 +136,187 @@ class History(CustomNimbusImageModel):
         if history_entry is None:
             return
 
-        # Find the document changes for this history entry
-        # Would have to use an aggregation pipeline to group by model_name
-        # This feature is not available in girder, use the sort instead
+        # Stream the document changes for this history entry, grouped by
+        # model. Only the side of each change that is written back is read in
+        # full; the other side is only needed for its id and dataset.
+        change_query = {"historyId": history_entry["_id"]}
+        write_key, other_key = ("before", "after") if undo else (
+            "after", "before"
+        )
         document_changes = self.documentChangeModel.findWithPermissions(
-            {"historyId": history_entry["_id"]},
-            sort=[("model_name", SortDir.ASCENDING)],
+            change_query,
+            sort=[("modelName", SortDir.ASCENDING)],
+            fields={
+                "modelName": 1,
+                "documentId": 1,
+                "op": 1,
+                "diff": 1,
+                write_key: 1,
+                other_key + "._id": 1,
+                other_key + ".datasetId": 1,
+            },
             user=user,
             level=AccessType.READ,
         )
+        if progress.on:
+            total = self.documentChangeModel.collection.count_documents(
+                change_query
+            )
+            progress.update(
+                force=True, total=total, current=0,
+                message="%s: %s" % (
+                    "Undoing" if undo else "Redoing",
+                    history_entry["actionName"],
+                ),
+            )
 
-        # Undo or redo the action
-        change_key = "before" if undo else "after"
-        previous_model_name = ""
-        model = None
-        for change in document_changes:
-            document_id = change["documentId"]
-            model_name = change["modelName"]
-            if model_name != previous_model_name:
-                model: CustomNimbusImageModel = ModelImporter.model(
-                    model_name, "upenncontrast_annotation"
-                )
-                previous_model_name = model_name
-            # Use 'before' when undoing, and 'after' when redoing
-            replacement = change[change_key]
-            if replacement is None:
-                model.collection.delete_one({"_id": document_id})
-            else:
-                model.collection.replace_one(
-                    {"_id": document_id}, replacement, upsert=True
-                )
+        # Undo or redo the action, one bulk_write per batch
+        done = 0
+        versioned = False
+        for model_name, changes in itertools.groupby(
+            document_changes, key=lambda change: change["modelName"]
+        ):
+            model: CustomNimbusImageModel = ModelImporter.model(
+                model_name, "upenncontrast_annotation"
+            )
+            while True:
+                batch = list(itertools.islice(changes, self.undoBatchSize))
+                if not batch:
+                    break
+                self.applyChanges(model, batch, undo)
+                done += len(batch)
+                progress.update(current=done)
+            versioned = versioned or model.versionsDatasetWrites
+
+        # The changes were written to the collections directly, so advance
+        # the write version here, after the last of them
+        if versioned:
+            DatasetChangeSequence().advanceWriteVersion([datasetId])
 
         # Update the entry
         history_entry["isUndone"] = undo
         return self.save(history_entry)
 
+    def applyChanges(self, model, changes, undo):
+        """
+        Revert (undo) or reapply (redo) the document changes of one model
+        with a single unordered bulk_write. Reads both the compact records
+        and the older ones holding full before/after copies.
+        """
+        replacements = []  # Full documents to write back
+        removed = []  # Documents to delete, with their datasetId if any
+        updates = {}  # Document id to field-level update
+        captured = []  # Inserted documents to keep so that redo works
+        for change in changes:
+            op = change.get("op")
+            if op is None:
+                # Use 'before' when undoing, and 'after' when redoing
+                replacement = change.get("before" if undo else "after")
+                if replacement is not None:
+                    replacements.append(replacement)
+                elif change.get("before") or change.get("after"):
+                    removed.append(change.get("before") or change.get("after"))
+            elif op == "update" and "paths" in change["diff"]:
+                fields = change["diff"]["before" if undo else "after"]
+                update = {}
+                for path in change["diff"]["paths"]:
+                    value = getDottedPath(fields, path)
+                    if value is MISSING:
+                        update.setdefault("$unset", {})[path] = ""
+                    else:
+                        update.setdefault("$set", {})[path] = value
+                updates[change["documentId"]] = update
+            elif op == "update":
+                fields = change["diff"]["before" if undo else "after"]
+                other = change["diff"]["after" if undo else "before"]
+                update = {}
+                if fields:
+                    update["$set"] = dict(fields)
+                unset = {key: "" for key in other if key not in fields}
+                if unset:
+                    update["$unset"] = unset
+                updates[change["documentId"]] = update
+            elif op == "insert" and undo:
+                captured.append(change)
+            elif op == "delete" and not undo:
+                removed.append(change["before"])
+            else:
+                # Redo an insertion or undo a deletion
+                document = change.get("after" if op == "insert" else "before")
+                if document is not None:
+                    replacements.append(document)
+
+        if captured:
+            # Undoing an insertion: keep the document on the change record
+            # before removing it, so that a redo can insert it back
+            documents = {
+                doc["_id"]: doc
+                for doc in model.collection.find({"_id": {
+                    "$in": [change["documentId"] for change in captured]
+                }})
+            }
+            if documents:
+                self.documentChangeModel.collection.bulk_write([
+                    UpdateOne(
+                        {"_id": change["_id"]},
+                        {"$set": {"after": documents[change["documentId"]]}},
+                    )
+                    for change in captured
+                    if change["documentId"] in documents
+                ], ordered=False)
+            removed.extend(documents.values())
+
+        if model.tracksDatasetChanges:
+            model.stampDatasetChanges(replacements)
+            model.recordDatasetRemovals(removed)
+            if updates:
+                updated = [
+                    {
+                        "_id": doc["_id"],
+                        "datasetId": updates[doc["_id"]]
+                        .get("$set", {})
+                        .get("datasetId", doc.get("datasetId")),
+                    }
+                    for doc in model.collection.find(
+                        {"_id": {"$in": list(updates)}}, {"datasetId": 1}
+                    )
+                ]
+                model.stampDatasetChanges(updated)
+                for doc in updated:
+                    if "changeSeq" in doc:
+                        updates[doc["_id"]].setdefault("$set", {})[
+                            "changeSeq"
+                        ] = doc["changeSeq"]
+
+        # Summary fields of the documents about to be written, to update the
+        # dataset summaries once they are
+        writtenIds = [document["_id"] for document in replacements]
+        writtenIds += list(updates)
+        removedIds = [document["_id"] for document in removed]
+        summaryBefore = model.findSummaryFields(
+            {"_id": {"$in": writtenIds + removedIds}}
+        )
+
+        operations = [
+            ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+            for document in replacements
+        ]
+        operations.extend(
+            UpdateOne({"_id": document_id}, update)
+            for document_id, update in updates.items()
+            if update
+        )
+        if removed:
+            operations.append(DeleteMany(
+                {"_id": {"$in": [document["_id"] for document in removed]}}
+            ))
+        if operations:
+            model.collection.bulk_write(operations, ordered=False)
+        if model.datasetSummaryFields and operations:
+            model.summarizeChanges(summaryBefore, model.findSummaryFields(
+                {"_id": {"$in": writtenIds}}
+            ))
+
     def cleanRemoveWithQuery(self, query, creator, **kwargs):
         # Find the ids of the docs to remove
         removed_docs = self.find(
@@ -196,3 +367,34 @@ class History(CustomNimbusImageModel):
         )
 
         return new_history_entry
+
+    def createInGroup(self, creator, entry, record, group):
+        """Record the changes of a request in the entry of its group of
+        requests, created by the first of them to finish.
+
+        The requests of a group may run concurrently, and should change
+        distinct documents: their changes are undone and redone together,
+        in no particular order.
+        """
+        query = {
+            "userId": creator["_id"],
+            "datasetId": entry["datasetId"],
+            "historyGroup": group,
+            "isUndone": False,
+        }
+        existing = self.findOne(query)
+        if existing is None:
+            try:
+                return self.create(
+                    creator, dict(entry, historyGroup=group), record
+                )
+            except ValidationException:
+                # Model.save reports the duplicate key of an entry another
+                # request of the group created meanwhile
+                existing = self.findOne(query)
+                if existing is None:
+                    raise
+        self.documentChangeModel.createChangesFromRecord(
+            existing["_id"], record, creator
+        )
+        return existing
@@ -2,6 +2,7 @@ from ..helpers.proxiedModel import ProxiedModel
 from girder.exceptions import ValidationException, RestException
 from girder.constants import AccessType
 from ..helpers.tasks import runJobRequest
+from .propertyValueIndex import PropertyValueIndex
 
 from ..helpers.fastjsonschema import customJsonSchemaCompile
 import fastjsonschema
@@ -61,6 +62,7 @@ class AnnotationProperty(ProxiedModel):
 
     def delete(self, property):
         self.remove(property)
+        PropertyValueIndex().dropProperty(str(property["_id"]))
 
     def getPropertyById(self, id, user=None):
         return self.load(id, user=user)
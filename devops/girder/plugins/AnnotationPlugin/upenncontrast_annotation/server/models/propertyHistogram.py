@@ -0,0 +1,93 @@
+from pymongo import ReplaceOne
+
+from girder import events
+from girder.constants import SortDir
+from girder.models.model_base import Model
+
+from .changeSequence import DatasetChangeSequence
+
+
+class PropertyHistogram(Model):
+    """
+    Histograms of property values, stored with the write version of their
+    dataset (see DatasetChangeSequence.writeVersion).
+
+    Documents are {datasetId, propertyPath, buckets, version, histogram}.
+    A histogram is served while the dataset has not been written since it
+    was computed, and recomputed on its next read otherwise, so writes never
+    have to invalidate it.
+    """
+
+    def initialize(self):
+        self.name = "property_histogram"
+        self.ensureIndices([(
+            (
+                ("datasetId", SortDir.ASCENDING),
+                ("propertyPath", SortDir.ASCENDING),
+                ("buckets", SortDir.ASCENDING),
+            ),
+            {},
+        )])
+        events.bind(
+            "model.folder.remove",
+            "upenn.propertyHistogram.folderRemovedEvent",
+            self.folderRemovedEvent,
+        )
+
+    def validate(self, document):
+        return document
+
+    def folderRemovedEvent(self, event):
+        if event.info and event.info["_id"]:
+            self.collection.delete_many({"datasetId": event.info["_id"]})
+
+    def getOrCompute(self, datasetId, propertyPaths, buckets, compute):
+        """The histograms of the property paths of a dataset.
+
+        Args:
+            datasetId (ObjectId): The dataset
+            propertyPaths (list[str]): Dotted property paths
+            buckets (int): The number of buckets of each histogram
+            compute (Callable): Called with the paths whose stored histogram
+                is missing or stale, returns their histograms by path
+
+        Returns:
+            dict: The histogram of each path
+        """
+        version = DatasetChangeSequence().writeVersion(datasetId)
+        histograms = {
+            document["propertyPath"]: document["histogram"]
+            for document in self.collection.find({
+                "datasetId": datasetId,
+                "propertyPath": {"$in": list(propertyPaths)},
+                "buckets": buckets,
+                "version": version,
+            })
+        }
+        stalePaths = [
+            path for path in propertyPaths if path not in histograms
+        ]
+        if not stalePaths:
+            return histograms
+
+        computed = compute(stalePaths)
+        self.collection.bulk_write([
+            ReplaceOne(
+                {
+                    "datasetId": datasetId,
+                    "propertyPath": path,
+                    "buckets": buckets,
+                },
+                {
+                    "datasetId": datasetId,
+                    "propertyPath": path,
+                    "buckets": buckets,
+                    "version": version,
+                    "histogram": computed[path],
+                },
+                upsert=True,
+            )
+            for path in stalePaths
+        ], ordered=False)
+        histograms.update(computed)
+        return histograms
@@ -0,0 +1,175 @@
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from girder.models.model_base import Model
+
+logger = logging.getLogger(__name__)
+
+
+class PropertyValueIndex(Model):
+    """
+    Partial indexes of the property-value collection, one per property value
+    path, serving the histograms and the property filters and sorts.
+
+    Each managed index is {datasetId: 1, "values.<path>": 1}, restricted to
+    the docs that have the path, and has a document {_id: "values.<path>",
+    indexName, lastUsed} here. Indexes are created for the leaf paths of
+    computed values when they are first submitted, refreshed when a query
+    uses them, and dropped with their property. At most `maxIndexes` are
+    kept: the least recently used is dropped before creating one more.
+
+    Indexes only speed up queries, so they are built on a background
+    thread of this process, outside the write that submitted the values,
+    and a failed build is logged without failing anything.
+    """
+
+    # MongoDB allows 64 indexes per collection, including the fixed ones
+    maxIndexes = 40
+
+    # Minimum delay between two lastUsed writes of a path by this process
+    touchInterval = datetime.timedelta(minutes=1)
+
+    # Off in the tests, whose database does not outlive them
+    buildInBackground = True
+
+    def initialize(self):
+        self.name = "property_value_index"
+        self.ensureIndices(["lastUsed"])
+        self.lock = threading.Lock()
+        # Paths this process knows to be indexed
+        self.indexed = set()
+        # When this process last marked each path as used
+        self.touched = {}
+        # Paths whose index is being built by this process
+        self.pending = set()
+        self.builder = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="propertyValueIndex"
+        )
+
+    def validate(self, document):
+        return document
+
+    @property
+    def valuesCollection(self):
+        # By name: the property-value model imports this one
+        return self.database["annotation_property_values"]
+
+    @staticmethod
+    def leafPaths(values, prefix="values"):
+        """The dotted paths of the non-object values of a values dict."""
+        paths = set()
+        for key, value in values.items():
+            if not isinstance(key, str) or "." in key or key.startswith("$"):
+                continue
+            path = prefix + "." + key
+            if isinstance(value, dict):
+                paths.update(PropertyValueIndex.leafPaths(value, path))
+            else:
+                paths.add(path)
+        return paths
+
+    def ensure(self, valueKeys):
+        """Build the indexes of the paths (values.<path>) not indexed yet.
+
+        Returns:
+            Future: The background build, or None when nothing is built
+                or the build ran inline
+        """
+        with self.lock:
+            missing = set(valueKeys) - self.indexed - self.pending
+            self.pending.update(missing)
+        if not missing:
+            return None
+        if not self.buildInBackground:
+            self.build(missing)
+            return None
+        return self.builder.submit(self.build, missing)
+
+    def build(self, valueKeys):
+        """Create the indexes of the paths one at a time, each after
+        evicting the least recently used beyond maxIndexes - 1."""
+        try:
+            for valueKey in sorted(valueKeys):
+                try:
+                    self._build(valueKey)
+                except PyMongoError:
+                    logger.exception(
+                        "Could not index property values at %s", valueKey
+                    )
+        finally:
+            with self.lock:
+                self.pending.difference_update(valueKeys)
+
+    def _build(self, valueKey):
+        if self.collection.find_one({"_id": valueKey}) is None:
+            self.evict(reserve=1)
+            indexName = self.valuesCollection.create_index(
+                [("datasetId", 1), (valueKey, 1)],
+                name="propertyValue_" + valueKey,
+                partialFilterExpression={valueKey: {"$exists": True}},
+            )
+            # Recorded once the index exists, so that a failed build is
+            # retried on the next submission of the path
+            self.collection.update_one(
+                {"_id": valueKey},
+                {
+                    "$set": {"indexName": indexName},
+                    "$setOnInsert": {
+                        "lastUsed": datetime.datetime.utcnow(),
+                    },
+                },
+                upsert=True,
+            )
+        with self.lock:
+            self.indexed.add(valueKey)
+
+    def touch(self, valueKeys):
+        """Mark the indexes of the paths as used by a query."""
+        now = datetime.datetime.utcnow()
+        for valueKey in valueKeys:
+            with self.lock:
+                last = self.touched.get(valueKey)
+                if last is not None and now - last < self.touchInterval:
+                    continue
+                self.touched[valueKey] = now
+            self.collection.update_one(
+                {"_id": valueKey}, {"$set": {"lastUsed": now}}
+            )
+
+    def evict(self, reserve=0):
+        """Drop the least recently used indexes beyond maxIndexes, keeping
+        room for `reserve` more."""
+        excess = (
+            self.collection.count_documents({}) + reserve - self.maxIndexes
+        )
+        if excess > 0:
+            self._drop(list(self.collection.find(
+                {}, sort=[("lastUsed", 1)], limit=excess
+            )))
+
+    def dropProperty(self, propertyId):
+        """Drop the indexes of the paths of a property."""
+        prefix = "values." + propertyId
+        self._drop(list(self.collection.find({"$or": [
+            {"_id": prefix},
+            # "/" follows "." in byte order
+            {"_id": {"$gte": prefix + ".", "$lt": prefix + "/"}},
+        ]})))
+
+    def _drop(self, documents):
+        for document in documents:
+            try:
+                self.valuesCollection.drop_index(
+                    document.get("indexName")
+                    or "propertyValue_" + document["_id"]
+                )
+            except OperationFailure:
+                # Already dropped, e.g. by another server process
+                pass
+            self.collection.delete_one({"_id": document["_id"]})
+            with self.lock:
+                self.indexed.discard(document["_id"])
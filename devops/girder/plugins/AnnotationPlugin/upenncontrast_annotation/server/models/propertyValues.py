@@ -9,6 +9,9 @@ from girder.utility.acl_mixin import AccessControlMixin
 
 from ..helpers.fastjsonschema import customJsonSchemaCompile
 from ..helpers.proxiedModel import ProxiedModel
+from .datasetSummary import DatasetSummary
+from .propertyHistogram import PropertyHistogram
+from .propertyValueIndex import PropertyValueIndex
 
 
 class PropertySchema:
@@ -46,6 +49,10 @@ class PropertySchema:
 # AccessControlMixin must precede ProxiedModel so its permission-aware
 # find/load methods take MRO precedence over the unchecked base methods.
 class AnnotationPropertyValues(AccessControlMixin, ProxiedModel):
+    # Invalidate cached list totals on writes.
+    versionsDatasetWrites = True
+    # Count values by property id in the dataset summary.
+    datasetSummaryFields = ("values",)
 
     def __init__(self):
         super().__init__()
@@ -53,7 +60,14 @@ class AnnotationPropertyValues(AccessControlMixin, ProxiedModel):
             ('datasetId', SortDir.ASCENDING),
             ('_id', SortDir.ASCENDING)
         )
+        # Values of a dataset in annotation order, for merge-joins with
+        # annotations sorted by _id (CSV export)
+        annotationOrderIndex = (
+            ('datasetId', SortDir.ASCENDING),
+            ('annotationId', SortDir.ASCENDING)
+        )
         self.ensureIndices([(compoundSearchIndex, {}),
+                            (annotationOrderIndex, {}),
                             "annotationId", "datasetId"])
 
         # Used by Girder to define what field are used to check permissions
@@ -112,21 +126,71 @@ class AnnotationPropertyValues(AccessControlMixin, ProxiedModel):
                     propertyValues["values"].update(existingDocument["values"])
                     propertyValues["_id"] = existingDocument["_id"]
 
-        # TODO(performance): create sparse index on properties if nonexisting
-        # https://docs.mongodb.com/manual/reference/operator/query/exists/
-
         return propertyValuesList
 
+    def summarizeChanges(self, before, after):
+        DatasetSummary().valuesChanged(before, after)
+
     def appendValues(self, values, annotationId, datasetId):
-        property_values = {
+        self.mergeMultipleValues([{
             "annotationId": annotationId,
             "values": values,
             "datasetId": datasetId,
-        }
-        return self.save(property_values)
+        }])
+        return self.findOne({"annotationId": annotationId})
 
     def appendMultipleValues(self, list_of_property_values):
-        return self.saveMany(list_of_property_values)
+        return self.mergeMultipleValues(list_of_property_values)
+
+    def mergeMultipleValues(self, propertyValuesList):
+        """Merge the submitted values into the value doc of each annotation,
+        creating the docs that do not exist yet.
+
+        Each submission becomes an upsert setting only its own top-level
+        property ids (values.<propertyId>), so the values of the other
+        properties of the annotation are neither read nor rewritten, and
+        workers submitting different properties of the same annotations do
+        not overwrite each other. A submitted property replaces the stored
+        value of that property.
+
+        Args:
+            propertyValuesList (list[dict]): {annotationId, datasetId,
+                values} documents
+
+        Returns:
+            list[dict]: The submitted documents
+        """
+        try:
+            for propertyValues in propertyValuesList:
+                self.jsonValidate(propertyValues)
+        except fastjsonschema.JsonSchemaValueException as exp:
+            raise ValidationException(exp)
+
+        updates = []
+        valueKeys = set()
+        for propertyValues in propertyValuesList:
+            if "annotationId" not in propertyValues:
+                raise ValidationException(
+                    "Property values need an annotationId"
+                )
+            fields = {}
+            if "datasetId" in propertyValues:
+                fields["datasetId"] = propertyValues["datasetId"]
+            values = propertyValues.get("values") or {}
+            for propertyId, value in values.items():
+                if not DatasetSummary.isCountableKey(propertyId):
+                    raise ValidationException(
+                        "Invalid property id: %s" % propertyId
+                    )
+                fields["values." + propertyId] = value
+            valueKeys.update(PropertyValueIndex.leafPaths(values))
+            update = {"$set": fields} if fields else {}
+            if not values:
+                update["$setOnInsert"] = {"values": {}}
+            updates.append((propertyValues["annotationId"], update))
+        self.upsertMany("annotationId", updates)
+        PropertyValueIndex().ensure(valueKeys)
+        return propertyValuesList
 
     def findByAnnotationIds(
         self, datasetId, annotationIds, propertyPaths=None
@@ -164,42 +228,83 @@ class AnnotationPropertyValues(AccessControlMixin, ProxiedModel):
         return results
 
     def delete(self, propertyId, datasetId):
-        # Could use self.collection.updateMany but girder doesn't expose it
-        for document in self.find(
-            {
-                "datasetId": datasetId,
-                ".".join(["values", propertyId]): {"$exists": True},
-            }
-        ):
-            document["values"].pop(propertyId, None)
-            if len(document["values"]) == 0:
-                self.remove(document)
-            else:
-                self.save(document, False)
+        # Drop the property from every value doc of the dataset with a single
+        # $unset, then remove the docs left without values. Both writes go
+        # through the recorded update/removeWithQuery, so the deletion can be
+        # undone: the update only records the dropped property of each doc.
+        valueKey = "values." + propertyId
+        result = self.update(
+            {"datasetId": datasetId, valueKey: {"$exists": True}},
+            {"$unset": {valueKey: ""}},
+            summarize=False,
+        )
+        if result.modified_count:
+            DatasetSummary().valuesRemoved(
+                datasetId, propertyId, result.modified_count
+            )
+        self.removeWithQuery({"datasetId": datasetId, "values": {}})
 
     def histogram(self, propertyPath, datasetId, buckets=255):
-        valueKey = "values." + propertyPath
-        match = {
-            "$match": {
-                "datasetId": datasetId,
-                # TODO(performance): sparse index see above
-                valueKey: {"$exists": True, "$ne": None},
-            }
-        }
+        return self.histograms([propertyPath], datasetId, buckets)[
+            propertyPath
+        ]
 
-        bucket = {
-            "$bucketAuto": {"groupBy": "$" + valueKey, "buckets": buckets}
-        }
+    def histograms(self, propertyPaths, datasetId, buckets=255):
+        """Histograms of several property paths of a dataset, served from
+        PropertyHistogram until the next write to the dataset.
 
-        project = {
-            "$project": {
+        Args:
+            propertyPaths (list[str]): Dotted property paths
+                (propertyId.subId0.subId1)
+            datasetId (ObjectId): The dataset
+            buckets (int): The number of buckets of each histogram
+
+        Returns:
+            dict: A list of {min, max, count} buckets for each path
+        """
+        PropertyValueIndex().touch(
+            ["values." + path for path in propertyPaths]
+        )
+        return PropertyHistogram().getOrCompute(
+            datasetId, propertyPaths, buckets,
+            lambda stalePaths: self._computeHistograms(
+                stalePaths, datasetId, buckets
+            ),
+        )
+
+    def _histogramStages(self, propertyPath, buckets):
+        valueKey = "values." + propertyPath
+        return [
+            {"$match": {valueKey: {"$exists": True, "$ne": None}}},
+            {"$bucketAuto": {"groupBy": "$" + valueKey, "buckets": buckets}},
+            {"$project": {
                 "_id": False,
                 "min": "$_id.min",
                 "max": "$_id.max",
                 "count": True,
-            }
-        }
+            }},
+        ]
 
-        return self.collection.aggregate([match, bucket, project])
+    def _computeHistograms(self, propertyPaths, datasetId, buckets):
+        if len(propertyPaths) == 1:
+            # The single-path pipeline can use the path's partial index
+            [propertyPath] = propertyPaths
+            stages = self._histogramStages(propertyPath, buckets)
+            stages[0]["$match"]["datasetId"] = datasetId
+            return {propertyPath: list(self.collection.aggregate(stages))}
+        # One pass over the dataset's values for all the paths. Facet names
+        # can't contain dots, so each path gets its position instead.
+        facets = {
+            "h%d" % i: self._histogramStages(propertyPath, buckets)
+            for i, propertyPath in enumerate(propertyPaths)
+        }
+        [result] = self.collection.aggregate([
+            {"$match": {"datasetId": datasetId}},
+            {"$facet": facets},
+        ])
+        return {
+            propertyPath: result["h%d" % i]
+            for i, propertyPath in enumerate(propertyPaths)
+        }
 
     # def SSE for property change, sends the whole annotation
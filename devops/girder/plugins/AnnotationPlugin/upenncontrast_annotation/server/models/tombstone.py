@@ -0,0 +1,102 @@
+import datetime
+
+from girder import events
+from girder.constants import SortDir
+from girder.models.model_base import Model
+
+from .changeSequence import DatasetChangeSequence
+
+
+class DatasetTombstone(Model):
+    """
+    Records the removal of documents from models that track dataset changes,
+    tagged with the dataset change sequence of the removal, so a delta sync
+    can report deletions as well as upserts.
+
+    Documents are {datasetId, modelName, documentId, seq, created}. They
+    are pruned once older than `retention`, after raising the oldest
+    sequence a delta can start from (see DatasetChangeSequence.deltaFloor):
+    clients that last synced before it get a reset instead of a delta.
+    They are cleaned up with their dataset.
+    """
+
+    retention = datetime.timedelta(days=30)
+
+    def initialize(self):
+        self.name = "dataset_tombstone"
+        self.ensureIndices([
+            (
+                (
+                    ("datasetId", SortDir.ASCENDING),
+                    ("modelName", SortDir.ASCENDING),
+                    ("seq", SortDir.ASCENDING),
+                ),
+                {},
+            ),
+            (
+                (
+                    ("datasetId", SortDir.ASCENDING),
+                    ("created", SortDir.ASCENDING),
+                ),
+                {},
+            ),
+        ])
+        events.bind(
+            "model.folder.remove",
+            "upenn.tombstone.folderRemovedEvent",
+            self.folderRemovedEvent,
+        )
+
+    def validate(self, document):
+        return document
+
+    def folderRemovedEvent(self, event):
+        if event.info and event.info["_id"]:
+            self.collection.delete_many({"datasetId": event.info["_id"]})
+
+    def record(self, modelName, removedDocuments, seqByDataset):
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        tombstones = [
+            {
+                "datasetId": document["datasetId"],
+                "modelName": modelName,
+                "documentId": document["_id"],
+                "seq": seqByDataset[document["datasetId"]],
+                "created": now,
+            }
+            for document in removedDocuments
+        ]
+        if tombstones:
+            self.collection.insert_many(tombstones)
+            self.prune(seqByDataset, now - self.retention)
+
+    def prune(self, datasetIds, before):
+        """Remove the tombstones of the datasets created before `before`,
+        with every older one."""
+        for datasetId in set(datasetIds):
+            expired = self.collection.find_one(
+                {"datasetId": datasetId, "created": {"$lt": before}},
+                {"seq": 1},
+                sort=[("seq", SortDir.DESCENDING)],
+            )
+            if expired is None:
+                continue
+            # Raise the floor first: a delta read meanwhile resets rather
+            # than misses the removals
+            DatasetChangeSequence().raiseDeltaFloor(datasetId, expired["seq"])
+            self.collection.delete_many(
+                {"datasetId": datasetId, "seq": {"$lte": expired["seq"]}}
+            )
+
+    def removedIdsSince(self, modelName, datasetId, since):
+        return [
+            tombstone["documentId"]
+            for tombstone in self.collection.find(
+                {
+                    "datasetId": datasetId,
+                    "modelName": modelName,
+                    "seq": {"$gt": since},
+                },
+                {"documentId": 1},
+            )
+        ]
@@ -2,6 +2,10 @@ import pytest
 
 from girder import events
 
+from upenncontrast_annotation.server.models.propertyValueIndex import (
+    PropertyValueIndex,
+)
+
 
 def unbindGirderEventsByHandlerName(handlerName):
     for eventName in events._mapping:
@@ -18,3 +22,9 @@ def unbindLargeImage(db):
 def unbindAnnotation(db):
     yield True
     unbindGirderEventsByHandlerName("upenncontrast_annotation")
+
+
+@pytest.fixture(autouse=True)
+def buildPropertyIndexesInline(monkeypatch):
+    # A background build could outlive the test database
+    monkeypatch.setattr(PropertyValueIndex, "buildInBackground", False)
@@ -14,6 +14,7 @@ from pytest_girder.assertions import assertStatus, assertStatusOk
 from girder.constants import AccessType
 from girder.models.folder import Folder
 
+from upenncontrast_annotation.server.helpers import access_helpers
 from upenncontrast_annotation.server.models.annotation import Annotation
 from upenncontrast_annotation.server.models.connections import (
     AnnotationConnection,
@@ -540,3 +541,60 @@ class TestInheritedAccessLoad:
             user=user,
         )
         assertStatus(resp, 403)
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestDatasetAccessCache:
+    """Read endpoints reuse recent dataset access grants
+    (access_helpers.requireDatasetAccess)."""
+
+    def _count(self, server, user, folder):
+        return server.request(
+            path="/upenn_annotation/count",
+            method="GET",
+            user=user,
+            params={"datasetId": str(folder["_id"])},
+        )
+
+    def _sharedFolder(self, admin, user):
+        folder = utilities.createPrivateFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        return Folder().setUserAccess(
+            folder, user, AccessType.READ, save=True
+        )
+
+    def testGrantIsReusedWithinTheTtl(
+        self, admin, user, server, monkeypatch
+    ):
+        folder = self._sharedFolder(admin, user)
+        loads = []
+        load = Folder.load
+        monkeypatch.setattr(
+            Folder, "load",
+            lambda self, *args, **kwargs: (
+                loads.append(args[0]), load(self, *args, **kwargs)
+            )[1],
+        )
+        assertStatusOk(self._count(server, user, folder))
+        assertStatusOk(self._count(server, user, folder))
+        assert loads.count(folder["_id"]) == 1
+
+        monkeypatch.setattr(access_helpers.datasetAccessCache, "ttl", 0)
+        assertStatusOk(self._count(server, user, folder))
+        assert loads.count(folder["_id"]) == 2
+
+    def testRevokedAccessIsDeniedAtOnce(self, admin, user, server):
+        folder = self._sharedFolder(admin, user)
+        assertStatusOk(self._count(server, user, folder))
+        Folder().setUserAccess(folder, user, None, save=True)
+        assertStatus(self._count(server, user, folder), 403)
+
+    def testDenialIsNotCached(self, admin, user, server):
+        folder = utilities.createPrivateFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        assertStatus(self._count(server, user, folder), 403)
+        Folder().setUserAccess(folder, user, AccessType.READ, save=True)
+        assertStatusOk(self._count(server, user, folder))
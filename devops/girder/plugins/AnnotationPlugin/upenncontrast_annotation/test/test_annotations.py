@@ -10,7 +10,11 @@ from upenncontrast_annotation.server.models import annotation
 from upenncontrast_annotation.server.models.propertyValues import (
     AnnotationPropertyValues,
 )
+from upenncontrast_annotation.server.models.tombstone import (
+    DatasetTombstone,
+)
 
+from girder import events
 from girder.constants import AccessType
 from girder.models.folder import Folder
 
@@ -493,6 +497,176 @@ class TestUpdateMultiple:
         assert "accessLevel" not in loaded
 
 
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestSaveMany:
+    """saveMany() replaces existing documents in place."""
+
+    def testMixedInsertAndReplaceInBatches(self, admin, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        existing = [
+            Annotation().create(
+                upenn_utilities.getSampleAnnotation(folder["_id"])
+            )
+            for _ in range(5)
+        ]
+        monkeypatch.setattr(Annotation(), "saveManyBatchSize", 2)
+        received = []
+        with events.bound(
+            "model.upenn_annotation.saveMany.after", "testSaveMany",
+            lambda event: received.append(event.info),
+        ):
+            # String ids are accepted and stored as ObjectIds
+            documents = [
+                dict(doc, _id=str(doc["_id"]), tags=["replaced"])
+                for doc in existing
+            ]
+            documents.insert(
+                2, upenn_utilities.getSampleAnnotation(folder["_id"])
+            )
+            saved = Annotation().saveMany(documents)
+
+        assert [doc["_id"] for doc in saved[:2] + saved[3:]] == [
+            doc["_id"] for doc in existing
+        ]
+        assert "_id" in saved[2]
+        assert len(list(Annotation().find({"datasetId": folder["_id"]}))) == 6
+        for doc in existing:
+            stored = Annotation().load(doc["_id"], force=True)
+            assert stored["tags"] == ["replaced"]
+        assert len(received) == 1
+        assert received[0]["removedIds"] == [doc["_id"] for doc in existing]
+        assert received[0]["newDocuments"] is saved
+        # Replacement is not a removal: no tombstones are left behind
+        assert DatasetTombstone().removedIdsSince(
+            Annotation().name, folder["_id"], 0
+        ) == []
+
+    def testInvalidDocumentWritesNothing(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        invalid = upenn_utilities.getSampleAnnotation(folder["_id"])
+        del invalid["shape"]
+        with pytest.raises(ValidationException):
+            Annotation().saveMany(
+                [dict(annotation, tags=["changed"]), invalid]
+            )
+        stored = Annotation().load(annotation["_id"], force=True)
+        assert stored["tags"] == annotation["tags"]
+
+    def testUndoRestoresReplacedDocuments(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        resp = server.request(
+            path="/upenn_annotation/multiple",
+            method="PUT",
+            user=admin,
+            body=json.dumps([{
+                "id": str(annotation["_id"]),
+                "datasetId": str(folder["_id"]),
+                "tags": ["updated"],
+            }]),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        stored = Annotation().load(annotation["_id"], force=True)
+        assert stored["tags"] == ["updated"]
+
+        resp = server.request(
+            path="/history/undo",
+            method="PUT",
+            user=admin,
+            params={"datasetId": str(folder["_id"])},
+        )
+        assertStatusOk(resp)
+        stored = Annotation().load(annotation["_id"], force=True)
+        assert stored["tags"] == annotation["tags"]
+
+    def testUpsertManyStampsDatasetChanges(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        Annotation().upsertMany("_id", [
+            (annotation["_id"], {"$set": {"name": "renamed"}}),
+        ])
+        stored = Annotation().load(annotation["_id"], force=True)
+        assert stored["name"] == "renamed"
+        assert stored["changeSeq"] > annotation["changeSeq"]
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestValidateMultiple:
+    """The schema only validates what the fast checks do not accept."""
+
+    def _annotations(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        return folder, [
+            dict(
+                upenn_utilities.getSampleAnnotation(folder["_id"]),
+                coordinates=[
+                    {"x": i, "y": 2.5 * i, "z": 0},
+                    {"x": 3 * i + 1, "y": 1},
+                    {"x": 2, "y": i},
+                ],
+            )
+            for i in range(4)
+        ]
+
+    def testValidAnnotationsSkipTheSchema(self, admin, monkeypatch):
+        _, annotations = self._annotations(admin)
+        validated = []
+        monkeypatch.setattr(
+            Annotation(), "jsonValidate", validated.append
+        )
+        Annotation().validateMultiple(annotations)
+        assert validated == []
+        for document in annotations:
+            assert {
+                key: document[key]
+                for key in ("bbox", "centroid", "estimatedRadius")
+            } == Annotation.spatialFields(document["coordinates"])
+
+    def testInvalidAnnotationsRaiseTheSchemaError(self, admin):
+        _, annotations = self._annotations(admin)
+        for field, value in (
+            ("channel", True),
+            ("coordinates", [{"y": 1}]),
+            ("coordinates", []),
+            ("shape", "hexagon"),
+            ("tags", ["a", 1]),
+        ):
+            invalid = dict(annotations[1], **{field: value})
+            with pytest.raises(ValidationException, match="data"):
+                Annotation().validateMultiple(
+                    [annotations[0], invalid, annotations[2]]
+                )
+
+    def testEveryDatasetMustExist(self, admin):
+        folder, annotations = self._annotations(admin)
+        other = utilities.createFolder(admin, "other", {})
+        annotations[2]["datasetId"] = other["_id"]
+        with pytest.raises(
+            ValidationException, match="Annotation dataset ID is invalid"
+        ):
+            Annotation().validateMultiple(annotations)
+
+
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
 @pytest.mark.plugin("upenncontrast_annotation")
 class TestInlinePropertiesField:
@@ -2,13 +2,16 @@ import json
 import pytest
 import math
 
-from pytest_girder.assertions import assertStatusOk
+import numpy as np
+
+from pytest_girder.assertions import assertStatus, assertStatusOk
 
 from upenncontrast_annotation.server.models.annotation import Annotation
 from upenncontrast_annotation.server.models.connections import (
     AnnotationConnection,
 )
 from upenncontrast_annotation.server.models import connections
+from upenncontrast_annotation.server.helpers import geometry
 from upenncontrast_annotation.server.helpers.connections import (
     annotationToAnnotationDistance,
     isAPoint,
@@ -433,62 +436,228 @@ class TestConnectToNearest:
         )
         assert distance == math.sqrt(162)
 
-    def testGetClosestAnnotation(self, db):
-        closest, _ = AnnotationConnection().getClosestAnnotation(
-            self.pointAnnotationRef, self.pointAnnotations
+
+class TestGeometry:
+    coordinateLists = [
+        [{"x": 1, "y": 2, "z": 3}],
+        [],
+        [{"x": 6, "y": 2}, {"x": 5, "y": -9, "z": 0}, {"x": 2, "y": -7}],
+        [{"x": 7, "y": 3, "z": 1}, {"x": 9, "y": 5, "z": 3}],
+    ]
+
+    def testCoordinateBuffer(self):
+        buffer = geometry.coordinateBuffer(self.coordinateLists)
+        assert buffer.offsets.tolist() == [0, 1, 1, 4, 6]
+        assert buffer.xy.dtype == np.float64
+        assert buffer.xy.shape == (6, 2)
+        assert buffer.xy[2].tolist() == [5, -9]
+        assert np.isnan(buffer.z[1]) and buffer.z[2] == 0
+
+    def testCentroidsMatchSimpleCentroid(self):
+        xy, z = geometry.centroids(
+            geometry.coordinateBuffer(self.coordinateLists)
+        )
+        for i, coordinates in enumerate(self.coordinateLists):
+            if not coordinates:
+                assert np.isnan(xy[i]).all() and np.isnan(z[i])
+                continue
+            expected = simpleCentroid(coordinates)
+            assert xy[i].tolist() == pytest.approx(
+                [expected["x"], expected["y"]]
+            )
+            if "z" in expected:
+                assert z[i] == pytest.approx(expected["z"])
+            else:
+                assert np.isnan(z[i])
+
+    def testDistancesMatchAnnotationDistance(self):
+        annotations = (
+            TestConnectToNearest.pointAnnotations
+            + TestConnectToNearest.lineAnnotations
+            + TestConnectToNearest.blobAnnotations
+        )
+        xy, z = geometry.centroids(geometry.coordinateBuffer(
+            [annotation["coordinates"] for annotation in annotations]
+        ))
+        # Every pair at once, by broadcasting
+        matrix = geometry.distances(
+            xy[:, np.newaxis], z[:, np.newaxis], xy, z
+        )
+        for i, first in enumerate(annotations):
+            for j, second in enumerate(annotations):
+                assert matrix[i, j] == pytest.approx(
+                    annotationToAnnotationDistance(first, second)
+                )
+
+    def testDistancesIgnoreMissingZ(self):
+        assert geometry.distances(
+            np.array([0, 0]), np.nan, np.array([[3, 4], [0, 0]]),
+            np.array([10, 2]),
+        ).tolist() == [5, 0]
+        assert geometry.distances(
+            np.array([0, 0]), 1.0, np.array([0, 0]), 3.0
+        ) == 2
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestConnectToNearestEndpoint:
+    def createPoint(self, dataset, x, y, **fields):
+        annotation = upenn_utilities.getSampleAnnotation(dataset["_id"])
+        annotation.update(
+            shape="point", coordinates=[{"x": x, "y": y}], **fields
         )
-        assert closest == self.pointAnnotations[1]
+        return Annotation().create(annotation)
 
-        closest, _ = AnnotationConnection().getClosestAnnotation(
-            self.pointAnnotationRef, self.lineAnnotations
+    def connectTo(self, server, user, annotations, tags=None, channelId=None):
+        return server.request(
+            path="/annotation_connection/connectTo",
+            method="POST",
+            user=user,
+            body=json.dumps({
+                "annotationsIds": [
+                    str(annotation["_id"]) for annotation in annotations
+                ],
+                "tags": tags or [],
+                "channelId": channelId,
+            }),
+            type="application/json",
         )
-        assert closest == self.lineAnnotations[0]
 
-        closest, _ = AnnotationConnection().getClosestAnnotation(
-            self.pointAnnotationRef, self.blobAnnotations
+    def testConnectsEachAnnotationToItsNearest(self, admin, server):
+        dataset = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
         )
-        assert closest == self.blobAnnotations[0]
+        nuclei = [
+            self.createPoint(dataset, 0, 0, tags=["nucleus"]),
+            self.createPoint(dataset, 100, 100, tags=["nucleus"]),
+        ]
+        # Not a candidate: wrong tag
+        self.createPoint(dataset, 1, 1, tags=["other"])
+        spots = [
+            self.createPoint(dataset, 90, 95, tags=["spot"]),
+            self.createPoint(dataset, 3, 4, tags=["spot"]),
+            self.createPoint(dataset, 2, 2, tags=["spot"]),
+        ]
 
-        annotations = (
-            self.pointAnnotations + self.lineAnnotations + self.blobAnnotations
+        resp = self.connectTo(server, admin, spots, tags=["nucleus"])
+        assertStatusOk(resp)
+        assert [
+            (connection["childId"], connection["parentId"])
+            for connection in resp.json
+        ] == [
+            (str(spots[0]["_id"]), str(nuclei[1]["_id"])),
+            (str(spots[1]["_id"]), str(nuclei[0]["_id"])),
+            (str(spots[2]["_id"]), str(nuclei[0]["_id"])),
+        ]
+        assert AnnotationConnection().collection.count_documents(
+            {"datasetId": dataset["_id"]}
+        ) == 3
+
+    def testOnlyConnectsWithinLocationAndChannel(self, admin, server):
+        dataset = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
         )
-        annotations.append(self.pointAnnotationRef)
-        closest, _ = AnnotationConnection().getClosestAnnotation(
-            self.pointAnnotationRef, annotations
+        otherTile = {"XY": 1, "Z": 0, "Time": 0}
+        sameTile = self.createPoint(dataset, 50, 50, channel=0)
+        self.createPoint(dataset, 0, 0, channel=1)
+        self.createPoint(dataset, 0, 0, channel=0, location=otherTile)
+        spot = self.createPoint(dataset, 1, 1, channel=0)
+        lonelySpot = self.createPoint(
+            dataset, 1, 1, channel=1, location={"XY": 2, "Z": 0, "Time": 0}
         )
-        assert closest == self.pointAnnotations[1]
 
-        (
-            closestPoint,
-            minDistanceToPoint,
-        ) = AnnotationConnection().getClosestAnnotation(
-            self.blobAnnotations[0], self.pointAnnotations
+        resp = self.connectTo(server, admin, [spot, lonelySpot], channelId=0)
+        assertStatusOk(resp)
+        assert len(resp.json) == 1
+        assert resp.json[0]["childId"] == str(spot["_id"])
+        assert resp.json[0]["parentId"] == str(sameTile["_id"])
+
+    def testUsesCoordinatesOfAnnotationsWithoutCentroid(self, admin, server):
+        dataset = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        near = self.createPoint(dataset, 5, 5)
+        self.createPoint(dataset, 20, 20)
+        spot = self.createPoint(dataset, 0, 0)
+        Annotation().collection.update_many(
+            {"datasetId": dataset["_id"]},
+            {"$unset": {"centroid": "", "bbox": "", "estimatedRadius": ""}},
         )
-        assert closestPoint == self.pointAnnotations[0]
 
-        (
-            closestLine,
-            minDistanceToLine,
-        ) = AnnotationConnection().getClosestAnnotation(
-            self.blobAnnotations[0], self.lineAnnotations
+        resp = self.connectTo(server, admin, [spot])
+        assertStatusOk(resp)
+        assert [connection["parentId"] for connection in resp.json] == [
+            str(near["_id"])
+        ]
+
+    def testDistanceIncludesZ(self, admin, server):
+        dataset = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
         )
-        assert closestLine == self.lineAnnotations[0]
 
-        (
-            closestBlob,
-            minDistanceToBlob,
-        ) = AnnotationConnection().getClosestAnnotation(
-            self.blobAnnotations[0], self.blobAnnotations
+        def createPoint3D(x, y, z):
+            annotation = upenn_utilities.getSampleAnnotation(dataset["_id"])
+            annotation.update(
+                shape="point", coordinates=[{"x": x, "y": y, "z": z}]
+            )
+            return Annotation().create(annotation)
+
+        # Nearest in x, y, but far in z
+        createPoint3D(1, 0, 100)
+        nearestInZ = createPoint3D(3, 0, 0)
+        # Without a z: at its x, y distance
+        withoutZ = self.createPoint(dataset, 0, 5)
+        spot = createPoint3D(0, 0, 0)
+        flatSpot = self.createPoint(dataset, 0, 4)
+
+        resp = self.connectTo(server, admin, [spot, flatSpot])
+        assertStatusOk(resp)
+        assert [connection["parentId"] for connection in resp.json] == [
+            str(nearestInZ["_id"]), str(withoutZ["_id"]),
+        ]
+
+    def testOnlyConnectsToMeasurableShapes(self, admin, server):
+        dataset = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
         )
-        assert closestBlob == self.blobAnnotations[1]
 
-        closest, minDistance = AnnotationConnection().getClosestAnnotation(
-            self.blobAnnotations[0], annotations
+        def createShape(shape, coordinates):
+            annotation = upenn_utilities.getSampleAnnotation(dataset["_id"])
+            annotation.update(shape=shape, coordinates=coordinates)
+            return Annotation().create(annotation)
+
+        square = [
+            {"x": 0, "y": 0}, {"x": 2, "y": 0},
+            {"x": 2, "y": 2}, {"x": 0, "y": 2},
+        ]
+        # Closer, but a rectangle has no distance
+        createShape("rectangle", square)
+        polygon = createShape(
+            "polygon",
+            [{"x": point["x"] + 20, "y": point["y"]} for point in square],
         )
-        assert minDistance == min(
-            minDistanceToPoint, minDistanceToLine, minDistanceToBlob
+        spot = self.createPoint(dataset, 1, 1)
+        roi = createShape("rectangle", square)
+
+        resp = self.connectTo(server, admin, [spot, roi])
+        assertStatusOk(resp)
+        assert [
+            (connection["childId"], connection["parentId"])
+            for connection in resp.json
+        ] == [
+            (str(spot["_id"]), str(polygon["_id"])),
+            (str(roi["_id"]), str(polygon["_id"])),
+        ]
+
+    def testRequiresReadAccess(self, admin, user, server):
+        dataset = utilities.createPrivateFolder(
+            admin, "private", upenn_utilities.datasetMetadata
         )
-        assert closest == closestPoint
+        self.createPoint(dataset, 0, 0)
+        spot = self.createPoint(dataset, 1, 1)
+        resp = self.connectTo(server, user, [spot])
+        assertStatus(resp, 403)
 
 
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
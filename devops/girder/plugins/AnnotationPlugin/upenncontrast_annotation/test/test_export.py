@@ -1,5 +1,9 @@
+import io
 import json
 
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 from pytest_girder.assertions import assertStatus, assertStatusOk
 
@@ -16,10 +20,16 @@ from upenncontrast_annotation.server.models.datasetView import (
     DatasetView as DatasetViewModel
 )
 from upenncontrast_annotation.server.api.export import (
+    ANNOTATION_EXPORT_EXCLUDED_FIELDS,
     Export,
     _deduplicateColumnNames,
     sanitizeCsvColumnName,
 )
+from upenncontrast_annotation.server.api import export as exportModule
+from upenncontrast_annotation.server.helpers import serialization
+from upenncontrast_annotation.server.helpers.serialization import (
+    orJsonDefaults,
+)
 
 from . import girder_utilities as utilities
 from . import upenn_testing_utilities as upenn_utilities
@@ -111,8 +121,8 @@ def buildExportData(export, datasetId, configurationId=None,
         )
 
     if includePropertyValues:
-        data["annotationPropertyValues"] = export._getPropertyValues(
-            datasetId
+        data["annotationPropertyValues"] = dict(
+            export._iterPropertyValues(datasetId)
         )
 
     return data
@@ -208,7 +218,7 @@ class TestExport:
                 "property values fetched for an empty subset"
             )
 
-        monkeypatch.setattr(export, "_getPropertyValues", failFetch)
+        monkeypatch.setattr(export, "_iterPropertyValues", failFetch)
         lines = list(export._generateCsvLines(
             dataset["_id"], [], parsedAnnotationIds=[]
         ))
@@ -244,6 +254,69 @@ class TestExport:
             400,
         )
 
+    def testExportJsonEndpointStreamsSameFormat(
+        self, admin, server, monkeypatch
+    ):
+        """The streamed body decodes to the same document as building the
+        whole export in memory, minus the server-maintained fields."""
+        dataset, annotations, _ = createDatasetWithData(admin)
+        for _ in range(3):
+            Annotation().create(
+                upenn_utilities.getSampleAnnotation(dataset["_id"])
+            )
+        monkeypatch.setattr(serialization, "JSON_CHUNK_ITEMS", 2)
+
+        response = server.request(
+            path="/export/json",
+            method="GET",
+            user=admin,
+            params={"datasetId": str(dataset["_id"])},
+            isJson=False,
+        )
+        assertStatusOk(response)
+        chunks = list(response.body)
+        assert len(chunks) > 4
+
+        expected = buildExportData(Export(), dataset["_id"], user=admin)
+        for annotation in expected["annotations"]:
+            for field in ANNOTATION_EXPORT_EXCLUDED_FIELDS:
+                annotation.pop(field, None)
+        assert json.loads(b"".join(chunks)) == json.loads(
+            orjson.dumps(expected, default=orJsonDefaults)
+        )
+
+    def testExportJsonEndpointSections(self, admin, server):
+        """Excluded sections are left out of the streamed object."""
+        dataset, _, _ = createDatasetWithData(admin)
+
+        def exportKeys(**params):
+            params["datasetId"] = str(dataset["_id"])
+            response = server.request(
+                path="/export/json",
+                method="GET",
+                user=admin,
+                params=params,
+                isJson=False,
+            )
+            assertStatusOk(response)
+            return list(json.loads(b"".join(response.body)))
+
+        assert exportKeys() == [
+            "annotations",
+            "annotationConnections",
+            "annotationProperties",
+            "annotationPropertyValues",
+        ]
+        assert exportKeys(
+            includeAnnotations="false", includeProperties="false"
+        ) == ["annotationConnections", "annotationPropertyValues"]
+        assert exportKeys(
+            includeAnnotations="false",
+            includeConnections="false",
+            includeProperties="false",
+            includePropertyValues="false",
+        ) == []
+
     def testExportJsonRejectsMalformedIds(self, admin, server):
         """The JSON export twin gets the same boundary validation."""
         dataset, _, _ = createDatasetWithData(admin)
@@ -356,12 +429,12 @@ class TestExport:
         assert result["annotationProperties"] == []
         assert result["annotationPropertyValues"] == {}
 
-    def testGetPropertyValues(self, admin):
+    def testIterPropertyValues(self, admin):
         """Test the property values helper method."""
         dataset, annotations, _ = createDatasetWithData(admin)
 
         export = Export()
-        result = export._getPropertyValues(dataset["_id"])
+        result = dict(export._iterPropertyValues(dataset["_id"]))
 
         # Should have property values for first annotation
         ann1_id = str(annotations[0]["_id"])
@@ -628,7 +701,7 @@ class TestCSVExport:
         dataset, annotations, _ = createDatasetWithData(admin)
 
         export = Export()
-        propertyValues = export._getPropertyValues(dataset["_id"])
+        propertyValues = dict(export._iterPropertyValues(dataset["_id"]))
 
         # Second annotation has no property values
         ann2Id = str(annotations[1]["_id"])
@@ -941,6 +1014,77 @@ class TestCSVExport:
         assert "/" not in header
         assert "(" not in header
 
+    def testExportCsvMergeJoinsValuesWithoutFullMap(
+        self, admin, monkeypatch
+    ):
+        """Values are joined to their annotation whether or not
+        neighbouring annotations have values, without building the
+        dataset-wide property-values map."""
+        dataset = utilities.createFolder(
+            admin, "join_dataset", upenn_utilities.datasetMetadata
+        )
+        prop = AnnotationProperty().save({
+            "name": "Area",
+            "image": "properties/test:latest",
+            "tags": {"exclusive": False, "tags": ["point"]},
+            "shape": "point",
+            "workerInterface": {}
+        })
+        propId = str(prop["_id"])
+        annotations = [
+            Annotation().create(
+                upenn_utilities.getSampleAnnotation(dataset["_id"])
+            )
+            for _ in range(6)
+        ]
+        valueModel = AnnotationPropertyValues()
+        for index in (1, 2, 5):
+            valueModel.appendValues(
+                {propId: {"Area": index * 10, "Other": "x"}},
+                annotations[index]["_id"],
+                dataset["_id"],
+            )
+        # Values of another dataset are never joined
+        otherDataset, otherAnnotations, _ = createDatasetWithData(admin)
+        valueModel.appendValues(
+            {propId: {"Area": 999}},
+            otherAnnotations[0]["_id"],
+            otherDataset["_id"],
+        )
+
+        export = Export()
+
+        def failFetch(datasetId):
+            raise AssertionError("full property-values map built")
+
+        monkeypatch.setattr(export, "_iterPropertyValues", failFetch)
+        monkeypatch.setattr(exportModule, "CSV_JOIN_CHUNK_SIZE", 2)
+
+        def areas(annotationIds=None):
+            lines = list(export._generateCsvLines(
+                dataset["_id"],
+                [[propId, "Area"]],
+                parsedAnnotationIds=annotationIds,
+            ))
+            return {
+                line.split(",")[0].strip('"'): line.strip().split(",")[-1]
+                for line in lines[1:]
+            }
+
+        expected = {
+            str(annotation["_id"]): (
+                str(index * 10) if index in (1, 2, 5) else ""
+            )
+            for index, annotation in enumerate(annotations)
+        }
+        assert areas() == expected
+
+        subset = [annotations[index]["_id"] for index in (0, 2, 3, 5)]
+        assert areas(subset) == {
+            str(annotationId): expected[str(annotationId)]
+            for annotationId in subset
+        }
+
     def testExportCsvSanitizedQuotesMultiTagValues(self, admin):
         """Tags with multiple values keep CSV quoting under sanitization.
 
@@ -1012,3 +1156,148 @@ class TestCSVExport:
         )
         assert colName == "cell fibroblast Blob Metrics / Area"
         assert ',' not in colName
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestTableExport:
+    def createProperty(self, dataset, annotations):
+        prop = AnnotationProperty().save({
+            "name": "Metrics",
+            "image": "properties/test:latest",
+            "tags": {"exclusive": False, "tags": ["polygon"]},
+            "shape": "polygon",
+            "workerInterface": {}
+        })
+        propId = str(prop["_id"])
+        AnnotationPropertyValues().appendValues(
+            {propId: {"Area": 150.5, "Label": "big"}},
+            annotations[0]["_id"],
+            dataset["_id"]
+        )
+        return propId
+
+    def postExport(self, server, user, exportFormat, body):
+        response = server.request(
+            path="/export/" + exportFormat,
+            method="POST",
+            user=user,
+            body=json.dumps(body),
+            type="application/json",
+            isJson=False,
+        )
+        assertStatusOk(response)
+        return b"".join(response.body)
+
+    def testExportParquetTypedColumns(self, admin, server):
+        dataset, annotations, _ = createDatasetWithData(admin)
+        propId = self.createProperty(dataset, annotations)
+
+        data = self.postExport(server, admin, "parquet", {
+            "datasetId": str(dataset["_id"]),
+            "propertyPaths": [[propId, "Area"], [propId, "Label"]],
+        })
+        table = pq.read_table(io.BytesIO(data))
+
+        assert table.schema.names == [
+            "Id", "Channel", "XY", "Z", "Time", "Tags", "Shape", "Name",
+            "Metrics / Area", "Metrics / Label",
+        ]
+        assert table.schema.field("XY").type == pa.int64()
+        assert table.schema.field("Tags").type == pa.list_(pa.string())
+        assert table.schema.field("Metrics / Area").type == pa.float64()
+        assert table.schema.field("Metrics / Label").type == pa.string()
+        rows = {row["Id"]: row for row in table.to_pylist()}
+        first = rows[str(annotations[0]["_id"])]
+        assert first["XY"] == annotations[0]["location"]["XY"] + 1
+        assert first["Tags"] == annotations[0]["tags"]
+        assert first["Metrics / Area"] == 150.5
+        assert first["Metrics / Label"] == "big"
+        second = rows[str(annotations[1]["_id"])]
+        assert second["Metrics / Area"] is None
+
+    def testExportArrowStreamsBatches(self, admin, server, monkeypatch):
+        dataset, annotations, _ = createDatasetWithData(admin)
+        for _ in range(3):
+            Annotation().create(
+                upenn_utilities.getSampleAnnotation(dataset["_id"])
+            )
+        monkeypatch.setattr(exportModule, "ARROW_BATCH_ROWS", 2)
+
+        data = self.postExport(server, admin, "arrow", {
+            "datasetId": str(dataset["_id"]),
+            "sanitizeColumnNames": True,
+        })
+        reader = pa.ipc.open_stream(data)
+        batches = list(reader)
+
+        assert [batch.num_rows for batch in batches] == [2, 2, 1]
+        assert reader.schema.names[0] == "Id"
+        ids = [aid for batch in batches for aid in batch.column("Id")]
+        assert len(ids) == 5
+
+    def testExportArrowTypesColumnsFromEveryBatch(
+        self, admin, server, monkeypatch
+    ):
+        dataset, annotations, _ = createDatasetWithData(admin)
+        propId = self.createProperty(dataset, annotations)
+        last = None
+        for _ in range(3):
+            last = Annotation().create(
+                upenn_utilities.getSampleAnnotation(dataset["_id"])
+            )
+        # Only the last batch holds a value that is not a number
+        AnnotationPropertyValues().appendValues(
+            {propId: {"Area": "n/a"}}, last["_id"], dataset["_id"]
+        )
+        monkeypatch.setattr(exportModule, "ARROW_BATCH_ROWS", 2)
+
+        data = self.postExport(server, admin, "arrow", {
+            "datasetId": str(dataset["_id"]),
+            "propertyPaths": [[propId, "Area"]],
+        })
+        table = pa.ipc.open_stream(data).read_all()
+
+        assert table.schema.field("Metrics / Area").type == pa.string()
+        rows = {row["Id"]: row for row in table.to_pylist()}
+        assert rows[str(annotations[0]["_id"])]["Metrics / Area"] == "150.5"
+        assert rows[str(last["_id"])]["Metrics / Area"] == "n/a"
+
+    def testExportTableSubsets(self, admin, server):
+        dataset, annotations, _ = createDatasetWithData(admin)
+        propId = self.createProperty(dataset, annotations)
+        body = {
+            "datasetId": str(dataset["_id"]),
+            "propertyPaths": [[propId, "Area"]],
+        }
+
+        data = self.postExport(server, admin, "parquet", dict(
+            body, annotationIds=[str(annotations[0]["_id"])]
+        ))
+        table = pq.read_table(io.BytesIO(data))
+        assert table.column("Id").to_pylist() == [
+            str(annotations[0]["_id"])
+        ]
+
+        data = self.postExport(
+            server, admin, "parquet", dict(body, annotationIds=[])
+        )
+        table = pq.read_table(io.BytesIO(data))
+        assert table.num_rows == 0
+        assert table.schema.field("Metrics / Area").type == pa.float64()
+
+    def testExportTableRejectsMalformedInput(self, admin, server):
+        dataset, _, _ = createDatasetWithData(admin)
+        for exportFormat in ("parquet", "arrow"):
+            response = server.request(
+                path="/export/" + exportFormat,
+                method="POST",
+                user=admin,
+                body=json.dumps({
+                    "datasetId": str(dataset["_id"]),
+                    "annotationIds": ["nope"],
+                }),
+                type="application/json",
+                isJson=False,
+            )
+            assertStatus(response, 400)
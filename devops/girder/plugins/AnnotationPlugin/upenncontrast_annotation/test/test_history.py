@@ -0,0 +1,523 @@
+import json
+
+import pytest
+
+from pytest_girder.assertions import assertStatus, assertStatusOk
+
+from upenncontrast_annotation.server.helpers.proxiedModel import ModelRecord
+from upenncontrast_annotation.server.models.annotation import Annotation
+from upenncontrast_annotation.server.models.documentChange import (
+    DocumentChange,
+)
+from upenncontrast_annotation.server.models.history import History
+from upenncontrast_annotation.server.models.propertyValues import (
+    AnnotationPropertyValues,
+)
+
+from . import girder_utilities as utilities
+from . import upenn_testing_utilities as upenn_utilities
+
+
+def undoOrRedo(server, user, datasetId, action="undo"):
+    resp = server.request(
+        path="/history/" + action,
+        method="PUT",
+        user=user,
+        params={"datasetId": str(datasetId)},
+    )
+    assertStatusOk(resp)
+
+
+def lastChanges(datasetId):
+    history = History().findOne(
+        {"datasetId": datasetId}, sort=[("actionDate", -1)]
+    )
+    return list(DocumentChange().find({"historyId": history["_id"]}))
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestCompactChanges:
+    def testCompactChange(self):
+        before = {"_id": 1, "tags": ["a"], "name": "x", "removed": 0}
+        after = {"_id": 1, "tags": ["b"], "name": "x", "added": 1}
+        assert DocumentChange.compactChange(before, after) == {
+            "op": "update",
+            "diff": {
+                "before": {"tags": ["a"], "removed": 0},
+                "after": {"tags": ["b"], "added": 1},
+            },
+        }
+        assert DocumentChange.compactChange(None, after) == {"op": "insert"}
+        assert DocumentChange.compactChange(before, None) == {
+            "op": "delete", "before": before,
+        }
+        assert DocumentChange.compactChange(before, dict(before)) is None
+        assert DocumentChange.compactChange(None, None) is None
+
+    def testUpdateStoresFieldDiff(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        resp = server.request(
+            path="/upenn_annotation/multiple",
+            method="PUT",
+            user=admin,
+            body=json.dumps([{
+                "id": str(annotation["_id"]),
+                "datasetId": str(folder["_id"]),
+                "tags": ["updated"],
+            }]),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+
+        [change] = lastChanges(folder["_id"])
+        assert change["op"] == "update"
+        assert "before" not in change and "after" not in change
+        assert "coordinates" not in change["diff"]["before"]
+        assert change["diff"]["before"]["tags"] == annotation["tags"]
+        assert change["diff"]["after"]["tags"] == ["updated"]
+
+        undoOrRedo(server, admin, folder["_id"], "undo")
+        stored = Annotation().load(annotation["_id"], force=True)
+        assert stored["tags"] == annotation["tags"]
+        assert stored["coordinates"] == annotation["coordinates"]
+
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        stored = Annotation().load(annotation["_id"], force=True)
+        assert stored["tags"] == ["updated"]
+
+    def testInsertStoresOnlyId(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        resp = server.request(
+            path="/upenn_annotation",
+            method="POST",
+            user=admin,
+            body=json.dumps(
+                upenn_utilities.getSampleAnnotation(str(folder["_id"]))
+            ),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        created = Annotation().load(resp.json["_id"], force=True)
+
+        [change] = lastChanges(folder["_id"])
+        assert change["op"] == "insert"
+        assert change["documentId"] == created["_id"]
+        assert "before" not in change and "after" not in change
+
+        undoOrRedo(server, admin, folder["_id"], "undo")
+        assert Annotation().load(created["_id"], force=True) is None
+
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        restored = Annotation().load(created["_id"], force=True)
+        assert restored["coordinates"] == created["coordinates"]
+        assert restored["tags"] == created["tags"]
+
+    def testDeleteRestoresDocument(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        resp = server.request(
+            path="/upenn_annotation/%s" % annotation["_id"],
+            method="DELETE",
+            user=admin,
+        )
+        assertStatusOk(resp)
+        [change] = lastChanges(folder["_id"])
+        assert change["op"] == "delete"
+        assert change["before"]["_id"] == annotation["_id"]
+
+        undoOrRedo(server, admin, folder["_id"], "undo")
+        restored = Annotation().load(annotation["_id"], force=True)
+        assert restored["coordinates"] == annotation["coordinates"]
+
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        assert Annotation().load(annotation["_id"], force=True) is None
+
+    def testFullCopyRecordsAreStillApplied(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        updated = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        inserted = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        before = dict(updated, tags=["old"])
+        # A history entry in the format written before compact changes
+        history = History().create(admin, {
+            "actionName": "Legacy action",
+            "actionDate": History.now(),
+            "userId": admin["_id"],
+            "isUndone": False,
+            "datasetId": folder["_id"],
+        }, {})
+        DocumentChange().collection.insert_many([
+            {
+                "historyId": history["_id"],
+                "modelName": "upenn_annotation",
+                "documentId": updated["_id"],
+                "before": before,
+                "after": updated,
+            },
+            {
+                "historyId": history["_id"],
+                "modelName": "upenn_annotation",
+                "documentId": inserted["_id"],
+                "before": None,
+                "after": inserted,
+            },
+        ])
+
+        undoOrRedo(server, admin, folder["_id"], "undo")
+        assert Annotation().load(updated["_id"], force=True)["tags"] == [
+            "old"
+        ]
+        assert Annotation().load(inserted["_id"], force=True) is None
+
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        assert Annotation().load(updated["_id"], force=True)["tags"] == (
+            updated["tags"]
+        )
+        assert Annotation().load(inserted["_id"], force=True) is not None
+
+    def testRecordedUpdateFollowsDocumentsLeavingTheQuery(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        model = Annotation()
+        model.startRecording()
+        try:
+            model.update(
+                {"_id": annotation["_id"], "name": annotation["name"]},
+                {"$set": {"name": "renamed"}},
+            )
+        finally:
+            record = model.stopRecording()
+        change = record.changes[annotation["_id"]]
+        assert change["before"]["name"] == annotation["name"]
+        assert change["after"]["name"] == "renamed"
+
+    def testRecordedUpsertOnlyHoldsTheUpdatedPaths(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        pv = AnnotationPropertyValues()
+        pv.appendValues({"p": 1, "q": 2}, annotation["_id"], folder["_id"])
+        pv.startRecording()
+        try:
+            pv.mergeMultipleValues([{
+                "annotationId": annotation["_id"],
+                "datasetId": folder["_id"],
+                "values": {"p": 5},
+            }])
+        finally:
+            record = pv.stopRecording()
+        [change] = record.changes.values()
+        assert change["before"]["values"] == {"p": 1}
+        assert change["after"]["values"] == {"p": 5}
+        History().create(admin, {
+            "actionName": "Merge",
+            "actionDate": History.now(),
+            "userId": admin["_id"],
+            "isUndone": False,
+            "datasetId": folder["_id"],
+        }, {pv.name: record.changes})
+        [stored] = lastChanges(folder["_id"])
+        assert stored["diff"] == {
+            "before": {"values": {"p": 1}},
+            "after": {"values": {"p": 5}},
+            "paths": ["values.p"],
+        }
+
+        # Another property written meanwhile is left alone
+        pv.collection.update_one(
+            {"annotationId": annotation["_id"]}, {"$set": {"values.r": 3}}
+        )
+        undoOrRedo(server, admin, folder["_id"], "undo")
+        values = pv.findOne({"annotationId": annotation["_id"]})["values"]
+        assert values == {"p": 1, "q": 2, "r": 3}
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        values = pv.findOne({"annotationId": annotation["_id"]})["values"]
+        assert values == {"p": 5, "q": 2, "r": 3}
+
+    def testPartialRecordsAreMerged(self):
+        record = ModelRecord()
+        record.changeDocument(
+            {"_id": 1, "values": {"p": 1}},
+            {"_id": 1, "values": {"p": 2}},
+            ["values.p"],
+        )
+        record.changeDocument(
+            {"_id": 1, "values": {"p": 2}},
+            {"_id": 1, "values": {"p": 3, "q": 4}},
+            ["values.p", "values.q"],
+        )
+        assert record.changes[1] == {
+            "before": {"_id": 1, "values": {"p": 1}},
+            "after": {"_id": 1, "values": {"p": 3, "q": 4}},
+            "paths": ["values.p", "values.q"],
+        }
+        # A full copy completes the partial one
+        full = {"_id": 1, "name": "x", "values": {"p": 3, "q": 4, "r": 5}}
+        record.changeDocument(full, None)
+        record.changeDocument(None, dict(full, name="y"))
+        assert record.changes[1] == {
+            "before": {"_id": 1, "name": "x", "values": {"p": 1, "r": 5}},
+            "after": dict(full, name="y"),
+        }
+
+    def testPropertyDeletionIsUndone(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotations = Annotation().createMultiple([
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+            for _ in range(3)
+        ])
+        pv = AnnotationPropertyValues()
+        pv.appendMultipleValues([
+            {"annotationId": annotations[0]["_id"],
+             "datasetId": folder["_id"], "values": {"p": 1}},
+            {"annotationId": annotations[1]["_id"],
+             "datasetId": folder["_id"], "values": {"p": 2, "q": 3}},
+            {"annotationId": annotations[2]["_id"],
+             "datasetId": folder["_id"], "values": {"q": 4}},
+        ])
+
+        def valuesByAnnotation():
+            return {
+                doc["annotationId"]: doc["values"]
+                for doc in pv.find({"datasetId": folder["_id"]})
+            }
+
+        before = valuesByAnnotation()
+        resp = server.request(
+            path="/annotation_property_values",
+            method="DELETE",
+            user=admin,
+            params={"propertyId": "p", "datasetId": str(folder["_id"])},
+        )
+        assertStatusOk(resp)
+        assert valuesByAnnotation() == {
+            annotations[1]["_id"]: {"q": 3},
+            annotations[2]["_id"]: {"q": 4},
+        }
+
+        undoOrRedo(server, admin, folder["_id"], "undo")
+        assert valuesByAnnotation() == before
+
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        assert valuesByAnnotation() == {
+            annotations[1]["_id"]: {"q": 3},
+            annotations[2]["_id"]: {"q": 4},
+        }
+
+    def testRecordedPropertyDeletionOnlyHoldsTheProperty(
+        self, admin, monkeypatch
+    ):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotations = Annotation().createMultiple([
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+            for _ in range(3)
+        ])
+        pv = AnnotationPropertyValues()
+        pv.appendMultipleValues([
+            {"annotationId": annotation["_id"],
+             "datasetId": folder["_id"], "values": {"p": index, "q": 0}}
+            for index, annotation in enumerate(annotations)
+        ])
+        # Read the updated documents back one query per document
+        monkeypatch.setattr(pv, "recordBatchSize", 1)
+        pv.startRecording()
+        try:
+            pv.delete("p", folder["_id"])
+        finally:
+            record = pv.stopRecording()
+
+        assert len(record.changes) == 3
+        for change in record.changes.values():
+            assert change["paths"] == ["values.p"]
+            assert set(change["before"]["values"]) == {"p"}
+            assert change["after"]["values"] == {}
+
+
+class RecordingProgress:
+    on = True
+
+    def __init__(self):
+        self.updates = []
+
+    def update(self, force=False, **kwargs):
+        self.updates.append(kwargs)
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestBulkUndo:
+    def testUndoBulkDeleteInBatchesWithProgress(
+        self, admin, server, monkeypatch
+    ):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotations = Annotation().createMultiple([
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+            for _ in range(7)
+        ])
+        resp = server.request(
+            path="/upenn_annotation/multiple",
+            method="DELETE",
+            user=admin,
+            body=json.dumps([str(ann["_id"]) for ann in annotations]),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        assert list(Annotation().find({"datasetId": folder["_id"]})) == []
+
+        monkeypatch.setattr(History(), "undoBatchSize", 3)
+        writes = []
+        collection = Annotation().collection
+        bulkWrite = collection.bulk_write
+        monkeypatch.setattr(
+            collection, "bulk_write",
+            lambda operations, **kwargs: writes.append(len(operations))
+            or bulkWrite(operations, **kwargs),
+        )
+        progress = RecordingProgress()
+        History().undo(admin, folder["_id"], progress)
+
+        restored = Annotation().find({"datasetId": folder["_id"]})
+        assert {ann["_id"] for ann in restored} == {
+            ann["_id"] for ann in annotations
+        }
+        assert writes == [3, 3, 1]
+        assert progress.updates[0]["total"] == 7
+        assert progress.updates[0]["current"] == 0
+        assert "Undoing" in progress.updates[0]["message"]
+        assert [update["current"] for update in progress.updates[1:]] == [
+            3, 6, 7,
+        ]
+
+    def testUndoWithProgressParam(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        resp = server.request(
+            path="/upenn_annotation",
+            method="POST",
+            user=admin,
+            body=json.dumps(
+                upenn_utilities.getSampleAnnotation(str(folder["_id"]))
+            ),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        resp = server.request(
+            path="/history/undo",
+            method="PUT",
+            user=admin,
+            params={"datasetId": str(folder["_id"]), "progress": "true"},
+        )
+        assertStatusOk(resp)
+        assert list(Annotation().find({"datasetId": folder["_id"]})) == []
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestHistoryGroups:
+    def _createMultiple(self, server, admin, folder, count, params):
+        resp = server.request(
+            path="/upenn_annotation/multiple",
+            method="POST",
+            user=admin,
+            params=params,
+            body=json.dumps([
+                upenn_utilities.getSampleAnnotation(str(folder["_id"]))
+                for _ in range(count)
+            ]),
+            type="application/json",
+        )
+        return resp
+
+    def testGroupedRequestsAreUndoneTogether(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        self._createMultiple(server, admin, folder, 1, {})
+        for _ in range(3):
+            assertStatusOk(self._createMultiple(
+                server, admin, folder, 2, {"historyGroup": "upload-1"}
+            ))
+        assert History().collection.count_documents(
+            {"datasetId": folder["_id"]}
+        ) == 2
+        assert Annotation().collection.count_documents(
+            {"datasetId": folder["_id"]}
+        ) == 7
+
+        undoOrRedo(server, admin, folder["_id"])
+        assert Annotation().collection.count_documents(
+            {"datasetId": folder["_id"]}
+        ) == 1
+        undoOrRedo(server, admin, folder["_id"], "redo")
+        assert Annotation().collection.count_documents(
+            {"datasetId": folder["_id"]}
+        ) == 7
+
+    def testConcurrentFirstRequestsShareTheEntry(self, admin, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        entry = {
+            "actionName": "Create multiple annotations",
+            "actionDate": History.now(),
+            "userId": admin["_id"],
+            "isUndone": False,
+            "datasetId": folder["_id"],
+        }
+        first = History().createInGroup(admin, dict(entry), {}, "g")
+        # The entry is created by another request after this one looked
+        findOne = History.findOne
+        lookups = []
+
+        def lateFindOne(self, *args, **kwargs):
+            lookups.append(args)
+            return None if len(lookups) == 1 else findOne(
+                self, *args, **kwargs
+            )
+
+        monkeypatch.setattr(History, "findOne", lateFindOne)
+        second = History().createInGroup(admin, dict(entry), {}, "g")
+        assert second["_id"] == first["_id"]
+        assert History().collection.count_documents(
+            {"datasetId": folder["_id"]}
+        ) == 1
+
+    def testInvalidGroupIsRejected(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        resp = self._createMultiple(
+            server, admin, folder, 1, {"historyGroup": "x" * 65}
+        )
+        assertStatus(resp, 400)
@@ -1,15 +1,28 @@
+import datetime
 import json
 
 import pytest
 
+from pymongo.errors import OperationFailure
+
 from pytest_girder.assertions import assertStatusOk
 
+from upenncontrast_annotation.server.models.annotation import Annotation
 from upenncontrast_annotation.server.models.property import (
     AnnotationProperty,
 )
+from upenncontrast_annotation.server.models.propertyValueIndex import (
+    PropertyValueIndex,
+)
+from upenncontrast_annotation.server.models.propertyValues import (
+    AnnotationPropertyValues,
+)
 
 from girder.constants import AccessType
 
+from . import girder_utilities as utilities
+from . import upenn_testing_utilities as upenn_utilities
+
 
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
 @pytest.mark.plugin("upenncontrast_annotation")
@@ -59,3 +72,126 @@ class TestPropertyEndpoints:
         assert "_malicious" not in loaded
         assert "accessLevel" not in loaded
         assert "unknownField" not in loaded
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestPropertyValueIndex:
+    """Partial indexes of the property value paths."""
+
+    @pytest.fixture(autouse=True)
+    def _forgetIndexedPaths(self, db):
+        PropertyValueIndex().indexed.clear()
+        PropertyValueIndex().touched.clear()
+
+    def _indexedPaths(self):
+        return {
+            name[len("propertyValue_"):]
+            for name in AnnotationPropertyValues().collection
+            .index_information()
+            if name.startswith("propertyValue_")
+        }
+
+    def _submit(self, admin, values, name="ds"):
+        folder = utilities.createFolder(
+            admin, name, upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        AnnotationPropertyValues().appendMultipleValues([{
+            "annotationId": annotation["_id"], "datasetId": folder["_id"],
+            "values": values,
+        }])
+        return folder
+
+    def testComputedValuesAreIndexed(self, admin):
+        self._submit(admin, {"p": {"Area": 1, "Ch": {"Mean": 2}}, "q": 3})
+        assert self._indexedPaths() == {
+            "values.p.Area", "values.p.Ch.Mean", "values.q",
+        }
+        index = AnnotationPropertyValues().collection.index_information()[
+            "propertyValue_values.p.Area"
+        ]
+        assert index["key"] == [("datasetId", 1), ("values.p.Area", 1)]
+        assert index["partialFilterExpression"] == {
+            "values.p.Area": {"$exists": True},
+        }
+
+    def testLeastRecentlyUsedIndexesAreEvicted(self, admin, monkeypatch):
+        monkeypatch.setattr(PropertyValueIndex, "maxIndexes", 2)
+        folder = self._submit(admin, {"a": 1}, "ds1")
+        self._submit(admin, {"b": 1}, "ds2")
+        PropertyValueIndex().collection.update_many(
+            {}, {"$set": {"lastUsed": datetime.datetime(2000, 1, 1)}}
+        )
+        # Sorting by "a" makes "b" the least recently used
+        list(Annotation().listPage(
+            folder["_id"], {}, {"type": "property", "key": ["a"]},
+            None, 0, 10,
+        ))
+        self._submit(admin, {"c": 1}, "ds3")
+        assert self._indexedPaths() == {"values.a", "values.c"}
+
+    def testIndexLimitIsNeverExceeded(self, admin, monkeypatch):
+        collection = AnnotationPropertyValues().collection
+        fixed = len(collection.index_information())
+        createIndex = collection.create_index
+        existing = []
+
+        def countingCreateIndex(*args, **kwargs):
+            existing.append(len(collection.index_information()))
+            return createIndex(*args, **kwargs)
+
+        monkeypatch.setattr(collection, "create_index", countingCreateIndex)
+        monkeypatch.setattr(
+            PropertyValueIndex, "valuesCollection", collection
+        )
+        count = 64 - fixed + 5
+        values = {"p%d" % i: i for i in range(count)}
+        folder = self._submit(admin, values)
+        stored = AnnotationPropertyValues().findOne(
+            {"datasetId": folder["_id"]}
+        )
+        assert stored["values"] == values
+        assert len(self._indexedPaths()) == PropertyValueIndex.maxIndexes
+        # MongoDB refuses a 65th index
+        assert len(existing) == count
+        assert max(existing) < 64
+        assert PropertyValueIndex().collection.count_documents({}) == (
+            PropertyValueIndex.maxIndexes
+        )
+
+    def testFailedBuildDoesNotFailTheWrite(self, admin, monkeypatch):
+        collection = AnnotationPropertyValues().collection
+
+        def createIndex(*args, **kwargs):
+            raise OperationFailure("too many indexes")
+
+        monkeypatch.setattr(collection, "create_index", createIndex)
+        monkeypatch.setattr(
+            PropertyValueIndex, "valuesCollection", collection
+        )
+        folder = self._submit(admin, {"a": 1})
+        assert AnnotationPropertyValues().findOne(
+            {"datasetId": folder["_id"]}
+        )["values"] == {"a": 1}
+        # Not recorded, so the next submission tries again
+        assert PropertyValueIndex().collection.count_documents({}) == 0
+        assert PropertyValueIndex().indexed == set()
+
+    def testIndexesAreBuiltInTheBackground(self, admin, monkeypatch):
+        monkeypatch.setattr(PropertyValueIndex, "buildInBackground", True)
+        PropertyValueIndex().ensure({"values.a"}).result()
+        assert self._indexedPaths() == {"values.a"}
+        assert PropertyValueIndex().ensure({"values.a"}) is None
+
+    def testDeletedPropertyIndexesAreDropped(self, admin):
+        prop = TestPropertyEndpoints()._createProperty(admin)
+        propertyId = str(prop["_id"])
+        self._submit(admin, {propertyId: {"Area": 1}, "other": 2})
+        assert self._indexedPaths() == {
+            "values." + propertyId + ".Area", "values.other",
+        }
+        AnnotationProperty().delete(prop)
+        assert self._indexedPaths() == {"values.other"}
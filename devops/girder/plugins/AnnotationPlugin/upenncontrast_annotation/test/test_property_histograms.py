@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from pytest_girder.assertions import assertStatus, assertStatusOk
+
+from upenncontrast_annotation.server.models.annotation import Annotation
+from upenncontrast_annotation.server.models.propertyValues import (
+    AnnotationPropertyValues,
+)
+
+from . import girder_utilities as utilities
+from . import upenn_testing_utilities as upenn_utilities
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestPropertyHistograms:
+    """Property histograms are stored until the next write to the dataset.
+
+    mongomock has no $bucketAuto, so the computation itself is replaced by
+    one recording the paths it is asked for.
+    """
+
+    @pytest.fixture
+    def computed(self, monkeypatch):
+        computed = []
+
+        def computeHistograms(self, propertyPaths, datasetId, buckets):
+            computed.append(list(propertyPaths))
+            return {
+                path: [{"min": 0, "max": buckets, "count": len(path)}]
+                for path in propertyPaths
+            }
+
+        monkeypatch.setattr(
+            AnnotationPropertyValues, "_computeHistograms", computeHistograms
+        )
+        return computed
+
+    def _dataset(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        AnnotationPropertyValues().appendValues(
+            {"p": {"Area": 1}, "q": 2}, annotation["_id"], folder["_id"]
+        )
+        return folder, annotation
+
+    def testHistogramIsStoredUntilTheNextWrite(self, admin, computed):
+        folder, annotation = self._dataset(admin)
+        pv = AnnotationPropertyValues()
+        first = pv.histogram("p.Area", folder["_id"])
+        assert pv.histogram("p.Area", folder["_id"]) == first
+        assert computed == [["p.Area"]]
+        # Another bucket count is another histogram
+        pv.histogram("p.Area", folder["_id"], 10)
+        assert computed == [["p.Area"], ["p.Area"]]
+
+        pv.appendValues({"q": 3}, annotation["_id"], folder["_id"])
+        pv.histogram("p.Area", folder["_id"])
+        assert computed == [["p.Area"], ["p.Area"], ["p.Area"]]
+
+    def testOnlyStaleHistogramsAreComputedTogether(self, admin, computed):
+        folder, _ = self._dataset(admin)
+        pv = AnnotationPropertyValues()
+        pv.histogram("q", folder["_id"])
+        histograms = pv.histograms(["p.Area", "q"], folder["_id"])
+        assert set(histograms) == {"p.Area", "q"}
+        assert computed == [["q"], ["p.Area"]]
+
+    def testHistogramsEndpoint(self, admin, server, computed):
+        folder, _ = self._dataset(admin)
+        resp = server.request(
+            path="/annotation_property_values/histograms",
+            method="POST",
+            user=admin,
+            body=json.dumps({
+                "datasetId": str(folder["_id"]),
+                "propertyPaths": [["p", "Area"], ["q"], ["q"]],
+                "buckets": 4,
+            }),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        assert resp.json == {
+            "p.Area": [{"min": 0, "max": 4, "count": 6}],
+            "q": [{"min": 0, "max": 4, "count": 1}],
+        }
+        assert computed == [["p.Area", "q"]]
+
+    def testHistogramsEndpointRejectsInvalidPaths(self, admin, server):
+        folder, _ = self._dataset(admin)
+        resp = server.request(
+            path="/annotation_property_values/histograms",
+            method="POST",
+            user=admin,
+            body=json.dumps({
+                "datasetId": str(folder["_id"]),
+                "propertyPaths": [["p.Area"]],
+            }),
+            type="application/json",
+        )
+        assertStatus(resp, 400)
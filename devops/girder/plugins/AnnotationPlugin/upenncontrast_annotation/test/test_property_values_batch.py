@@ -310,3 +310,131 @@ class TestFindByAnnotationIds:
         assert len(docs) == 1
         assert "_id" not in docs[0]
         assert "datasetId" not in docs[0]
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestMergeMultipleValues:
+    """POST /annotation_property_values/multiple merges each submitted
+    property into the annotation's value doc with an upsert."""
+
+    def _post(self, server, user, body):
+        return server.request(
+            path="/annotation_property_values/multiple",
+            method="POST",
+            user=user,
+            body=json.dumps(body),
+            type="application/json",
+        )
+
+    def _entries(self, folder, annotations, values):
+        return [
+            {"datasetId": str(folder["_id"]),
+             "annotationId": str(annotation["_id"]),
+             "values": values}
+            for annotation in annotations
+        ]
+
+    def testMergesPropertiesIntoOneDoc(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotations = Annotation().createMultiple([
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+            for _ in range(2)
+        ])
+        pv = AnnotationPropertyValues()
+        assertStatusOk(self._post(server, admin, self._entries(
+            folder, annotations, {"propA": {"Area": 1}}
+        )))
+        assertStatusOk(self._post(server, admin, self._entries(
+            folder, annotations[:1], {"propB": 2, "propA": {"Area": 3}}
+        )))
+
+        docs = {
+            doc["annotationId"]: doc
+            for doc in pv.find({"datasetId": folder["_id"]})
+        }
+        assert len(docs) == 2
+        assert docs[annotations[0]["_id"]]["values"] == {
+            "propA": {"Area": 3}, "propB": 2,
+        }
+        assert docs[annotations[1]["_id"]]["values"] == {
+            "propA": {"Area": 1},
+        }
+
+    def testOnlyWritesSubmittedProperties(self, admin, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        pv = AnnotationPropertyValues()
+        pv.appendValues({"propA": 1}, annotation["_id"], folder["_id"])
+
+        writes = []
+        bulkWrite = pv.collection.bulk_write
+        monkeypatch.setattr(
+            pv.collection, "bulk_write",
+            lambda operations, **kwargs: (
+                writes.extend(operations), bulkWrite(operations, **kwargs)
+            )[1],
+        )
+        pv.appendMultipleValues([{
+            "annotationId": annotation["_id"], "datasetId": folder["_id"],
+            "values": {"propB": 2},
+        }])
+        [operation] = writes
+        assert operation._doc == {"$set": {
+            "datasetId": folder["_id"], "values.propB": 2,
+        }}
+        assert pv.findOne({"annotationId": annotation["_id"]})["values"] == {
+            "propA": 1, "propB": 2,
+        }
+
+    def testRejectsDottedPropertyIds(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        resp = self._post(server, admin, self._entries(
+            folder, [annotation], {"prop.A": 1}
+        ))
+        assertStatus(resp, 400)
+
+    def testRecordedMergeIsUndone(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotations = Annotation().createMultiple([
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+            for _ in range(2)
+        ])
+        pv = AnnotationPropertyValues()
+        pv.appendValues({"propA": 1}, annotations[0]["_id"], folder["_id"])
+        pv.startRecording()
+        try:
+            pv.appendMultipleValues([
+                {"annotationId": annotation["_id"],
+                 "datasetId": folder["_id"], "values": {"propB": 2}}
+                for annotation in annotations
+            ])
+        finally:
+            record = pv.stopRecording()
+        changes = {
+            change["after"]["annotationId"]: change
+            for change in record.changes.values()
+        }
+        # Only the merged property is recorded
+        before = changes[annotations[0]["_id"]]["before"]
+        assert before.get("values", {}) == {}
+        assert changes[annotations[0]["_id"]]["after"]["values"] == {
+            "propB": 2,
+        }
+        assert changes[annotations[1]["_id"]]["before"] is None
+        assert changes[annotations[1]["_id"]]["after"]["values"] == {
+            "propB": 2,
+        }
@@ -528,6 +528,36 @@ class TestServerListProperties:
         })
         assert parseStreaming(resp2)["total"] == 4
 
+    @pytest.mark.parametrize("sort", [
+        None,
+        {"type": "field", "key": "name", "order": "desc"},
+    ])
+    def testApplicationJoinMatchesLookup(self, admin, monkeypatch, sort):
+        folder, anns, noval = self._setup(admin)
+        pv = AnnotationPropertyValues()
+        pv.appendValues(
+            {"q": {"Mean": 1, "Max": None}}, anns[0]["_id"], folder["_id"]
+        )
+        pv.appendValues({"q": 2}, anns[1]["_id"], folder["_id"])
+        propertyPaths = [["p", "Area"], ["q", "Mean"], ["q", "Max"], ["r"]]
+
+        def page(minRows):
+            monkeypatch.setattr(Annotation, "APP_JOIN_MIN_ROWS", minRows)
+            return list(Annotation().listPage(
+                folder["_id"], {}, sort, propertyPaths, 0, 10,
+            ))
+
+        lookupRows = page(11)
+        applicationRows = page(10)
+        assert applicationRows == lookupRows
+        valuesById = {row["_id"]: row["values"] for row in applicationRows}
+        assert valuesById == {
+            anns[0]["_id"]: {"p": {"Area": 30}, "q": {"Mean": 1}},
+            anns[1]["_id"]: {"p": {"Area": 10}, "q": {}},
+            anns[2]["_id"]: {"p": {"Area": 20}, "q": {}},
+            noval["_id"]: {"p": {}, "q": {}},
+        }
+
 
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
 @pytest.mark.plugin("upenncontrast_annotation")
@@ -697,6 +727,274 @@ class TestServerListRefactorCharacterization:
         ]
 
 
+def assertCursorPagesMatchOffsetPages(server, admin, datasetId, sort,
+                                      limit, filters=None):
+    """Walking the list with nextCursor must return the same rows, in the
+    same order, as one offset page holding all of them."""
+    base = {
+        "datasetId": str(datasetId),
+        "filters": filters or {},
+        "sort": sort,
+        "propertyPaths": [["p", "Area"]],
+    }
+    resp = postList(server, admin, "/upenn_annotation/list", {
+        **base, "offset": 0, "limit": 1000,
+    })
+    assertStatusOk(resp)
+    expected = [str(r["_id"]) for r in parseStreaming(resp)["rows"]]
+
+    walked = []
+    body = {**base, "offset": 0, "limit": limit}
+    while True:
+        resp = postList(server, admin, "/upenn_annotation/list", body)
+        assertStatusOk(resp)
+        page = parseStreaming(resp)
+        assert page["total"] == len(expected)
+        walked += [str(r["_id"]) for r in page["rows"]]
+        if page["nextCursor"] is None:
+            break
+        assert len(walked) <= len(expected)
+        body = {**base, "cursor": page["nextCursor"], "limit": limit}
+    assert walked == expected
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestServerListCursor:
+    def _setup(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        pv = AnnotationPropertyValues()
+        # Equal sort values, missing values, a value doc without the sort
+        # key, and missing names, across two tags
+        for i, (value, name) in enumerate([
+            (30, "b"), (10, None), (20, "a"), (20, "b"), (None, "a"),
+            (10, None), ("other", "c"), (None, None), (5, "a"),
+        ]):
+            annotation = makeAnnotation(
+                folder["_id"], tags=["A" if i % 2 else "B"],
+                location={"XY": i % 3, "Z": 0, "Time": 0},
+            )
+            if name is not None:
+                Annotation().collection.update_one(
+                    {"_id": annotation["_id"]}, {"$set": {"name": name}}
+                )
+            if value == "other":
+                pv.appendValues(
+                    {"q": 1}, annotation["_id"], folder["_id"]
+                )
+            elif value is not None:
+                pv.appendValues(
+                    {"p": {"Area": value}}, annotation["_id"], folder["_id"]
+                )
+        return folder
+
+    @pytest.mark.parametrize("order", ["asc", "desc"])
+    @pytest.mark.parametrize("sort", [
+        None,
+        {"type": "field", "key": "_id"},
+        {"type": "field", "key": "location.XY"},
+        {"type": "field", "key": "name"},
+        {"type": "property", "key": ["p", "Area"]},
+    ])
+    def testCursorPagesMatchOffsetPages(self, admin, server, sort, order):
+        folder = self._setup(admin)
+        sort = dict(sort, order=order) if sort else None
+        for filters in (
+            {},
+            {"tags": {"values": ["A"], "exclusive": False}},
+            {"propertyFilters": [
+                {"path": ["p", "Area"], "mode": "range", "min": 10},
+            ]},
+            {
+                "tags": {"values": ["A"], "exclusive": False},
+                "propertyFilters": [
+                    {"path": ["p", "Area"], "mode": "range", "min": 10},
+                ],
+            },
+        ):
+            for limit in (1, 2, 4):
+                assertCursorPagesMatchOffsetPages(
+                    server, admin, folder["_id"], sort, limit, filters
+                )
+
+    def testCursorPageDoesNotSkip(self, admin, server, monkeypatch):
+        folder = self._setup(admin)
+        pipelines = []
+        aggregate = Annotation()._aggregate
+        monkeypatch.setattr(
+            Annotation(), "_aggregate",
+            lambda collection, pipeline, **kwargs: pipelines.append(pipeline)
+            or aggregate(collection, pipeline, **kwargs),
+        )
+        body = {
+            "datasetId": str(folder["_id"]), "filters": {},
+            "sort": {"type": "property", "key": ["p", "Area"],
+                     "order": "asc"},
+            "propertyPaths": [], "offset": 0, "limit": 2,
+        }
+        page = parseStreaming(
+            postList(server, admin, "/upenn_annotation/list", body)
+        )
+        pipelines.clear()
+        resp = postList(server, admin, "/upenn_annotation/list", {
+            **body, "cursor": page["nextCursor"],
+        })
+        assertStatusOk(resp)
+        parseStreaming(resp)
+        assert pipelines
+        assert all(
+            stage.get("$skip", 0) == 0
+            for pipeline in pipelines for stage in pipeline
+        )
+
+    def testLastPageHasNoCursor(self, admin, server):
+        folder = self._setup(admin)
+        resp = postList(server, admin, "/upenn_annotation/list", {
+            "datasetId": str(folder["_id"]), "filters": {}, "sort": None,
+            "propertyPaths": [], "offset": 0, "limit": 100,
+        })
+        assert parseStreaming(resp)["nextCursor"] is None
+
+    def testInvalidCursorReturns400(self, admin, server):
+        folder = self._setup(admin)
+        body = {
+            "datasetId": str(folder["_id"]), "filters": {},
+            "sort": {"type": "field", "key": "name", "order": "asc"},
+            "propertyPaths": [], "offset": 0, "limit": 2,
+        }
+        page = parseStreaming(
+            postList(server, admin, "/upenn_annotation/list", body)
+        )
+        for cursor in ("not a cursor", 12):
+            resp = postList(server, admin, "/upenn_annotation/list", {
+                **body, "cursor": cursor,
+            })
+            assertStatus(resp, 400)
+        # A cursor only resumes the sort it was made for
+        resp = postList(server, admin, "/upenn_annotation/list", {
+            **body, "sort": None, "cursor": page["nextCursor"],
+        })
+        assertStatus(resp, 400)
+        resp = postList(server, admin, "/upenn_annotation/list", {
+            **body, "cursor": page["nextCursor"],
+            "anchorId": str(ObjectId()),
+        })
+        assertStatus(resp, 400)
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestServerListCountCache:
+    def _countTotals(self, server, admin, folder, monkeypatch, filters):
+        computed = []
+        compute = Annotation()._computeListCount
+        monkeypatch.setattr(
+            Annotation(), "_computeListCount",
+            lambda *args: computed.append(args) or compute(*args),
+        )
+
+        def total():
+            resp = postList(server, admin, "/upenn_annotation/list", {
+                "datasetId": str(folder["_id"]), "filters": filters,
+                "sort": None, "propertyPaths": [], "offset": 0, "limit": 1,
+            })
+            assertStatusOk(resp)
+            return parseStreaming(resp)["total"]
+        return total, computed
+
+    def testTotalIsCountedOnceUntilAWrite(self, admin, server, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        first = makeAnnotation(folder["_id"], tags=["A"])
+        makeAnnotation(folder["_id"], tags=["B"])
+        total, computed = self._countTotals(
+            server, admin, folder, monkeypatch,
+            {"tags": {"values": ["A"], "exclusive": False}},
+        )
+
+        assert total() == 1
+        assert total() == 1
+        assert len(computed) == 1
+
+        makeAnnotation(folder["_id"], tags=["A"])
+        assert total() == 2
+        Annotation().delete(first)
+        assert total() == 1
+        assert len(computed) == 3
+
+    def testPropertyValueWritesInvalidateTotals(
+        self, admin, server, monkeypatch
+    ):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotations = [makeAnnotation(folder["_id"]) for _ in range(3)]
+        pv = AnnotationPropertyValues()
+        pv.appendValues({"p": {"Area": 5}}, annotations[0]["_id"],
+                        folder["_id"])
+        total, computed = self._countTotals(
+            server, admin, folder, monkeypatch,
+            {"propertyFilters": [
+                {"path": ["p", "Area"], "mode": "range", "min": 1},
+            ]},
+        )
+
+        assert total() == 1
+        pv.appendMultipleValues([
+            {"annotationId": annotation["_id"], "datasetId": folder["_id"],
+             "values": {"p": {"Area": 7}}}
+            for annotation in annotations[1:]
+        ])
+        assert total() == 3
+        pv.delete("p", folder["_id"])
+        assert total() == 0
+        assert total() == 0
+        assert len(computed) == 3
+
+    def testUndoInvalidatesTotals(self, admin, server, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        total, computed = self._countTotals(
+            server, admin, folder, monkeypatch, {}
+        )
+        resp = server.request(
+            path="/upenn_annotation", method="POST", user=admin,
+            body=json.dumps(
+                upenn_utilities.getSampleAnnotation(str(folder["_id"]))
+            ),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        assert total() == 1
+
+        resp = server.request(
+            path="/history/undo", method="PUT", user=admin,
+            params={"datasetId": str(folder["_id"])},
+        )
+        assertStatusOk(resp)
+        assert total() == 0
+
+    def testOtherDatasetWritesKeepTotals(self, admin, server, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        other = utilities.createFolder(
+            admin, "other", upenn_utilities.datasetMetadata
+        )
+        makeAnnotation(folder["_id"])
+        total, computed = self._countTotals(
+            server, admin, folder, monkeypatch, {}
+        )
+        assert total() == 1
+        makeAnnotation(other["_id"])
+        assert total() == 1
+        assert len(computed) == 1
+
+
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
 @pytest.mark.plugin("upenncontrast_annotation")
 class TestPropertyValueCleanup:
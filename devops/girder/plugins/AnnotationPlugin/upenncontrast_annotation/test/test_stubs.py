@@ -1,12 +1,23 @@
+import datetime
 import json
+import struct
+
+import numpy as np
 import pytest
 
 from bson.objectid import ObjectId
+from girder.models.folder import Folder
 
 from pytest_girder.assertions import assertStatus, assertStatusOk
 
-from upenncontrast_annotation.server.helpers import validation
+from upenncontrast_annotation.server.helpers import columnar, validation
 from upenncontrast_annotation.server.models.annotation import Annotation
+from upenncontrast_annotation.server.models.changeSequence import (
+    DatasetChangeSequence,
+)
+from upenncontrast_annotation.server.models.tombstone import (
+    DatasetTombstone,
+)
 
 from . import girder_utilities as utilities
 from . import upenn_testing_utilities as upenn_utilities
@@ -35,6 +46,65 @@ def parseStreamingResponse(resp):
     return json.loads(body)
 
 
+def decodeColumnarStubs(body):
+    """Reference decoder for the columnar stub layout (helpers/columnar)."""
+    assert body[:4] == columnar.COLUMNAR_MAGIC
+    assert struct.unpack_from("<I", body, 4)[0] == columnar.COLUMNAR_VERSION
+    offset = 8
+    strings = []
+    stubs = []
+
+    def read(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    while True:
+        (rows,) = struct.unpack_from("<I", body, offset)
+        offset += 4
+        if rows == 0:
+            break
+        (newStrings,) = struct.unpack_from("<I", body, offset)
+        offset += 4
+        for _ in range(newStrings):
+            (length,) = struct.unpack_from("<I", body, offset)
+            offset += 4
+            strings.append(body[offset:offset + length].decode("utf-8"))
+            offset += length
+        offset += -offset % 4
+        ids = [
+            str(ObjectId(body[offset + 12 * i:offset + 12 * (i + 1)]))
+            for i in range(rows)
+        ]
+        offset += 12 * rows
+        x, y, radius = (read("<f4", rows) for _ in range(3))
+        shape, color, tagCount = (read("<u4", rows) for _ in range(3))
+        tags = read("<u4", int(tagCount.sum()))
+        xy, z, time, channel = (read("<u4", rows) for _ in range(4))
+        tagOffset = 0
+        for i in range(rows):
+            rowTags = tags[tagOffset:tagOffset + tagCount[i]]
+            tagOffset += tagCount[i]
+            stubs.append({
+                "_id": ids[i],
+                "centroid": {"x": float(x[i]), "y": float(y[i])},
+                "estimatedRadius": float(radius[i]),
+                "shape": strings[shape[i]],
+                "color": (
+                    None if color[i] == columnar.NULL_INDEX
+                    else strings[color[i]]
+                ),
+                "tags": [strings[t] for t in rowTags],
+                "location": {
+                    "XY": int(xy[i]), "Z": int(z[i]), "Time": int(time[i]),
+                },
+                "channel": int(channel[i]),
+            })
+    assert offset == len(body)
+    return stubs
+
+
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
 @pytest.mark.plugin("upenncontrast_annotation")
 class TestStubs:
@@ -248,6 +318,389 @@ class TestStubs:
         assert stubs[0]["centroid"]["y"] == pytest.approx(99)
         assert stubs[0]["estimatedRadius"] == pytest.approx(0)
 
+    def testSpatialFieldsPersistedAtWriteTime(self, admin):
+        """centroid/bbox/estimatedRadius are stored on the document, so the
+        stub and list queries don't aggregate over coordinates."""
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        ann = createPolygonAnnotation(
+            folder["_id"],
+            [{"x": 0, "y": 0}, {"x": 20, "y": 0}, {"x": 20, "y": 6}],
+        )
+        stored = Annotation().collection.find_one({"_id": ann["_id"]})
+        assert stored["centroid"]["x"] == pytest.approx(40 / 3)
+        assert stored["centroid"]["y"] == pytest.approx(2)
+        assert stored["bbox"] == {
+            "minX": 0, "minY": 0, "maxX": 20, "maxY": 6,
+        }
+        assert stored["estimatedRadius"] == pytest.approx(10)
+
+    def testStubsFallBackForLegacyAnnotations(self, admin, server):
+        """Annotations saved before the spatial fields were persisted (and
+        not yet backfilled) still get a computed centroid and radius."""
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        ann = createPolygonAnnotation(
+            folder["_id"],
+            [{"x": 0, "y": 0}, {"x": 10, "y": 0}, {"x": 10, "y": 4}],
+        )
+        Annotation().collection.update_one(
+            {"_id": ann["_id"]},
+            {"$unset": {"centroid": "", "bbox": "", "estimatedRadius": ""}},
+        )
+
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=admin,
+            params={"datasetId": str(folder["_id"])},
+            isJson=False,
+        )
+        assertStatusOk(resp)
+        stubs = parseStreamingResponse(resp)
+        assert len(stubs) == 1
+        assert stubs[0]["centroid"]["x"] == pytest.approx(20 / 3)
+        assert stubs[0]["centroid"]["y"] == pytest.approx(4 / 3)
+        assert stubs[0]["estimatedRadius"] == pytest.approx(5)
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestColumnarStubs:
+    def requestColumnar(self, server, user, datasetId, **params):
+        params.update({"datasetId": str(datasetId), "format": "columnar"})
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=user,
+            params=params,
+            isJson=False,
+        )
+        assertStatusOk(resp)
+        assert resp.headers["Content-Type"] == "application/octet-stream"
+        return decodeColumnarStubs(b"".join(resp.body))
+
+    def testEmptyDataset(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        assert self.requestColumnar(server, admin, folder["_id"]) == []
+
+    def testMatchesJsonStubs(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        createPolygonAnnotation(
+            folder["_id"],
+            [{"x": 0, "y": 0}, {"x": 10, "y": 0}, {"x": 10, "y": 10}],
+            tags=["nucleus", "bright"],
+            location={"XY": 2, "Z": 5, "Time": 1},
+        )
+        createPolygonAnnotation(
+            folder["_id"], [{"x": 3.5, "y": 7.25}], shape="point",
+            tags=["spot"],
+        )
+        untagged = upenn_utilities.getSampleAnnotation(folder["_id"])
+        untagged.update({"tags": [], "channel": 3, "color": "#ff0000"})
+        Annotation().create(untagged)
+
+        columnarStubs = self.requestColumnar(server, admin, folder["_id"])
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=admin,
+            params={"datasetId": str(folder["_id"])},
+            isJson=False,
+        )
+        jsonStubs = parseStreamingResponse(resp)
+
+        assert len(columnarStubs) == len(jsonStubs) == 3
+        for packed, stub in zip(columnarStubs, jsonStubs):
+            assert packed["_id"] == stub["_id"]
+            assert packed["centroid"]["x"] == pytest.approx(
+                stub["centroid"]["x"])
+            assert packed["centroid"]["y"] == pytest.approx(
+                stub["centroid"]["y"])
+            assert packed["estimatedRadius"] == pytest.approx(
+                stub["estimatedRadius"])
+            assert packed["shape"] == stub["shape"]
+            assert packed["color"] == stub.get("color")
+            assert packed["tags"] == stub["tags"]
+            assert packed["location"] == stub["location"]
+            assert packed["channel"] == stub["channel"]
+
+    def testDictionarySpansBatches(self, admin, server, monkeypatch):
+        # Strings first seen in an earlier batch are referenced, not resent.
+        monkeypatch.setattr(columnar, "COLUMNAR_BATCH_SIZE", 2)
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        for i in range(5):
+            createPolygonAnnotation(
+                folder["_id"], [{"x": i, "y": i}], shape="point",
+                tags=["shared", "t%d" % (i % 2)],
+            )
+        stubs = self.requestColumnar(server, admin, folder["_id"])
+        assert len(stubs) == 5
+        assert [stub["tags"] for stub in stubs] == [
+            ["shared", "t%d" % (i % 2)] for i in range(5)
+        ]
+
+    def testLargeLocationIndices(self, admin, server):
+        # Indices beyond the range of 16 bits are not truncated
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        location = {"XY": 70000, "Z": 65536, "Time": 100000}
+        createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}], shape="point",
+            location=location,
+        )
+        [stub] = self.requestColumnar(server, admin, folder["_id"])
+        assert stub["location"] == location
+
+    def testFiltersApply(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}, {"x": 1, "y": 1}]
+        )
+        createPolygonAnnotation(
+            folder["_id"], [{"x": 5, "y": 5}], shape="point"
+        )
+        stubs = self.requestColumnar(
+            server, admin, folder["_id"], shape="point"
+        )
+        assert [stub["shape"] for stub in stubs] == ["point"]
+
+    def testInvalidFormatReturns400(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=admin,
+            params={"datasetId": str(folder["_id"]), "format": "xml"},
+        )
+        assertStatus(resp, 400)
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestStubDelta:
+    def fullSeq(self, server, user, datasetId):
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=user,
+            params={"datasetId": str(datasetId)},
+            isJson=False,
+        )
+        assertStatusOk(resp)
+        return int(resp.headers["Nimbus-Change-Seq"])
+
+    def requestDelta(self, server, user, datasetId, since, **params):
+        params.update({"datasetId": str(datasetId), "since": since})
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=user,
+            params=params,
+            isJson=False,
+        )
+        assertStatusOk(resp)
+        return parseStreamingResponse(resp)
+
+    def testFreshDatasetIsAtSequenceZero(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        assert self.fullSeq(server, admin, folder["_id"]) == 0
+        delta = self.requestDelta(server, admin, folder["_id"], 0)
+        assert delta == {
+            "seq": 0, "reset": False, "deleted": [], "upserted": [],
+        }
+
+    def testDeltaReportsUpsertsAndDeletes(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        unchanged = createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}], shape="point")
+        updated = createPolygonAnnotation(
+            folder["_id"], [{"x": 1, "y": 1}], shape="point")
+        deleted = createPolygonAnnotation(
+            folder["_id"], [{"x": 2, "y": 2}], shape="point")
+        seq = self.fullSeq(server, admin, folder["_id"])
+        assert seq > 0
+
+        created = createPolygonAnnotation(
+            folder["_id"], [{"x": 3, "y": 3}], shape="point")
+        Annotation().updateMultiple(
+            {updated["_id"]: {"coordinates": [{"x": 9, "y": 9}]}}, admin
+        )
+        Annotation().deleteMultiple([str(deleted["_id"])])
+
+        delta = self.requestDelta(server, admin, folder["_id"], seq)
+        assert delta["seq"] > seq
+        assert delta["reset"] is False
+        assert delta["deleted"] == [str(deleted["_id"])]
+        upserted = {stub["_id"]: stub for stub in delta["upserted"]}
+        assert set(upserted) == {str(created["_id"]), str(updated["_id"])}
+        assert str(unchanged["_id"]) not in upserted
+        assert upserted[str(updated["_id"])]["centroid"]["x"] == (
+            pytest.approx(9))
+        assert "coordinates" not in upserted[str(updated["_id"])]
+
+        # Nothing changed after the latest sequence.
+        latest = self.requestDelta(
+            server, admin, folder["_id"], delta["seq"])
+        assert latest["upserted"] == [] and latest["deleted"] == []
+
+    def testSingleDeleteLeavesTombstone(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        ann = createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}], shape="point")
+        seq = self.fullSeq(server, admin, folder["_id"])
+        Annotation().delete(ann)
+        delta = self.requestDelta(server, admin, folder["_id"], seq)
+        assert delta["deleted"] == [str(ann["_id"])]
+
+    def testFilteredDeltaDropsAnnotationsLeavingTheFilter(
+        self, admin, server
+    ):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        kept = createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}], shape="point", tags=["a"])
+        retagged = createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}], shape="point", tags=["a"])
+        seq = self.fullSeq(server, admin, folder["_id"])
+        Annotation().updateMultiple({
+            kept["_id"]: {"name": "renamed"},
+            retagged["_id"]: {"tags": ["b"]},
+        }, admin)
+
+        delta = self.requestDelta(
+            server, admin, folder["_id"], seq, tags=json.dumps(["a"]))
+        assert [stub["_id"] for stub in delta["upserted"]] == [
+            str(kept["_id"])]
+        assert delta["deleted"] == [str(retagged["_id"])]
+
+    def testUndoneCreationIsReportedDeleted(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        seq = self.fullSeq(server, admin, folder["_id"])
+        annotation = upenn_utilities.getSampleAnnotation(str(folder["_id"]))
+        resp = server.request(
+            path="/upenn_annotation",
+            method="POST",
+            user=admin,
+            body=json.dumps(annotation),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        createdId = resp.json["_id"]
+        delta = self.requestDelta(server, admin, folder["_id"], seq)
+        assert [stub["_id"] for stub in delta["upserted"]] == [createdId]
+
+        resp = server.request(
+            path="/history/undo",
+            method="PUT",
+            user=admin,
+            params={"datasetId": str(folder["_id"])},
+        )
+        assertStatusOk(resp)
+        delta = self.requestDelta(server, admin, folder["_id"], seq)
+        assert delta["upserted"] == []
+        assert delta["deleted"] == [createdId]
+
+    def testSequenceAheadOfServerResets(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        createPolygonAnnotation(
+            folder["_id"], [{"x": 0, "y": 0}], shape="point")
+        seq = self.fullSeq(server, admin, folder["_id"])
+        delta = self.requestDelta(server, admin, folder["_id"], seq + 100)
+        assert delta["reset"] is True
+        assert delta["seq"] == seq
+        assert len(delta["upserted"]) == 1
+
+    def testPrunedTombstonesReset(self, admin, server, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        first, second = [
+            createPolygonAnnotation(
+                folder["_id"], [{"x": 0, "y": 0}], shape="point")
+            for _ in range(2)
+        ]
+        seq = self.fullSeq(server, admin, folder["_id"])
+        monkeypatch.setattr(
+            DatasetTombstone, "retention", datetime.timedelta(0)
+        )
+        Annotation().delete(first)
+        afterFirst = self.fullSeq(server, admin, folder["_id"])
+        # Prunes the tombstone of the first removal
+        Annotation().delete(second)
+
+        delta = self.requestDelta(server, admin, folder["_id"], seq)
+        assert delta["reset"] is True
+        assert delta["upserted"] == []
+        delta = self.requestDelta(server, admin, folder["_id"], afterFirst)
+        assert delta["reset"] is False
+        assert delta["deleted"] == [str(second["_id"])]
+        assert DatasetTombstone().removedIdsSince(
+            Annotation().name, folder["_id"], 0
+        ) == [second["_id"]]
+
+    def testRemovedDatasetLeavesNoTombstones(self, admin, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        for _ in range(3):
+            createPolygonAnnotation(
+                folder["_id"], [{"x": 0, "y": 0}], shape="point")
+        recorded = []
+        monkeypatch.setattr(
+            DatasetTombstone, "record",
+            lambda self, *args: recorded.append(args),
+        )
+        Folder().remove(folder)
+
+        assert recorded == []
+
+        assert Annotation().findOne({"datasetId": folder["_id"]}) is None
+        assert DatasetTombstone().findOne(
+            {"datasetId": folder["_id"]}
+        ) is None
+        assert DatasetChangeSequence().findOne({"_id": folder["_id"]}) is None
+
+    def testSinceWithColumnarReturns400(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "test_dataset", upenn_utilities.datasetMetadata
+        )
+        resp = server.request(
+            path="/upenn_annotation/stubs",
+            method="GET",
+            user=admin,
+            params={
+                "datasetId": str(folder["_id"]),
+                "since": 0,
+                "format": "columnar",
+            },
+        )
+        assertStatus(resp, 400)
+
 
 @pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
 @pytest.mark.plugin("upenncontrast_annotation")
@@ -6,6 +6,9 @@ from pytest_girder.assertions import assertStatus, assertStatusOk
 
 from upenncontrast_annotation.server.helpers import validation
 from upenncontrast_annotation.server.models.annotation import Annotation
+from upenncontrast_annotation.server.models.datasetSummary import (
+    DatasetSummary,
+)
 from upenncontrast_annotation.server.models.propertyValues import (
     AnnotationPropertyValues,
 )
@@ -276,3 +279,150 @@ class TestUncomputedCounts:
         props = [self._prop("p%d" % i) for i in range(3)]
         resp = self._uncomputed(server, admin, str(folder["_id"]), props)
         assertStatus(resp, 400)
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestDatasetSummary:
+    """uncomputedCounts reads a materialized summary, kept up to date by
+    the annotation and property-value writes."""
+
+    def _counts(self, folder):
+        return Annotation().uncomputedCounts(folder["_id"], [
+            TestUncomputedCounts._prop("propA"),
+            TestUncomputedCounts._prop("propN", tags=["nucleus"]),
+            TestUncomputedCounts._prop(
+                "propX", shape="polygon", tags=["nucleus", "big"],
+                exclusive=True,
+            ),
+        ])
+
+    def _summaryWithoutKeys(self, summary):
+        return (
+            sorted(
+                (group["shape"], group["tags"], group["count"])
+                for group in summary["annotationGroups"].values()
+                if group["count"]
+            ),
+            {key: n for key, n in summary["valueCounts"].items() if n},
+        )
+
+    def assertSummaryMatchesRebuild(self, folder):
+        incremental = DatasetSummary().findOne({"_id": folder["_id"]})
+        rebuilt = Annotation().rebuildDatasetSummary(folder["_id"])
+        assert self._summaryWithoutKeys(incremental) == \
+            self._summaryWithoutKeys(rebuilt)
+
+    def testWritesUpdateTheSummaryIncrementally(self, admin, monkeypatch):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = upenn_utilities.getSampleAnnotation(folder["_id"])
+        annotation["tags"] = ["nucleus"]
+        first = Annotation().create(annotation)
+        assert self._counts(folder) == {"propA": 1, "propN": 1, "propX": 0}
+
+        rebuild = Annotation().rebuildDatasetSummary
+        monkeypatch.setattr(
+            Annotation(), "rebuildDatasetSummary",
+            lambda datasetId: pytest.fail("summary rebuilt"),
+        )
+        created = Annotation().createMultiple([
+            dict(
+                upenn_utilities.getSampleAnnotation(folder["_id"]),
+                shape=shape, tags=tags,
+            )
+            for shape, tags in (
+                ("point", ["big", "nucleus"]),
+                ("polygon", ["big", "nucleus"]),
+                ("polygon", ["nucleus", "big"]),
+                ("point", []),
+            )
+        ])
+        pv = AnnotationPropertyValues()
+        pv.appendValues({"propA": 1}, first["_id"], folder["_id"])
+        # Merged into the existing value doc of the annotation
+        pv.appendValues({"propN": 2}, first["_id"], folder["_id"])
+        pv.appendMultipleValues([
+            {"annotationId": annotation["_id"], "datasetId": folder["_id"],
+             "values": {"propX": 3}}
+            for annotation in created[1:3]
+        ])
+        assert self._counts(folder) == {"propA": 2, "propN": 1, "propX": 0}
+
+        Annotation().updateMultiple(
+            {created[1]["_id"]: {"tags": ["cell"]}}, admin
+        )
+        Annotation().delete(created[2])
+        Annotation().deleteMultiple([str(created[3]["_id"])])
+        assert self._counts(folder) == {"propA": 1, "propN": 1, "propX": 0}
+
+        monkeypatch.setattr(Annotation(), "rebuildDatasetSummary", rebuild)
+        self.assertSummaryMatchesRebuild(folder)
+
+    def testUndoUpdatesTheSummary(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        Annotation().create(
+            upenn_utilities.getSampleAnnotation(folder["_id"])
+        )
+        assert self._counts(folder)["propA"] == 1
+        resp = server.request(
+            path="/upenn_annotation/multiple", method="POST", user=admin,
+            body=json.dumps([
+                upenn_utilities.getSampleAnnotation(str(folder["_id"]))
+                for _ in range(3)
+            ]),
+            type="application/json",
+        )
+        assertStatusOk(resp)
+        assert self._counts(folder)["propA"] == 4
+
+        resp = server.request(
+            path="/history/undo", method="PUT", user=admin,
+            params={"datasetId": str(folder["_id"])},
+        )
+        assertStatusOk(resp)
+        assert self._counts(folder)["propA"] == 1
+        self.assertSummaryMatchesRebuild(folder)
+
+    def testPropertyDeletionUpdatesTheSummary(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        annotation = upenn_utilities.getSampleAnnotation(folder["_id"])
+        annotation["tags"] = ["nucleus"]
+        annotations = Annotation().createMultiple([
+            dict(annotation) for _ in range(3)
+        ])
+        pv = AnnotationPropertyValues()
+        pv.appendMultipleValues([
+            {"annotationId": created["_id"], "datasetId": folder["_id"],
+             "values": values}
+            for created, values in zip(annotations, (
+                {"propA": 1}, {"propA": 2, "propN": 3}, {"propN": 4},
+            ))
+        ])
+        assert self._counts(folder) == {"propA": 1, "propN": 1, "propX": 0}
+
+        pv.delete("propA", folder["_id"])
+        assert self._counts(folder) == {"propA": 3, "propN": 1, "propX": 0}
+        assert pv.findOne({"annotationId": annotations[0]["_id"]}) is None
+        self.assertSummaryMatchesRebuild(folder)
+
+    def testRebuildFixesDrift(self, admin):
+        folder = utilities.createFolder(
+            admin, "ds", upenn_utilities.datasetMetadata
+        )
+        for _ in range(2):
+            Annotation().create(
+                upenn_utilities.getSampleAnnotation(folder["_id"])
+            )
+        assert self._counts(folder)["propA"] == 2
+        DatasetSummary().collection.update_one(
+            {"_id": folder["_id"]}, {"$set": {"annotationGroups": {}}}
+        )
+        assert self._counts(folder)["propA"] == 0
+        Annotation().rebuildDatasetSummary(folder["_id"])
+        assert self._counts(folder)["propA"] == 2
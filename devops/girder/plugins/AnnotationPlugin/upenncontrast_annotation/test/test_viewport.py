@@ -0,0 +1,212 @@
+import json
+import pytest
+
+from pytest_girder.assertions import assertStatus, assertStatusOk
+
+from upenncontrast_annotation.server.models.annotation import Annotation
+
+from . import girder_utilities as utilities
+from . import upenn_testing_utilities as upenn_utilities
+
+
+def createAnnotation(datasetId, coords, shape="polygon", location=None,
+                     tags=None):
+    ann = upenn_utilities.getSampleAnnotation(datasetId)
+    ann["coordinates"] = coords
+    ann["shape"] = shape
+    if location is not None:
+        ann["location"] = location
+    if tags is not None:
+        ann["tags"] = tags
+    return Annotation().create(ann)
+
+
+def square(x, y, size=10):
+    return [
+        {"x": x, "y": y},
+        {"x": x + size, "y": y},
+        {"x": x + size, "y": y + size},
+        {"x": x, "y": y + size},
+    ]
+
+
+def requestViewport(server, user, datasetId, bounds, **params):
+    minX, minY, maxX, maxY = bounds
+    params.update({
+        "datasetId": str(datasetId),
+        "minX": minX,
+        "minY": minY,
+        "maxX": maxX,
+        "maxY": maxY,
+    })
+    return server.request(
+        path="/upenn_annotation/viewport",
+        method="GET",
+        user=user,
+        params=params,
+        isJson=False,
+    )
+
+
+def parseStreamingResponse(resp):
+    return json.loads(b"".join(resp.body))
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestBoundingBox:
+    def testBboxPersistedOnCreate(self, admin):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        ann = createAnnotation(folder["_id"], square(5, 20))
+        stored = Annotation().load(ann["_id"], force=True)
+        assert stored["bbox"] == {
+            "minX": 5, "minY": 20, "maxX": 15, "maxY": 30,
+        }
+
+    def testBboxPersistedOnCreateMultiple(self, admin):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        anns = [upenn_utilities.getSampleAnnotation(folder["_id"])
+                for _ in range(3)]
+        for i, ann in enumerate(anns):
+            ann["coordinates"] = [{"x": i, "y": 2 * i}]
+        for ann in Annotation().createMultiple(anns):
+            stored = Annotation().load(ann["_id"], force=True)
+            x = stored["coordinates"][0]["x"]
+            y = stored["coordinates"][0]["y"]
+            assert stored["bbox"] == {
+                "minX": x, "minY": y, "maxX": x, "maxY": y,
+            }
+
+    def testBboxFollowsCoordinateUpdates(self, admin):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        ann = createAnnotation(folder["_id"], square(0, 0))
+        Annotation().updateMultiple(
+            {ann["_id"]: {"coordinates": square(100, 200, 5)}}, admin
+        )
+        stored = Annotation().load(ann["_id"], force=True)
+        assert stored["bbox"] == {
+            "minX": 100, "minY": 200, "maxX": 105, "maxY": 205,
+        }
+
+
+@pytest.mark.usefixtures("unbindLargeImage", "unbindAnnotation")
+@pytest.mark.plugin("upenncontrast_annotation")
+class TestViewport:
+    def testReturnsOnlyIntersectingAnnotations(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        inside = createAnnotation(folder["_id"], square(10, 10))
+        overlapping = createAnnotation(folder["_id"], square(45, 45))
+        createAnnotation(folder["_id"], square(200, 200))
+        createAnnotation(folder["_id"], [{"x": 51, "y": 0}], shape="point")
+
+        resp = requestViewport(server, admin, folder["_id"], (0, 0, 50, 50))
+        assertStatusOk(resp)
+        result = parseStreamingResponse(resp)
+        assert {r["_id"] for r in result} == {
+            str(inside["_id"]), str(overlapping["_id"]),
+        }
+        # Full documents, geometry included.
+        assert all("coordinates" in r for r in result)
+
+    def testBoundsAreInclusive(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        edge = createAnnotation(
+            folder["_id"], [{"x": 50, "y": 50}], shape="point"
+        )
+        resp = requestViewport(server, admin, folder["_id"], (0, 0, 50, 50))
+        assertStatusOk(resp)
+        result = parseStreamingResponse(resp)
+        assert [r["_id"] for r in result] == [str(edge["_id"])]
+
+    def testLocationFilter(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        here = createAnnotation(
+            folder["_id"], square(0, 0),
+            location={"XY": 1, "Z": 2, "Time": 0},
+        )
+        createAnnotation(
+            folder["_id"], square(0, 0),
+            location={"XY": 1, "Z": 3, "Time": 0},
+        )
+        createAnnotation(
+            folder["_id"], square(0, 0),
+            location={"XY": 0, "Z": 2, "Time": 0},
+        )
+
+        resp = requestViewport(
+            server, admin, folder["_id"], (0, 0, 100, 100),
+            XY=1, Z=2, Time=0,
+        )
+        assertStatusOk(resp)
+        result = parseStreamingResponse(resp)
+        assert [r["_id"] for r in result] == [str(here["_id"])]
+
+        # Omitted axes are not constrained.
+        resp = requestViewport(
+            server, admin, folder["_id"], (0, 0, 100, 100), XY=1,
+        )
+        assertStatusOk(resp)
+        assert len(parseStreamingResponse(resp)) == 2
+
+    def testShapeTagsAndLimit(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        for _ in range(3):
+            createAnnotation(folder["_id"], square(0, 0), tags=["cell"])
+        createAnnotation(folder["_id"], square(0, 0), tags=["nucleus"])
+        createAnnotation(
+            folder["_id"], [{"x": 1, "y": 1}], shape="point", tags=["cell"]
+        )
+
+        resp = requestViewport(
+            server, admin, folder["_id"], (0, 0, 100, 100),
+            shape="polygon", tags=json.dumps(["cell"]),
+        )
+        assertStatusOk(resp)
+        assert len(parseStreamingResponse(resp)) == 3
+
+        resp = requestViewport(
+            server, admin, folder["_id"], (0, 0, 100, 100), limit=2,
+        )
+        assertStatusOk(resp)
+        assert len(parseStreamingResponse(resp)) == 2
+
+    def testInvertedBoundsReturns400(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        resp = requestViewport(server, admin, folder["_id"], (50, 0, 0, 50))
+        assertStatus(resp, 400)
+
+    def testMissingBoundReturns400(self, admin, server):
+        folder = utilities.createFolder(
+            admin, "dataset", upenn_utilities.datasetMetadata
+        )
+        resp = server.request(
+            path="/upenn_annotation/viewport",
+            method="GET",
+            user=admin,
+            params={"datasetId": str(folder["_id"]), "minX": 0},
+        )
+        assertStatus(resp, 400)
+
+    def testAccessDenied(self, admin, user, server):
+        folder = utilities.createPrivateFolder(
+            admin, "private_dataset", upenn_utilities.datasetMetadata
+        )
+        createAnnotation(folder["_id"], square(0, 0))
+        resp = requestViewport(server, user, folder["_id"], (0, 0, 50, 50))
+        assertStatus(resp, 403)
@@ -9,6 +9,8 @@ Usage:
     anns = ds.annotations.list(shape='polygon')
 """
 
+from nimbusimage._upload import ChunkUploadError
+from nimbusimage.cache import RegionCache
 from nimbusimage.client import NimbusClient
 from nimbusimage.collections import Collection
 from nimbusimage.coordinates import attach_geometry_methods
@@ -41,6 +43,8 @@ def connect(
     username: str | None = None,
     password: str | None = None,
     anonymous: bool = False,
+    cache_dir: str | None = None,
+    cache_max_bytes: int | None = None,
 ) -> NimbusClient:
     """Connect to a NimbusImage server.
 
@@ -55,6 +59,10 @@ def connect(
         anonymous: Connect without credentials. Only public
             datasets are accessible (e.g., for measurements on
             published data).
+        cache_dir: Cache the fetched image regions on disk in this
+            directory (see RegionCache). Or set NI_CACHE_DIR env var.
+        cache_max_bytes: Size of the region cache, 2 GiB by default.
+            Or set NI_CACHE_MAX_BYTES env var.
 
     Returns:
         Authenticated NimbusClient.
@@ -62,6 +70,7 @@ def connect(
     return NimbusClient(
         api_url=api_url, token=token, api_key=api_key,
         username=username, password=password, anonymous=anonymous,
+        cache_dir=cache_dir, cache_max_bytes=cache_max_bytes,
     )
 
 
@@ -99,6 +108,7 @@ __all__ = [
     "Job",
     "WorkerContext",
     "LineScanResult",
+    "RegionCache",
     # Data models
     "Annotation",
     "Connection",
@@ -110,4 +120,6 @@ __all__ = [
     "filter_by_tags",
     "filter_by_location",
     "group_by_location",
+    # Errors
+    "ChunkUploadError",
 ]
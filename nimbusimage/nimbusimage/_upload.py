@@ -0,0 +1,149 @@
+"""Chunked, concurrent bulk POSTs shared by the bulk-create accessors.
+
+A bulk payload posted as one JSON array (100K+ spots from a worker) is
+slow to send serially and can exceed the server's request body limit.
+``post_chunks`` splits it into chunks and posts them on a bounded thread
+pool. Every POST goes through the client's retrying session (see
+``_girder.create_client``), which is safe to share between threads.
+
+POST is not retried by that session (NIM-007), so chunks are retried
+here, only when the caller says its endpoint is idempotent, and only on
+transient failures: 502/503/504 responses and connection errors.
+"""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import girder_client
+import requests
+
+from nimbusimage._girder import (
+    _RETRY_BACKOFF_FACTOR,
+    _RETRY_STATUS_FORCELIST,
+)
+
+# At most this many POSTs are in flight: below the connection pool size
+# of the session adapter (10), so threads never wait for a connection.
+UPLOAD_WORKERS = 4
+
+
+class ChunkUploadError(RuntimeError):
+    """Some chunks of a bulk upload failed after their retries.
+
+    Uploads are not atomic: the other chunks were written. Attributes:
+        results: The parsed results of the chunks that succeeded, in
+            input order (e.g. the created annotations).
+        committed: ``(start, stop)`` for each chunk that succeeded, where
+            ``items[start:stop]`` is a part of the input that was written.
+        failures: ``(start, stop, exception)`` for each failed chunk,
+            where ``items[start:stop]`` is the part of the input that
+            was not written.
+    """
+
+    def __init__(
+        self,
+        results: list,
+        committed: list[tuple[int, int]],
+        failures: list[tuple],
+    ):
+        self.results = results
+        self.committed = committed
+        self.failures = failures
+        failed = sum(stop - start for start, stop, _ in failures)
+        super().__init__(
+            f"{len(failures)} chunk(s) failed ({failed} item(s) not "
+            f"written); first error: {failures[0][2]!r}"
+        )
+
+
+def _is_transient(exc: Exception) -> bool:
+    if isinstance(exc, girder_client.HttpError):
+        return exc.status in _RETRY_STATUS_FORCELIST
+    return isinstance(
+        exc, (requests.ConnectionError, requests.Timeout)
+    )
+
+
+def post_chunks(
+    gc: girder_client.GirderClient,
+    path: str,
+    items: list,
+    chunk_size: int,
+    max_workers: int = UPLOAD_WORKERS,
+    retries: int = 0,
+    parse: Callable[[object], list] | None = None,
+    parameters: dict | None = None,
+) -> list:
+    """POST ``items`` to ``path`` in chunks, concurrently.
+
+    Args:
+        gc: The client, whose session is shared by the threads.
+        path: The bulk endpoint, which receives a JSON array.
+        items: The JSON-serializable items to post.
+        chunk_size: The number of items per POST.
+        max_workers: The maximum number of concurrent POSTs.
+        retries: How many times a chunk is posted again after a
+            transient failure. Only pass a non-zero value for endpoints
+            where posting the same chunk twice is harmless.
+        parse: Converts the response of a chunk into a list of results.
+            Responses are ignored when omitted.
+        parameters: Query parameters of every POST.
+
+    Returns:
+        The results of all the chunks, concatenated in input order.
+
+    Raises:
+        ValueError: If ``chunk_size`` or ``max_workers`` is not positive.
+        ChunkUploadError: If some chunks failed; the others are written
+            and their results are attached to the error. When every
+            chunk failed, the error of the first one is raised instead.
+    """
+    if chunk_size < 1 or max_workers < 1:
+        raise ValueError("chunk_size and max_workers must be positive")
+    bounds = [
+        (start, min(start + chunk_size, len(items)))
+        for start in range(0, len(items), chunk_size)
+    ]
+
+    def post(start: int, stop: int) -> list:
+        for attempt in range(retries + 1):
+            try:
+                data = gc.post(
+                    path, parameters=parameters, json=items[start:stop]
+                )
+                break
+            except Exception as exc:
+                if attempt == retries or not _is_transient(exc):
+                    raise
+                time.sleep(_RETRY_BACKOFF_FACTOR * 2 ** attempt)
+        return parse(data) if parse is not None else []
+
+    if not bounds:
+        return []
+    if len(bounds) == 1:
+        # No thread for a single chunk
+        return post(*bounds[0])
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(bounds))
+    ) as pool:
+        futures = [pool.submit(post, *bound) for bound in bounds]
+
+    results = []
+    committed = []
+    failures = []
+    for (start, stop), future in zip(bounds, futures):
+        exc = future.exception()
+        if exc is not None:
+            failures.append((start, stop, exc))
+        else:
+            committed.append((start, stop))
+            results.extend(future.result())
+    if len(failures) == len(bounds):
+        # No chunk succeeded: not a partial failure
+        raise failures[0][2]
+    if failures:
+        raise ChunkUploadError(results, committed, failures)
+    return results
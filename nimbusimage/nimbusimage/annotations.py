@@ -3,9 +3,11 @@
 from __future__ import annotations
 
 import json
+import uuid
 from collections.abc import Iterator
 from typing import TYPE_CHECKING
 
+from nimbusimage._upload import UPLOAD_WORKERS, post_chunks
 from nimbusimage._workers import ANNOTATION_ROLE_LABEL, check_worker_role
 from nimbusimage.jobs import Job
 from nimbusimage.models import Annotation, Location
@@ -13,6 +15,8 @@ from nimbusimage.models import Annotation, Location
 if TYPE_CHECKING:
     import girder_client
 
+_CREATE_CHUNK_SIZE = 5000
+
 
 class AnnotationAccessor:
     """Access annotations for a specific dataset."""
@@ -150,21 +154,53 @@ class AnnotationAccessor:
         self,
         annotations: list[Annotation],
         connect_to: dict | None = None,
+        chunk_size: int = _CREATE_CHUNK_SIZE,
+        max_workers: int = UPLOAD_WORKERS,
+        retries: int = 0,
     ) -> list[Annotation]:
         """Create multiple annotations in bulk.
 
+        Annotations are posted in chunks of ``chunk_size``, up to
+        ``max_workers`` chunks at a time. The chunks share one history
+        entry on the server, so a single undo removes the whole upload.
+        The upload is not atomic: when some chunks fail, the others stay
+        created (see ``ChunkUploadError``).
+
         Args:
             annotations: List of Annotation objects to create.
             connect_to: If provided, auto-connect created annotations
                 to nearest matching annotation. Dict with 'tags' and
                 'channel' keys.
+            chunk_size: Number of annotations per request.
+            max_workers: Maximum number of concurrent requests.
+            retries: How many times a chunk is posted again after a
+                transient failure (502/503/504 or connection error).
+                Defaults to 0: a chunk whose response was lost may
+                already be created, and posting it again would create
+                its annotations twice.
 
         Returns:
-            List of created Annotations (with server-assigned IDs).
+            List of created Annotations (with server-assigned IDs), in
+            the order of ``annotations``.
+
+        Raises:
+            ChunkUploadError: If some chunks failed. Its ``results`` are
+                the annotations created by the other chunks, its
+                ``committed`` ranges locate them in ``annotations``, and
+                its ``failures`` locate the annotations that were not
+                created. Nothing is connected in that case.
         """
         dicts = [a.to_dict() for a in annotations]
-        data = self._gc.post("/upenn_annotation/multiple", json=dicts)
-        created = [Annotation.from_dict(d) for d in data]
+        created = post_chunks(
+            self._gc,
+            "/upenn_annotation/multiple",
+            dicts,
+            chunk_size,
+            max_workers=max_workers,
+            retries=retries,
+            parse=lambda data: [Annotation.from_dict(d) for d in data],
+            parameters={"historyGroup": uuid.uuid4().hex},
+        )
 
         if (
             connect_to is not None
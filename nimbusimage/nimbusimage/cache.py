@@ -0,0 +1,172 @@
+"""RegionCache — opt-in on-disk cache of image regions.
+
+Notebooks and scripts that are re-run fetch the same frames from the tile
+server every time. With a cache, each region fetched by ``ds.images`` is
+also stored as a ``.npy`` file, and read back memory-mapped on the next
+request for it.
+
+Entries are keyed by the large image item, its modification time, the
+frame and the region parameters, so a replaced or re-processed image never
+serves stale pixels: its regions get new keys, and the old entries age out.
+The least recently used entries are evicted beyond a byte budget.
+
+Enable it with ``ni.connect(..., cache_dir=...)`` or the ``NI_CACHE_DIR``
+environment variable.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+class RegionCache:
+    """A directory of cached regions, evicted by LRU against a byte budget.
+
+    Several processes can share a directory: files are written atomically,
+    and last use is tracked by file modification time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: Where the ``.npy`` files are stored. Created if
+                missing.
+            max_bytes: Total size of the cached files above which the
+                least recently used are deleted.
+        """
+        self._directory = os.path.abspath(os.path.expanduser(directory))
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Size of the directory as of the last scan, plus what this
+        # process wrote since: scanning only when it exceeds the budget
+        self._total_bytes: int | None = None
+        os.makedirs(self._directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @staticmethod
+    def key(
+        item_id: str, modified: str, frame: int, params: dict
+    ) -> str:
+        """The cache key of a region of a large image item.
+
+        Args:
+            item_id: The large image item.
+            modified: The item's modification time.
+            frame: The frame index.
+            params: The other region request parameters.
+        """
+        return hashlib.sha256(json.dumps(
+            [item_id, modified, frame, params],
+            sort_keys=True,
+            default=str,
+        ).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key + ".npy")
+
+    def get(self, key: str) -> np.ndarray | None:
+        """The cached region, or None.
+
+        The array is memory-mapped copy-on-write: reading it does not
+        copy the file, and writing to it never changes the cache.
+        """
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="c")
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, evicted meanwhile or unreadable
+            return None
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        """Store a region, then evict beyond the byte budget."""
+        if array.dtype.hasobject or array.nbytes > self._max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self._directory, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array, allow_pickle=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            # A full or read-only disk must not fail the fetch
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+                if self._total_bytes <= self._max_bytes:
+                    return
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already evicted by another process
+                pass
+            total -= size
+        self._total_bytes = total
+
+    def clear(self) -> None:
+        """Delete every cached region."""
+        with self._lock:
+            for entry in os.scandir(self._directory):
+                if entry.name.endswith(".npy"):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+            self._total_bytes = 0
+
+
+def cache_from_env(
+    cache_dir: str | None = None, max_bytes: int | None = None
+) -> RegionCache | None:
+    """The RegionCache of ``cache_dir``, or of the ``NI_CACHE_DIR``
+    environment variable, or None when neither is set.
+
+    The budget defaults to ``NI_CACHE_MAX_BYTES``, then to 2 GiB.
+    """
+    cache_dir = cache_dir or os.environ.get("NI_CACHE_DIR")
+    if not cache_dir:
+        return None
+    if max_bytes is None:
+        max_bytes = int(
+            os.environ.get("NI_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        )
+    return RegionCache(cache_dir, max_bytes=max_bytes)
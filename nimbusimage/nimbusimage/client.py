@@ -5,6 +5,7 @@ from __future__ import annotations
 import os
 
 from nimbusimage._girder import create_client
+from nimbusimage.cache import cache_from_env
 from nimbusimage.collections import Collection
 from nimbusimage.dataset import Dataset
 from nimbusimage.jobs import Job
@@ -20,6 +21,7 @@ class NimbusClient:
         client = ni.connect(api_url, username=..., password=...)
         client = ni.connect()  # from NI_API_URL + NI_TOKEN env vars
         client = ni.connect(api_url, anonymous=True)  # public data only
+        client = ni.connect(api_url, token=..., cache_dir="~/.ni-cache")
     """
 
     def __init__(
@@ -31,6 +33,8 @@ class NimbusClient:
         password: str | None = None,
         frontend_url: str = DEFAULT_FRONTEND_URL,
         anonymous: bool = False,
+        cache_dir: str | None = None,
+        cache_max_bytes: int | None = None,
     ):
         self._gc = create_client(
             api_url=api_url,
@@ -44,6 +48,7 @@ class NimbusClient:
             "NI_API_URL", self._gc.urlBase
         )
         self._frontend_url = os.environ.get("NI_FRONTEND_URL", frontend_url)
+        self._region_cache = cache_from_env(cache_dir, cache_max_bytes)
 
     @property
     def api_url(self) -> str:
@@ -85,6 +90,7 @@ class NimbusClient:
             return Dataset(
                 self._gc, dataset_id,
                 frontend_url=self._frontend_url,
+                region_cache=self._region_cache,
             )
         if name is not None:
             folders = self._gc.get(
@@ -102,6 +108,7 @@ class NimbusClient:
                     return Dataset(
                         self._gc, f["_id"],
                         frontend_url=self._frontend_url,
+                        region_cache=self._region_cache,
                     )
             raise ValueError(f"Dataset with name '{name}' not found")
         raise ValueError("Provide either dataset_id or name=")
@@ -24,6 +24,8 @@ from nimbusimage.urls import (
 if TYPE_CHECKING:
     import girder_client
 
+    from nimbusimage.cache import RegionCache
+
 
 class Dataset:
     """Access point for a single NimbusImage dataset.
@@ -36,12 +38,15 @@ class Dataset:
         gc: girder_client.GirderClient,
         dataset_id: str,
         frontend_url: str = DEFAULT_FRONTEND_URL,
+        region_cache: RegionCache | None = None,
     ):
         self._gc = gc
         self._id = dataset_id
         self._frontend_url = frontend_url
+        self._region_cache = region_cache
         self._tiles: dict | None = None
         self._item_id: str | None = None
+        self._item_updated: str | None = None
         self._folder_data: dict | None = None
 
         # Create accessor sub-objects
@@ -86,6 +91,8 @@ class Dataset:
             )
 
         self._item_id = item["_id"]
+        # Versions the cached regions of the image (see RegionCache)
+        self._item_updated = item.get("updated")
 
         # Fetch tiles metadata
         self._tiles = self._gc.get(f"item/{self._item_id}/tiles")
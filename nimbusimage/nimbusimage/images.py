@@ -3,6 +3,8 @@
 from __future__ import annotations
 
 import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Iterator, NamedTuple, Sequence
 
 import numpy as np
@@ -12,6 +14,11 @@ from nimbusimage.models import FrameInfo
 if TYPE_CHECKING:
     from nimbusimage.dataset import Dataset
 
+# Concurrent region requests of get_many and the iter_frames look-ahead.
+# Requests share the client's session, whose connection pool holds 10
+# connections per host.
+_FETCH_WORKERS = 4
+
 
 class LineScanResult(NamedTuple):
     """Intensity profile along a polyline.
@@ -64,7 +71,22 @@ class ImageAccessor:
         return self._frame_map[channel][time][z][xy]
 
     def _get_region(self, frame: int, **kwargs) -> np.ndarray:
-        """Fetch a region as a numpy array via pickle protocol."""
+        """Fetch a region as a numpy array via pickle protocol.
+
+        Served from the dataset's region cache when it has one, unless
+        the image item has no modification time to validate it against.
+        """
+        cache = self._dataset._region_cache
+        key = None
+        if cache is not None and self._dataset._item_updated:
+            key = cache.key(
+                self._dataset._item_id, self._dataset._item_updated,
+                frame, kwargs,
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
         params = {"frame": frame, "encoding": "pickle:5"}
         params.update(kwargs)
         response = self._dataset._gc.get(
@@ -72,7 +94,10 @@ class ImageAccessor:
             parameters=params,
             jsonResp=False,
         )
-        return pickle.loads(response.content)
+        region = pickle.loads(response.content)
+        if key is not None and isinstance(region, np.ndarray):
+            cache.put(key, region)
+        return region
 
     def get(
         self,
@@ -94,26 +119,53 @@ class ImageAccessor:
             2D numpy array.
         """
         frame = self._frame_index(channel, time, z, xy)
-        kwargs = {}
-        if crop is not None:
-            left, top, right, bottom = crop
-            kwargs.update({
-                "left": left, "top": top,
-                "right": right, "bottom": bottom,
-            })
-        img = self._get_region(frame, **kwargs)
+        img = self._get_region(frame, **_crop_params(crop))
         return img.squeeze()
 
+    def get_many(
+        self,
+        coords: Sequence[dict],
+        crop: tuple[float, float, float, float] | None = None,
+        max_workers: int = _FETCH_WORKERS,
+    ) -> list[np.ndarray]:
+        """Get several image frames, fetched concurrently.
+
+        Args:
+            coords: One dict of ``xy``, ``z``, ``time`` and ``channel``
+                per frame, as accepted by :meth:`get` (missing keys
+                default to 0), e.g. ``FrameInfo.to_dict()``.
+            crop: Optional (left, top, right, bottom) crop region,
+                applied to every frame.
+            max_workers: Maximum number of concurrent requests.
+
+        Returns:
+            List of 2D numpy arrays, in the order of ``coords``.
+        """
+        # Resolve every frame first: unknown coordinates fail before any
+        # request is sent
+        frames = [self._frame_index(**coord) for coord in coords]
+        params = _crop_params(crop)
+
+        def fetch(frame: int) -> np.ndarray:
+            return self._get_region(frame, **params).squeeze()
+
+        if max_workers <= 1 or len(frames) <= 1:
+            return [fetch(frame) for frame in frames]
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(frames))
+        ) as pool:
+            return list(pool.map(fetch, frames))
+
     def get_all_channels(
         self, xy: int = 0, z: int = 0, time: int = 0
     ) -> list[np.ndarray]:
         """Get all channels at one location as a list of 2D arrays."""
         self._dataset._ensure_metadata()
         n_ch = self._dataset.num_channels
-        return [
-            self.get(xy=xy, z=z, time=time, channel=ch)
+        return self.get_many([
+            {"xy": xy, "z": z, "time": time, "channel": ch}
             for ch in range(n_ch)
-        ]
+        ])
 
     def get_stack(
         self,
@@ -134,19 +186,19 @@ class ImageAccessor:
         self._dataset._ensure_metadata()
         if axis == "z":
             n = self._dataset.num_z
-            images = [
-                self.get(xy=xy, z=i, time=time, channel=channel)
+            coords = [
+                {"xy": xy, "z": i, "time": time, "channel": channel}
                 for i in range(n)
             ]
         elif axis == "time":
             n = self._dataset.num_time
-            images = [
-                self.get(xy=xy, z=z, time=i, channel=channel)
+            coords = [
+                {"xy": xy, "z": z, "time": i, "channel": channel}
                 for i in range(n)
             ]
         else:
             raise ValueError(f"axis must be 'z' or 'time', got '{axis}'")
-        return np.stack(images, axis=0)
+        return np.stack(self.get_many(coords), axis=0)
 
     def get_composite(
         self,
@@ -172,18 +224,22 @@ class ImageAccessor:
         source_dtype = self._dataset.dtype
         target_dtype = dtype or source_dtype
 
-        layers = self._dataset.collections.layers
+        layers = [
+            layer for layer in self._dataset.collections.layers
+            if layer.get("visible", True)
+        ]
         h, w = self._dataset.shape
         composite = np.zeros((h, w, 3), dtype=np.float64)
 
-        for layer in layers:
-            ch = layer.get("channel", 0)
-            if not layer.get("visible", True):
-                continue
-
-            img = self.get(xy=xy, z=z, time=time, channel=ch).astype(
-                np.float64
-            )
+        images = self.get_many([
+            {
+                "xy": xy, "z": z, "time": time,
+                "channel": layer.get("channel", 0),
+            }
+            for layer in layers
+        ])
+        for layer, img in zip(layers, images):
+            img = img.astype(np.float64)
 
             # Apply contrast — percentile-based blackPoint/whitePoint
             contrast = layer.get("contrast", {})
@@ -352,17 +408,40 @@ class ImageAccessor:
             region.shape[0] / region_height,
         )
 
-    def iter_frames(self) -> Iterator[tuple[FrameInfo, np.ndarray]]:
+    def iter_frames(
+        self, prefetch: int = _FETCH_WORKERS
+    ) -> Iterator[tuple[FrameInfo, np.ndarray]]:
         """Iterate over all frames in the dataset.
 
+        Args:
+            prefetch: Number of frames fetched ahead of the one being
+                processed, concurrently. 0 fetches each frame when it is
+                reached.
+
         Yields:
             (FrameInfo, 2D numpy array) tuples.
         """
-        for fi in self._dataset.frames:
-            img = self.get(
-                xy=fi.xy, z=fi.z, time=fi.time, channel=fi.channel
-            )
-            yield fi, img
+        frames = self._dataset.frames
+        if prefetch < 1:
+            for fi in frames:
+                yield fi, self.get(**fi.to_dict())
+            return
+
+        self._ensure_frame_map()
+        pool = ThreadPoolExecutor(max_workers=prefetch)
+        pending: deque = deque()
+        try:
+            for fi in frames:
+                pending.append((fi, pool.submit(self.get, **fi.to_dict())))
+                if len(pending) > prefetch:
+                    fi, future = pending.popleft()
+                    yield fi, future.result()
+            while pending:
+                fi, future = pending.popleft()
+                yield fi, future.result()
+        finally:
+            # When the caller stops early, drop the queued look-ahead
+            pool.shutdown(cancel_futures=True)
 
     def new_writer(self, copy_metadata: bool = True):
         """Create an ImageWriter for writing processed images.
@@ -379,6 +458,16 @@ class ImageAccessor:
         return ImageWriter(self._dataset, copy_metadata=copy_metadata)
 
 
+def _crop_params(
+    crop: tuple[float, float, float, float] | None,
+) -> dict:
+    """Region parameters of an optional (left, top, right, bottom) crop."""
+    if crop is None:
+        return {}
+    left, top, right, bottom = crop
+    return {"left": left, "top": top, "right": right, "bottom": bottom}
+
+
 def _bilinear_sample(
     region: np.ndarray, x: np.ndarray, y: np.ndarray
 ) -> np.ndarray:
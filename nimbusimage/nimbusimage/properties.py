@@ -4,6 +4,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+from nimbusimage._upload import UPLOAD_WORKERS, post_chunks
 from nimbusimage._workers import PROPERTY_ROLE_LABEL, check_worker_role
 from nimbusimage.jobs import Job
 from nimbusimage.models import Property
@@ -110,17 +111,34 @@ class PropertyAccessor:
         return self._gc.get(url)
 
     def submit_values(
-        self, property_id: str, values: dict[str, dict]
+        self,
+        property_id: str,
+        values: dict[str, dict],
+        chunk_size: int = _BATCH_SIZE,
+        max_workers: int = UPLOAD_WORKERS,
+        retries: int = 2,
     ) -> None:
         """Submit property values in bulk.
 
         Transforms user-friendly format to backend wire format and
-        auto-batches at 10K entries.
+        posts it in chunks of ``chunk_size`` entries, up to
+        ``max_workers`` chunks at a time.
 
         Args:
             property_id: The property these values belong to.
             values: Dict mapping annotation_id to {key: value} dicts.
                 Example: {"ann_1": {"Area": 100}, "ann_2": {"Area": 200}}
+            chunk_size: Number of entries per request.
+            max_workers: Maximum number of concurrent requests.
+            retries: How many times a chunk is posted again after a
+                transient failure (502/503/504 or connection error).
+                Submitting the same values twice is harmless: the server
+                merges them into each annotation's values.
+
+        Raises:
+            ChunkUploadError: If some chunks failed after their retries.
+                Its ``failures`` locate the entries that were not
+                submitted (in the order of ``values``).
         """
         entries = []
         for ann_id, ann_values in values.items():
@@ -130,11 +148,14 @@ class PropertyAccessor:
                 "values": {property_id: ann_values},
             })
 
-        for i in range(0, len(entries), _BATCH_SIZE):
-            batch = entries[i:i + _BATCH_SIZE]
-            self._gc.post(
-                "/annotation_property_values/multiple", json=batch
-            )
+        post_chunks(
+            self._gc,
+            "/annotation_property_values/multiple",
+            entries,
+            chunk_size,
+            max_workers=max_workers,
+            retries=retries,
+        )
 
     def delete_values(self, property_id: str) -> None:
         """Delete all values for a property in this dataset."""
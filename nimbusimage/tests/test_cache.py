@@ -0,0 +1,147 @@
+"""Tests for the on-disk RegionCache and its use by ImageAccessor."""
+
+import os
+import pickle
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from nimbusimage.cache import RegionCache, cache_from_env
+from nimbusimage.dataset import Dataset
+from nimbusimage.images import ImageAccessor
+
+
+def _make_dataset(mock_gc, tiles_meta, cache, updated="2024-01-01"):
+    ds = Dataset.__new__(Dataset)
+    ds._gc = mock_gc
+    ds._id = "folder_001"
+    ds._item_id = "item_001"
+    ds._item_updated = updated
+    ds._tiles = tiles_meta
+    ds._region_cache = cache
+    ds.images = ImageAccessor(ds)
+    return ds
+
+
+def _serve_frames(mock_gc):
+    def get(path, parameters=None, jsonResp=True):
+        response = MagicMock()
+        response.content = pickle.dumps(
+            np.full((1, 3, 4), parameters["frame"], dtype=np.uint16)
+        )
+        return response
+
+    mock_gc.get.side_effect = get
+
+
+def _age(cache, key, seconds):
+    path = os.path.join(cache.directory, key + ".npy")
+    mtime = os.stat(path).st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+class TestRegionCache:
+    def test_roundtrip_is_memory_mapped_copy_on_write(self, tmp_path):
+        cache = RegionCache(str(tmp_path))
+        array = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        key = cache.key("item", "t0", 0, {"left": 1})
+        assert cache.get(key) is None
+
+        cache.put(key, array)
+        cached = cache.get(key)
+        assert isinstance(cached, np.memmap)
+        np.testing.assert_array_equal(cached, array)
+        # Writes stay private to the returned array
+        cached[0, 0] = 99
+        assert cache.get(key)[0, 0] == 0
+
+    def test_key_covers_every_component(self):
+        key = RegionCache.key("item", "t0", 0, {"left": 1, "top": 2})
+        assert key == RegionCache.key("item", "t0", 0, {"top": 2, "left": 1})
+        assert key != RegionCache.key("other", "t0", 0, {"left": 1, "top": 2})
+        assert key != RegionCache.key("item", "t1", 0, {"left": 1, "top": 2})
+        assert key != RegionCache.key("item", "t0", 1, {"left": 1, "top": 2})
+        assert key != RegionCache.key("item", "t0", 0, {"left": 1})
+
+    def test_least_recently_used_are_evicted(self, tmp_path):
+        array = np.zeros(100, dtype=np.uint8)
+        # Room for two 228-byte files (100 bytes and the .npy header)
+        cache = RegionCache(str(tmp_path), max_bytes=500)
+        cache.put("a", array)
+        cache.put("b", array)
+        _age(cache, "a", 20)
+        _age(cache, "b", 10)
+        # Reading "a" makes "b" the least recently used
+        assert cache.get("a") is not None
+        cache.put("c", array)
+        cache.put("d", array)
+
+        assert cache.get("b") is None
+        assert cache.get("d") is not None
+        assert sum(
+            entry.stat().st_size for entry in os.scandir(tmp_path)
+        ) <= 500
+
+    def test_arrays_larger_than_the_budget_are_not_stored(self, tmp_path):
+        cache = RegionCache(str(tmp_path), max_bytes=50)
+        cache.put("a", np.zeros(100, dtype=np.uint8))
+        assert os.listdir(tmp_path) == []
+
+    def test_clear(self, tmp_path):
+        cache = RegionCache(str(tmp_path))
+        cache.put("a", np.zeros(3))
+        cache.clear()
+        assert cache.get("a") is None
+
+    def test_cache_from_env(self, tmp_path):
+        with patch.dict(os.environ, {}, clear=True):
+            assert cache_from_env() is None
+        with patch.dict(os.environ, {
+            "NI_CACHE_DIR": str(tmp_path), "NI_CACHE_MAX_BYTES": "1000",
+        }):
+            cache = cache_from_env()
+        assert cache.directory == str(tmp_path)
+        assert cache.max_bytes == 1000
+
+
+class TestImageAccessorCache:
+    def test_regions_are_fetched_once(
+        self, mock_gc, sample_tiles_metadata, tmp_path
+    ):
+        _serve_frames(mock_gc)
+        cache = RegionCache(str(tmp_path))
+        ds = _make_dataset(mock_gc, sample_tiles_metadata, cache)
+
+        first = ds.images.get(channel=1, crop=(0, 0, 4, 3))
+        second = ds.images.get(channel=1, crop=(0, 0, 4, 3))
+        np.testing.assert_array_equal(first, second)
+        assert second.shape == (3, 4)
+        assert mock_gc.get.call_count == 1
+        # Another region of the frame is fetched
+        ds.images.get(channel=1)
+        assert mock_gc.get.call_count == 2
+
+    def test_modified_image_bypasses_the_cached_regions(
+        self, mock_gc, sample_tiles_metadata, tmp_path
+    ):
+        _serve_frames(mock_gc)
+        cache = RegionCache(str(tmp_path))
+        _make_dataset(mock_gc, sample_tiles_metadata, cache).images.get()
+        ds = _make_dataset(
+            mock_gc, sample_tiles_metadata, cache, updated="2024-02-01"
+        )
+        ds.images.get()
+        assert mock_gc.get.call_count == 2
+
+    def test_image_without_modification_time_is_not_cached(
+        self, mock_gc, sample_tiles_metadata, tmp_path
+    ):
+        _serve_frames(mock_gc)
+        cache = RegionCache(str(tmp_path))
+        ds = _make_dataset(
+            mock_gc, sample_tiles_metadata, cache, updated=None
+        )
+        ds.images.get()
+        ds.images.get()
+        assert mock_gc.get.call_count == 2
+        assert os.listdir(tmp_path) == []
@@ -113,10 +113,23 @@ class TestNimbusClientDataset:
         client._gc = mock_gc
         client._api_url = "http://localhost:8080/api/v1"
         client._frontend_url = "http://localhost:5173"
+        client._region_cache = None
 
         ds = client.dataset("folder_123")
         assert ds.id == "folder_123"
 
+    def test_dataset_shares_the_region_cache(self, mock_gc, tmp_path):
+        with patch("nimbusimage._girder.girder_client.GirderClient"):
+            client = NimbusClient(
+                api_url="http://localhost:8080/api/v1",
+                token="tok123",
+                cache_dir=str(tmp_path),
+                cache_max_bytes=1000,
+            )
+        ds = client.dataset("folder_123")
+        assert ds._region_cache.directory == str(tmp_path)
+        assert ds._region_cache.max_bytes == 1000
+
     def test_dataset_by_name(self, mock_gc):
         mock_gc.get.return_value = [
             {"_id": "folder_123", "name": "My Dataset", "meta": {}},
@@ -125,6 +138,7 @@ class TestNimbusClientDataset:
         client._gc = mock_gc
         client._api_url = "http://localhost:8080/api/v1"
         client._frontend_url = "http://localhost:5173"
+        client._region_cache = None
 
         ds = client.dataset(name="My Dataset")
         assert ds.id == "folder_123"
@@ -135,6 +149,7 @@ class TestNimbusClientDataset:
         client._gc = mock_gc
         client._api_url = "http://localhost:8080/api/v1"
         client._frontend_url = "http://localhost:5173"
+        client._region_cache = None
 
         with pytest.raises(ValueError, match="not found"):
             client.dataset(name="Nonexistent")
@@ -1,9 +1,11 @@
 """Tests for ImageAccessor."""
 
 import pickle
+import threading
 from unittest.mock import MagicMock
 
 import numpy as np
+import pytest
 from nimbusimage.images import ImageAccessor, _parse_color
 from nimbusimage.models import FrameInfo
 
@@ -15,6 +17,8 @@ def _make_dataset(mock_gc, tiles_meta):
     ds._gc = mock_gc
     ds._id = "folder_001"
     ds._item_id = "item_001"
+    ds._item_updated = "2024-01-01T00:00:00+00:00"
+    ds._region_cache = None
     ds._tiles = tiles_meta
     ds._folder_data = {"_id": "folder_001", "name": "Test"}
     ds.images = ImageAccessor(ds)
@@ -452,3 +456,76 @@ class TestImageWriterGuard:
         writer.__exit__(None, None, None)
         # write() should not be called on the sink since _written is True
         writer._sink.write.assert_not_called()
+
+
+def _mock_frame_region_endpoint(mock_gc, delays=None):
+    """Serve each frame as a 2x2 array filled with its frame index, after
+    an optional per-frame delay. Returns the list of requested frames."""
+    requested = []
+
+    def get(path, parameters=None, jsonResp=True):
+        frame = parameters["frame"]
+        requested.append(frame)
+        threading.Event().wait((delays or {}).get(frame, 0))
+        response = MagicMock()
+        response.content = pickle.dumps(
+            np.full((1, 2, 2), frame, dtype=np.uint16)
+        )
+        return response
+
+    mock_gc.get.side_effect = get
+    return requested
+
+
+class TestConcurrentFetch:
+    def test_get_many_keeps_input_order(
+        self, mock_gc, sample_tiles_metadata
+    ):
+        # The first frames answer last
+        _mock_frame_region_endpoint(mock_gc, {0: 0.05, 1: 0.02})
+        ds = _make_dataset(mock_gc, sample_tiles_metadata)
+        coords = [
+            {"channel": 0}, {"channel": 1}, {"z": 1}, {"z": 1, "channel": 1},
+        ]
+        result = ds.images.get_many(coords, crop=(0, 0, 2, 2))
+
+        assert [int(img[0, 0]) for img in result] == [0, 1, 2, 3]
+        assert all(img.shape == (2, 2) for img in result)
+        params = mock_gc.get.call_args[1]["parameters"]
+        assert params["right"] == 2
+
+    def test_get_many_rejects_unknown_coordinates_before_fetching(
+        self, mock_gc, sample_tiles_metadata
+    ):
+        _mock_frame_region_endpoint(mock_gc)
+        ds = _make_dataset(mock_gc, sample_tiles_metadata)
+        with pytest.raises(KeyError):
+            ds.images.get_many([{"channel": 0}, {"channel": 5}])
+        mock_gc.get.assert_not_called()
+
+    def test_iter_frames_prefetch(self, mock_gc, sample_tiles_metadata):
+        requested = _mock_frame_region_endpoint(mock_gc)
+        ds = _make_dataset(mock_gc, sample_tiles_metadata)
+        frames = ds.images.iter_frames(prefetch=2)
+
+        fi, img = next(frames)
+        assert (fi.index, int(img[0, 0])) == (0, 0)
+        # The next two frames are requested in the background, not more
+        for _ in range(100):
+            if len(requested) == 3:
+                break
+            threading.Event().wait(0.01)
+        assert sorted(requested) == [0, 1, 2]
+        assert [
+            (fi.index, int(img[0, 0])) for fi, img in frames
+        ] == [(1, 1), (2, 2), (3, 3)]
+
+    def test_iter_frames_without_prefetch(
+        self, mock_gc, sample_tiles_metadata
+    ):
+        requested = _mock_frame_region_endpoint(mock_gc)
+        ds = _make_dataset(mock_gc, sample_tiles_metadata)
+        frames = ds.images.iter_frames(prefetch=0)
+
+        next(frames)
+        assert requested == [0]
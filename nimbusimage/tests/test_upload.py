@@ -0,0 +1,143 @@
+"""Tests for the chunked, concurrent bulk POSTs of create_many and
+submit_values."""
+
+import threading
+from unittest.mock import patch
+
+import girder_client
+import pytest
+import requests
+
+from nimbusimage import ChunkUploadError
+from nimbusimage._upload import post_chunks
+from nimbusimage.annotations import AnnotationAccessor
+from nimbusimage.models import Annotation, Location
+from nimbusimage.properties import PropertyAccessor
+
+
+def _http_error(status):
+    return girder_client.HttpError(status, "error", "url", "POST")
+
+
+def _echo(path, json, parameters=None):
+    return [{"item": item} for item in json]
+
+
+class TestPostChunks:
+    def test_results_are_merged_in_input_order(self, mock_gc):
+        release = threading.Event()
+
+        def post(path, json, parameters=None):
+            # The first chunk answers last
+            if json[0] == 0:
+                release.wait(5)
+            elif json[0] == 6:
+                release.set()
+            return _echo(path, json)
+
+        mock_gc.post.side_effect = post
+        results = post_chunks(
+            mock_gc, "/bulk", list(range(8)), 2, max_workers=4,
+            parse=lambda data: [d["item"] for d in data],
+        )
+        assert results == list(range(8))
+        assert mock_gc.post.call_count == 4
+
+    def test_concurrency_is_bounded(self, mock_gc):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def post(path, json, parameters=None):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            threading.Event().wait(0.01)
+            with lock:
+                active[0] -= 1
+
+        mock_gc.post.side_effect = post
+        post_chunks(mock_gc, "/bulk", list(range(20)), 1, max_workers=3)
+        assert mock_gc.post.call_count == 20
+        assert active[1] <= 3
+
+    def test_partial_failure_reports_the_failed_chunks(self, mock_gc):
+        def post(path, json, parameters=None):
+            if json[0] == 2:
+                raise _http_error(400)
+            return _echo(path, json)
+
+        mock_gc.post.side_effect = post
+        with pytest.raises(ChunkUploadError) as info:
+            post_chunks(
+                mock_gc, "/bulk", list(range(5)), 2,
+                parse=lambda data: [d["item"] for d in data],
+            )
+        assert info.value.results == [0, 1, 4]
+        assert info.value.committed == [(0, 2), (4, 5)]
+        [(start, stop, exc)] = info.value.failures
+        assert (start, stop) == (2, 4)
+        assert exc.status == 400
+
+    def test_total_failure_raises_the_original_error(self, mock_gc):
+        mock_gc.post.side_effect = _http_error(400)
+        with pytest.raises(girder_client.HttpError):
+            post_chunks(mock_gc, "/bulk", list(range(4)), 2)
+
+    @patch("nimbusimage._upload.time.sleep")
+    def test_transient_failures_are_retried(self, sleep, mock_gc):
+        mock_gc.post.side_effect = [
+            _http_error(503), requests.ConnectionError(), [{"item": 1}],
+        ]
+        results = post_chunks(
+            mock_gc, "/bulk", [1], 10, retries=2,
+            parse=lambda data: [d["item"] for d in data],
+        )
+        assert results == [1]
+        assert mock_gc.post.call_count == 3
+
+    @patch("nimbusimage._upload.time.sleep")
+    def test_client_errors_are_not_retried(self, sleep, mock_gc):
+        mock_gc.post.side_effect = _http_error(400)
+        with pytest.raises(girder_client.HttpError):
+            post_chunks(mock_gc, "/bulk", [1], 10, retries=2)
+        mock_gc.post.assert_called_once()
+
+    def test_no_items_posts_nothing(self, mock_gc):
+        assert post_chunks(mock_gc, "/bulk", [], 10) == []
+        mock_gc.post.assert_not_called()
+
+    def test_chunk_size_must_be_positive(self, mock_gc):
+        with pytest.raises(ValueError):
+            post_chunks(mock_gc, "/bulk", [1], 0)
+
+
+class TestAccessors:
+    def test_create_many_in_chunks(self, mock_gc, sample_annotation_dict):
+        mock_gc.post.side_effect = lambda path, json, parameters: [
+            {**sample_annotation_dict, "_id": f"ann_{d['tags'][0]}"}
+            for d in json
+        ]
+        accessor = AnnotationAccessor(mock_gc, "ds_001")
+        annotations = [
+            Annotation(
+                id=None, shape="point", tags=[str(i)], channel=0,
+                location=Location(), coordinates=[], dataset_id="ds_001",
+            )
+            for i in range(7)
+        ]
+        created = accessor.create_many(annotations, chunk_size=3)
+        assert [a.id for a in created] == [f"ann_{i}" for i in range(7)]
+        assert mock_gc.post.call_count == 3
+        # One history entry, so one undo, for the whole upload
+        groups = {
+            call.kwargs["parameters"]["historyGroup"]
+            for call in mock_gc.post.call_args_list
+        }
+        assert len(groups) == 1
+
+    @patch("nimbusimage._upload.time.sleep")
+    def test_submit_values_retries_chunks(self, sleep, mock_gc):
+        mock_gc.post.side_effect = [_http_error(502), None]
+        accessor = PropertyAccessor(mock_gc, "ds_001")
+        accessor.submit_values("prop_001", {"ann_a": {"Area": 1}})
+        assert mock_gc.post.call_count == 2
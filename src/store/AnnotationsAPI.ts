@@ -129,6 +129,7 @@ export default class AnnotationsAPI {
       total: response.data.total,
       rows: (response.data.rows as any[]).map(this.toListRow),
       offset: response.data.offset,
+      nextCursor: response.data.nextCursor,
     };
   }
 
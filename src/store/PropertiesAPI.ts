@@ -72,6 +72,24 @@ export default class PropertiesAPI {
       .then((res) => res.data);
   }
 
+  // Histograms of several property paths, keyed by their dot-joined path.
+  // The server computes the ones it has no stored histogram for in a
+  // single pass over the dataset.
+  async getPropertyHistograms(
+    datasetId: string,
+    propertyPaths: string[][],
+    buckets: number = 255,
+  ): Promise<{ [joinedPropertyPath: string]: TPropertyHistogram }> {
+    if (propertyPaths.length === 0) {
+      return {};
+    }
+    const response = await this.client.post(
+      "annotation_property_values/histograms",
+      { datasetId, propertyPaths, buckets },
+    );
+    return response.data;
+  }
+
   // Per-property count of annotations matching the property's compute
   // criteria (shape + tags) that have no computed value yet. The server
   // returns counts only, so this scales to large datasets without
@@ -542,16 +542,12 @@ export class Filters extends VuexModule {
       this.setPropertyHistograms({});
       return;
     }
-    const histograms: TFilterHistograms = {};
-    const promises = this.filterPaths.map((path: string[]) =>
-      properties.propertiesAPI
-        .getPropertyHistogram(dataset.id, path)
-        .then((histogram: TPropertyHistogram) => {
-          const key = createPathStringFromPathArray(path);
-          histograms[key] = histogram;
-        }),
-    );
-    Promise.all(promises).then(() => this.setPropertyHistograms(histograms));
+    // One request for every filtered path instead of one per path
+    properties.propertiesAPI
+      .getPropertyHistograms(dataset.id, this.filterPaths)
+      .then((histograms: TFilterHistograms) =>
+        this.setPropertyHistograms(histograms),
+      );
   }
 }
 
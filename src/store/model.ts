@@ -1623,6 +1623,10 @@ export interface IAnnotationListQuery {
   // this annotation under the same filters and sort. `offset` in the response
   // is null when the annotation is not part of the filtered result.
   anchorId?: string;
+  // The nextCursor of the previous page, under the same filters and sort.
+  // When supplied, the server ignores `offset` and returns the following
+  // page without skipping over the earlier rows.
+  cursor?: string;
 }
 
 // A server list row: stub fields + the requested property values.
@@ -1635,6 +1639,8 @@ export interface IAnnotationListPage {
   total: number;
   rows: IAnnotationListRow[];
   offset?: number | null;
+  // Resumes the list after this page; null on the last page.
+  nextCursor?: string | null;
 }
 
 export type THydrationMode = "shapes" | "dots";